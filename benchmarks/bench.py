@@ -0,0 +1,321 @@
+"""
+rate_limit benchmark suite
+
+measures, separately:
+
+- parse: Rule parsing
+- evaluate: And/Or rule tree evaluation, with a predicate that
+  returns immediately
+- selectors: Limit.get_relevant_selectors
+- decision: full Limit.cm decisions against a local redis-server, over
+  a matrix of rule tree shape, selector cardinality, concurrency and
+  disable_locks
+- shared: full decisions against a SharedMemoryRateLimit, no redis,
+  through Limit's coroutines ("coroutine") and SharedMemoryRateLimit.check
+  ("sync")
+- startup: import time and peak memory of a fresh interpreter importing
+  the core (rules and plans) or the full RateLimit
+
+every result is printed as a JSON line, with operations per second,
+p50/p99 latency (seconds) and, for decisions, Redis round trips per
+decision (a pipeline is one round trip), so runs can be compared to catch
+regressions.
+
+usage: python benchmarks/bench.py [--no-redis] [--iterations N]
+"""
+from __future__ import print_function, division
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from rate_limit import RateLimit, RateLimitExceeded, And, Or  # noqa
+from rate_limit.limit import Limit  # noqa
+from rate_limit.metrics import Metrics  # noqa
+from rate_limit.rule import Rule  # noqa
+from rate_limit.shared import SharedMemoryRateLimit, SharedMemoryTable  # noqa
+from tornado.gen import coroutine, Return  # noqa
+from tornado.ioloop import IOLoop  # noqa
+from timeit import default_timer  # noqa
+import argparse  # noqa
+import subprocess  # noqa
+import resource  # noqa
+import itertools  # noqa
+import json  # noqa
+import random  # noqa
+import string  # noqa
+
+SHAPES = {
+    "single": 'user:100/s',
+    "or": Or('user:100/s', '1000/m'),
+    "nested": And(
+        'user:100/s',
+        Or('ip:50/s', And('1000/m', 'user:5000/h'))
+    ),
+}
+
+CARDINALITIES = (1, 1000)
+CONCURRENCIES = (1, 16)
+DISABLE_LOCKS = (False, True)
+
+
+def percentile(latencies, fraction):
+    """
+    returns the fraction percentile of sorted latencies
+    """
+
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+def summarize(name, latencies, elapsed, **params):
+    latencies = sorted(latencies)
+
+    res = {
+        "benchmark": name,
+        "ops_per_second": len(latencies) / elapsed,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+    }
+    res.update(params)
+
+    return res
+
+
+def measure(name, func, iterations, **params):
+    """
+    runs func iterations times, timing every run
+    """
+
+    latencies = []
+    start = default_timer()
+
+    for _ in range(iterations):
+        before = default_timer()
+        func()
+        latencies.append(default_timer() - before)
+
+    return summarize(name, latencies, default_timer() - start, **params)
+
+
+def bench_parse(iterations):
+    rules = ['100/s', 'user:100/s', 'apikey:10MB/m', 'ip:5000/24h']
+
+    for rule in rules:
+        yield measure("parse", lambda: Rule(rule), iterations, rule=rule)
+
+
+def bench_evaluate(iterations):
+    @coroutine
+    def predicate(rule):
+        raise Return(False)
+
+    @coroutine
+    def evaluate(rules):
+        latencies = []
+        start = default_timer()
+
+        for _ in range(iterations):
+            before = default_timer()
+            yield rules.run(predicate)
+            latencies.append(default_timer() - before)
+
+        raise Return((latencies, default_timer() - start))
+
+    for shape, rules in SHAPES.items():
+        if not isinstance(rules, (And, Or)):
+            continue
+
+        latencies, elapsed = IOLoop.current().run_sync(
+            lambda: evaluate(rules)
+        )
+
+        yield summarize("evaluate", latencies, elapsed, shape=shape)
+
+
+def bench_selectors(iterations):
+    for shape, rules in SHAPES.items():
+        limit = Limit(None, rules, key="bench", user="vova", ip="8.8.8.8")
+
+        yield measure(
+            "selectors", limit.get_relevant_selectors, iterations,
+            shape=shape
+        )
+
+
+def random_string():
+    return ''.join(random.choice(string.ascii_lowercase) for _ in range(8))
+
+
+@coroutine
+def run_decisions(rl, rules, cardinality, concurrency, iterations):
+    """
+    runs iterations decisions, concurrency at a time, returns their latencies
+    """
+
+    users = [random_string() for _ in range(cardinality)]
+    latencies = []
+
+    rl.limit(rules, key="bench")
+
+    @coroutine
+    def worker(count):
+        for _ in range(count):
+            user = random.choice(users)
+            before = default_timer()
+
+            try:
+                limit = rl.limit(key="bench", user=user, ip=user)
+
+                with (yield limit.cm()):
+                    pass
+            except RateLimitExceeded:
+                pass
+
+            latencies.append(default_timer() - before)
+
+    yield [worker(iterations // concurrency) for _ in range(concurrency)]
+
+    raise Return(latencies)
+
+
+def bench_decisions(iterations):
+    import tornadoredis
+
+    redis_conn = tornadoredis.Client()
+    redis_conn.connect()
+    io_loop = IOLoop.current()
+
+    matrix = itertools.product(
+        sorted(SHAPES), CARDINALITIES, CONCURRENCIES, DISABLE_LOCKS
+    )
+
+    for shape, cardinality, concurrency, disable_locks in matrix:
+        metrics = Metrics()
+        rl = RateLimit(
+            redis_conn,
+            namespace="bench:" + random_string(),
+            disable_locks=disable_locks,
+            lock_polling_interval=0.001,
+            metrics=metrics
+        )
+
+        start = default_timer()
+        latencies = io_loop.run_sync(lambda: run_decisions(
+            rl, SHAPES[shape], cardinality, concurrency, iterations
+        ))
+        res = summarize(
+            "decision", latencies, default_timer() - start,
+            shape=shape, cardinality=cardinality, concurrency=concurrency,
+            disable_locks=disable_locks
+        )
+        res["redis_round_trips_per_decision"] = (
+            metrics.get_counter("redis_round_trips_total") / len(latencies)
+        )
+
+        yield res
+
+
+def bench_shared(iterations):
+    io_loop = IOLoop.current()
+
+    for shape, cardinality in itertools.product(sorted(SHAPES),
+                                                CARDINALITIES):
+        rl = SharedMemoryRateLimit(
+            SharedMemoryTable(sets=1024, ways=2, capacity=5000)
+        )
+
+        start = default_timer()
+        latencies = io_loop.run_sync(lambda: run_decisions(
+            rl, SHAPES[shape], cardinality, 1, iterations
+        ))
+
+        yield summarize(
+            "shared", latencies, default_timer() - start,
+            shape=shape, cardinality=cardinality, api="coroutine"
+        )
+
+        rl = SharedMemoryRateLimit(
+            SharedMemoryTable(sets=1024, ways=2, capacity=5000)
+        )
+        rl.limit(SHAPES[shape], key="bench")
+        users = itertools.cycle([
+            random_string() for _ in range(cardinality)
+        ])
+
+        def check():
+            user = next(users)
+            rl.check("bench", user=user, ip=user)
+
+        yield measure(
+            "shared", check, iterations,
+            shape=shape, cardinality=cardinality, api="sync"
+        )
+
+
+STARTUP_TARGETS = {
+    "core": (
+        "from rate_limit import And, Or\n"
+        "from rate_limit.plan import Plan\n"
+        "Plan(And('user:100/s', Or('ip:50/s', '1000/m')))\n"
+    ),
+    "full": "from rate_limit import RateLimit\n",
+}
+
+STARTUP_SCRIPT = (
+    "import sys\n"
+    "sys.path.insert(0, %r)\n"
+    "%s"
+    "print('tornado' in sys.modules)\n"
+)
+
+
+def bench_startup(iterations):
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+    for target, code in sorted(STARTUP_TARGETS.items()):
+        script = STARTUP_SCRIPT % (root, code)
+        latencies = []
+        rss = 0
+
+        for _ in range(iterations):
+            before = default_timer()
+            output = subprocess.check_output([sys.executable, "-c", script])
+            latencies.append(default_timer() - before)
+
+            # children's peak RSS, the largest child so far
+            rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+        res = summarize("startup", latencies, sum(latencies), target=target)
+        res["max_rss_kb"] = rss
+        res["tornado_loaded"] = output.strip() == b"True"
+
+        yield res
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--iterations", type=int, default=10000)
+    parser.add_argument("--decisions", type=int, default=2000)
+    parser.add_argument("--startups", type=int, default=10)
+    parser.add_argument("--no-redis", action="store_true",
+                        help="skip the benchmarks that need a redis-server")
+    args = parser.parse_args()
+
+    benchmarks = [
+        bench_parse(args.iterations),
+        bench_evaluate(args.iterations),
+        bench_selectors(args.iterations),
+        bench_shared(args.decisions),
+        bench_startup(args.startups),
+    ]
+
+    if not args.no_redis:
+        benchmarks.append(bench_decisions(args.decisions))
+
+    for result in itertools.chain(*benchmarks):
+        print(json.dumps(result, sort_keys=True))
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,48 @@
+"""
+the core, rule parsing (rate_limit.rule), the grammar (And, Or) and
+compiled plans (rate_limit.plan), has no dependencies. the frontends
+below need tornado (and tornadoredis for Redis), and are imported on
+first access.
+"""
 from __future__ import absolute_import, division
 
-from .client import RateLimit
-from .limit import RateLimitExceeded
 from .grammer import And, Or
+from types import ModuleType
+import importlib
+import sys
 
 __version__ = '0.1'
+
+_LAZY = {
+    "RateLimit": ".client",
+    "CompactRateLimit": ".compact",
+    "HashedIdentifiers": ".identifiers",
+    "migrate_identifiers": ".identifiers",
+    "RateLimitExceeded": ".limit",
+}
+
+__all__ = ["And", "Or"] + sorted(_LAZY)
+
+
+class _LazyModule(ModuleType):
+    """
+    the package module, importing the frontends on first access
+    """
+
+    def __getattr__(self, name):
+        if name not in _LAZY:
+            raise AttributeError(name)
+
+        value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+        setattr(self, name, value)
+
+        return value
+
+
+_module = _LazyModule(__name__, __doc__)
+_module.__dict__.update(
+    (key, value) for key, value in globals().items() if key != "_module"
+)
+# python 2 clears the globals of a collected module, keep this one alive
+_module._original = sys.modules[__name__]
+sys.modules[__name__] = _module
@@ -0,0 +1,171 @@
+from __future__ import division
+import copy
+
+# feeds a window of observations (ARGV[3..5]: count, errors, latency sum)
+# to the state hash of an adaptive rule, and once its window is ARGV[2]
+# seconds old, adjusts the limit by AIMD and starts a new window. returns
+# the current limit. the window is shared by all the processes reporting
+# to it, so the limit moves once per window no matter how many report.
+ADJUST_SCRIPT = """
+local now = tonumber(ARGV[1])
+local state = redis.call('HMGET', KEYS[1], 'limit', 'start', 'count',
+                         'errors', 'latency')
+local limit = tonumber(state[1]) or tonumber(ARGV[7])
+local start = tonumber(state[2]) or now
+local count = (tonumber(state[3]) or 0) + tonumber(ARGV[3])
+local errors = (tonumber(state[4]) or 0) + tonumber(ARGV[4])
+local latency = (tonumber(state[5]) or 0) + tonumber(ARGV[5])
+
+if now - start >= tonumber(ARGV[2]) and count > 0 then
+    if latency / count > tonumber(ARGV[8]) or
+            errors / count > tonumber(ARGV[9]) then
+        limit = math.max(tonumber(ARGV[6]),
+                         math.floor(limit * tonumber(ARGV[11])))
+    else
+        limit = math.min(tonumber(ARGV[7]), limit + tonumber(ARGV[10]))
+    end
+
+    start, count, errors, latency = now, 0, 0, 0
+end
+
+redis.call('HMSET', KEYS[1], 'limit', limit, 'start', start, 'count', count,
+           'errors', errors, 'latency', latency)
+redis.call('EXPIRE', KEYS[1], ARGV[12])
+
+return limit
+"""
+
+
+def get_adaptive_rule(rule, allowed_requests):
+    """
+    returns a copy of an adaptive rule, allowing allowed_requests
+    """
+
+    res = copy.copy(rule)
+    res.allowed_requests = allowed_requests
+
+    return res
+
+
+class AIMD(object):
+    """
+    adjusts the limits of adaptive rules (e.g '20-200/s') by additive
+    increase, multiplicative decrease: every interval seconds, if the
+    average latency of the guarded requests was over latency_target or
+    more than error_threshold of them raised, the limit is multiplied by
+    decrease, otherwise increase is added to it, within the rule's range.
+
+    every process measures the requests it guards, and once an interval
+    reports them to the shared state and reads the current limit back,
+    in a single round trip.
+    """
+
+    def __init__(self, latency_target=0.5, error_threshold=0.05,
+                 increase=None, decrease=0.5, interval=1, ttl=3600):
+        """
+        Args:
+            latency_target: the highest healthy average latency,
+                in seconds. (Default: 0.5)
+            error_threshold: the highest healthy fraction of requests
+                raising an exception. (Default: 0.05)
+            increase: requests added to a healthy limit, by default
+                a twentieth of the rule's range, at least 1.
+            decrease: the factor an unhealthy limit is multiplied by.
+                (Default: 0.5)
+            interval: seconds between adjustments, and between reports
+                of each process. (Default: 1)
+            ttl: seconds the shared state of an idle rule is kept.
+                (Default: 3600)
+        """
+
+        self.latency_target = latency_target
+        self.error_threshold = error_threshold
+        self.increase = increase
+        self.decrease = decrease
+        self.interval = interval
+        self.ttl = ttl
+
+        self.limits = {}
+        self.stats = {}
+
+    def get_increase(self, rule):
+        if self.increase is not None:
+            return self.increase
+
+        return max(1, (rule.max_requests - rule.min_requests) // 20)
+
+    def get_limit(self, name, now):
+        """
+        returns the limit of name read less than interval seconds ago,
+        or None if it's due for a report.
+        """
+
+        if name in self.limits:
+            limit, read_at = self.limits[name]
+
+            if now - read_at < self.interval:
+                return limit
+
+        return None
+
+    def set_limit(self, name, limit, now):
+        self.limits[name] = (limit, now)
+
+    def observe(self, name, latency, error):
+        """
+        records a guarded request of name
+        """
+
+        stats = self.stats.setdefault(name, [0, 0, 0])
+        stats[0] += 1
+        stats[1] += bool(error)
+        stats[2] += latency
+
+    def flush(self, name):
+        """
+        returns the (count, errors, latency sum) recorded for name since
+        the last flush, and resets them.
+        """
+
+        return tuple(self.stats.pop(name, (0, 0, 0)))
+
+    def get_script_args(self, rule, stats, now):
+        """
+        returns the ARGV of ADJUST_SCRIPT
+        """
+
+        count, errors, latency = stats
+
+        return [
+            repr(now), self.interval, count, errors, repr(latency),
+            rule.min_requests, rule.max_requests, self.latency_target,
+            self.error_threshold, self.get_increase(rule), self.decrease,
+            self.ttl
+        ]
+
+    def adjust(self, state, rule, stats, now):
+        """
+        same as ADJUST_SCRIPT, on a state dict, for in process backends
+        """
+
+        state.setdefault("limit", rule.max_requests)
+        state.setdefault("start", now)
+
+        for field, value in zip(("count", "errors", "latency"), stats):
+            state[field] = state.get(field, 0) + value
+
+        if now - state["start"] >= self.interval and state["count"] > 0:
+            if (state["latency"] / state["count"] > self.latency_target or
+                    state["errors"] / state["count"] > self.error_threshold):
+                state["limit"] = max(
+                    rule.min_requests, int(state["limit"] * self.decrease)
+                )
+            else:
+                state["limit"] = min(
+                    rule.max_requests,
+                    state["limit"] + self.get_increase(rule)
+                )
+
+            state.update(start=now, count=0, errors=0, latency=0)
+
+        return state["limit"]
@@ -0,0 +1,535 @@
+from __future__ import absolute_import
+from __future__ import division
+from .cluster import unescape_tag
+from .plan import Plan
+from .rule import Rule
+from .sketch import CountMinSketch
+from .utils import join_non_empty
+from tornado.gen import coroutine, Task, Return
+from tornadoredis.exceptions import RedisError
+import heapq
+import math
+
+# the rough size of Redis structures on a 64 bit build, used to project
+# memory before there's data to scan, compare with the bytes per key the
+# analyzer reports for a live namespace:
+#
+# KEY_OVERHEAD: the keyspace entry, the key object and its expiration
+# LIST_OVERHEAD: the quicklist, its first node and the base timestamp (a 64
+# bit integer), LIST_ENTRY: a delta in a listpack (a 32 bit integer, its
+# encoding and back length)
+# STRING_OVERHEAD: the value object and sds header of a compact log
+# ZSET_ENTRY: a lease or a weighted entry in a small sorted set
+# HASH_FIELD: a sketch counter in a hash table encoded hash
+KEY_OVERHEAD = 80
+LIST_OVERHEAD = 74
+LIST_ENTRY = 6
+STRING_OVERHEAD = 16
+ZSET_ENTRY = 48
+HASH_FIELD = 64
+
+# identifiers of the keys RateLimit stores besides requests lists, by the
+# prefix they start with, see get_cost_identifier, get_concurrency_identifier
+# get_sketch_identifier, MultiRegionRateLimit and ADJUST_SCRIPT.
+KINDS = (
+    ("cost:", "cost"),
+    ("conc:", "concurrency"),
+    ("cms:", "sketch"),
+    ("crdt:", "crdt"),
+    ("aimd:", "adaptive"),
+)
+
+# the command returning the length of a key, by its type
+LENGTH_COMMANDS = {
+    "list": "llen",
+    "zset": "zcard",
+    "hash": "hlen",
+    "set": "scard",
+    "string": "strlen",
+}
+
+
+def get_length_bucket(length):
+    """
+    returns the power of 2 bounding length, the list length histogram
+    counts lists per bucket.
+    """
+
+    return 1 << max(0, int(length) - 1).bit_length() if length else 0
+
+
+class Usage(object):
+    """
+    the keys and bytes of a group of keys
+    """
+
+    def __init__(self):
+        self.keys = 0
+        self.bytes = 0
+
+    def add(self, size):
+        self.keys += 1
+        self.bytes += size
+
+    def describe(self):
+        return {
+            "keys": self.keys,
+            "bytes": self.bytes,
+            "bytes_per_key": self.bytes // self.keys if self.keys else 0,
+        }
+
+
+class KeyspaceAnalyzer(object):
+    """
+    reports the memory a RateLimit takes in Redis: scans its namespace
+    count keys at a time, and fetches the type, MEMORY USAGE and TTL
+    of each batch, then their lengths, in two pipelines.
+
+    each key is parsed back to the key, selector and rule it was stored
+    for, by the identifiers RateLimit.add_namespace and
+    Limit.create_identifier build, and added up per key, per selector,
+    per rule (or rules, for a list shared by several rules) and per kind
+    of key. requests lists get a length histogram, and lists holding
+    more requests than their rules need, or kept longer than their
+    longest span, are reported as over retained.
+
+    keys are only added up, never kept, apart from the top largest keys
+    and over retained examples, so memory is bounded no matter how big
+    the namespace is. pass on_key to stream every key elsewhere.
+
+    the keys of rules defined with RateLimit.limit(rules, key=...) or
+    set_rules are attributed to their rules, other keys (e.g decorators
+    limiting by function name) only to their key.
+    """
+
+    def __init__(self, rate_limit, count=1000, top=20, max_groups=1000,
+                 on_key=None):
+        """
+        Args:
+            rate_limit: the RateLimit whose namespace is analyzed
+            count: the SCAN batch size (Default: 1000)
+            top: how many of the largest keys and over retained lists to
+                keep as examples (Default: 20)
+            max_groups: the most keys and selectors added up separately,
+                the others are added up under "<other>" (Default: 1000)
+            on_key: a callable called with the description of every key
+                scanned, a dict. (Default: None)
+        """
+
+        if rate_limit.identifiers is not None:
+            raise RuntimeError("Can't analyze hashed identifiers")
+
+        self.rate_limit = rate_limit
+        self.count = count
+        self.top = top
+        self.max_groups = max_groups
+        self.on_key = on_key
+
+        namespace = rate_limit.namespace
+        self.prefix = namespace + ":" if namespace else ""
+        self.match = self.prefix + "*"
+        self.cursor = 0
+        self.done = False
+
+        self.total = Usage()
+        self.kinds = {}
+        self.keys = {}
+        self.selectors = {}
+        self.rules = {}
+        self.lengths = {}
+        self.largest = []
+        self.over_retained = []
+        self.over_retained_keys = 0
+
+    def get_group(self, groups, name):
+        if name not in groups and len(groups) >= self.max_groups:
+            name = "<other>"
+
+        return groups.setdefault(name, Usage())
+
+    def parse(self, identifier):
+        """
+        returns the (kind, key, selector, rules) an identifier (without
+        the namespace) was stored for, rules is a list of rule strings,
+        empty if they aren't known.
+        """
+
+        kind = "list"
+
+        # hash tags (see rate_limit.cluster) only pick the slot
+        identifier = identifier.replace("{", "").replace("}", "")
+
+        if getattr(self.rate_limit, "hash_tags", None) is not None:
+            identifier = unescape_tag(identifier)
+
+        for prefix, name in KINDS:
+            if identifier.startswith(prefix):
+                kind = name
+                identifier = identifier[len(prefix):]
+                break
+
+        # the longest defined key the identifier starts with
+        defined = sorted((
+            key for key, plan in self.rate_limit._plans.items()
+            if plan is not None
+        ), key=len, reverse=True)
+        key = next((
+            key for key in defined if key and (
+                identifier == key or identifier.startswith(key + ":") or
+                identifier.startswith(key + "#")
+            )
+        ), None)
+
+        if key is None:
+            return kind, identifier.split(":")[0].split("#")[0], None, []
+
+        plan = self.rate_limit.get_plan(key)
+        rest = identifier[len(key) + 1:]
+
+        if kind == "sketch":
+            # cms:key:selector:rate, followed by the window
+            rule = Rule(rest.rsplit(":", 1)[0])
+            return kind, key, rule.selector, [rest.rsplit(":", 1)[0]]
+
+        selector = rest.split(":")[0] if rest else None
+        selectors = set(rule.selector for rule in plan.rules.values())
+
+        if selector not in selectors:
+            selector = None
+
+        if kind == "list":
+            suffix = "#" + identifier.rsplit("#", 1)[-1]
+
+            if not suffix[1:].isdigit():
+                suffix = ""
+
+            layout = next((
+                layout for layout in plan.layouts.get(selector, ())
+                if layout.suffix == suffix
+            ), None)
+            rules = layout.rules if layout is not None else []
+        else:
+            rules = [
+                rule for rule in plan.rules.values()
+                if rule.selector == selector and (
+                    (kind == "cost" and rule.unit is not None) or
+                    (kind == "concurrency" and
+                     rule.concurrency is not None)
+                )
+            ]
+
+        return kind, key, selector, sorted(
+            join_non_empty(":", rule.selector, rule.rate) for rule in rules
+        )
+
+    def check_retention(self, kind, rules, length, ttl):
+        """
+        returns why a requests list is kept longer than its rules need,
+        or None if it isn't.
+        """
+
+        if kind != "list" or not rules:
+            return None
+
+        compiled = [Rule(rule) for rule in rules]
+
+        if ttl is None or ttl == -1:
+            return "no expiration"
+
+        if ttl > math.ceil(max(rule.requests_span for rule in compiled)):
+            return "expires after the longest span"
+
+        allowed = max(rule.allowed_requests for rule in compiled)
+
+        if length is not None and length > allowed:
+            return "longer than the allowed requests"
+
+        return None
+
+    def add(self, name, key_type, size, ttl, length):
+        """
+        adds up a scanned key
+        """
+
+        identifier = name[len(self.prefix):]
+        kind, key, selector, rules = self.parse(identifier)
+
+        if kind == "list" and key_type == "string":
+            kind = "compact"
+
+        size = size or 0
+        self.total.add(size)
+        self.get_group(self.kinds, kind).add(size)
+        self.get_group(self.keys, key).add(size)
+        self.get_group(
+            self.selectors, join_non_empty(":", key, selector)
+        ).add(size)
+
+        if rules:
+            self.get_group(
+                self.rules, join_non_empty(":", key, ",".join(rules))
+            ).add(size)
+
+        if kind in ("list", "compact") and length is not None:
+            if kind == "compact":
+                # the slots after the 16 bytes header, see compact.py
+                length = max(0, length - 16) // 4
+            else:
+                # the deltas before the base timestamp, see client.py
+                length = max(0, length - 1)
+
+            bucket = get_length_bucket(length)
+            self.lengths[bucket] = self.lengths.get(bucket, 0) + 1
+
+        description = {
+            "name": name,
+            "kind": kind,
+            "key": key,
+            "selector": selector,
+            "rules": rules,
+            "bytes": size,
+            "length": length,
+            "ttl": ttl,
+        }
+
+        reason = self.check_retention(kind, rules, length, ttl)
+
+        if reason is not None:
+            self.over_retained_keys += 1
+
+            if len(self.over_retained) < self.top:
+                self.over_retained.append(dict(description, reason=reason))
+
+        if len(self.largest) < self.top:
+            heapq.heappush(self.largest, (size, name))
+        elif size > self.largest[0][0]:
+            heapq.heapreplace(self.largest, (size, name))
+
+        if self.on_key is not None:
+            self.on_key(description)
+
+    @coroutine
+    def step(self):
+        """
+        scans and adds up the next batch of keys, returns if the whole
+        namespace was scanned.
+        """
+
+        redis_conn = self.rate_limit.redis_conn
+        response = yield Task(
+            redis_conn.scan, self.cursor, count=self.count, match=self.match
+        )
+
+        if isinstance(response, RedisError):
+            raise response
+
+        cursor, keys = response
+        keys = list(keys)
+
+        if keys:
+            pipe = redis_conn.pipeline()
+
+            for key in keys:
+                pipe.type(key)
+                pipe.execute_command("MEMORY", "USAGE", key)
+                pipe.ttl(key)
+
+            response = yield Task(pipe.execute)
+
+            if isinstance(response, RedisError):
+                raise response
+
+            stats = [response[i:i + 3] for i in range(0, len(response), 3)]
+            pipe = redis_conn.pipeline()
+            measured = []
+
+            for key, (key_type, _, _) in zip(keys, stats):
+                if key_type in LENGTH_COMMANDS:
+                    getattr(pipe, LENGTH_COMMANDS[key_type])(key)
+                    measured.append(key)
+
+            lengths = {}
+
+            if measured:
+                response = yield Task(pipe.execute)
+
+                if isinstance(response, RedisError):
+                    raise response
+
+                lengths = dict(zip(measured, response))
+
+            for key, (key_type, size, ttl) in zip(keys, stats):
+                self.add(key, key_type, size, ttl, lengths.get(key))
+
+        self.cursor = int(cursor)
+        self.done = self.cursor == 0
+
+        raise Return(self.done)
+
+    @coroutine
+    def run(self):
+        """
+        scans the whole namespace, returns the report
+        """
+
+        while not (yield self.step()):
+            pass
+
+        raise Return(self.report())
+
+    def report(self):
+        """
+        returns what was added up so far
+        """
+
+        def describe(groups):
+            return dict(
+                (name, usage.describe()) for name, usage in groups.items()
+            )
+
+        return dict(self.total.describe(), **{
+            "kinds": describe(self.kinds),
+            "per_key": describe(self.keys),
+            "per_selector": describe(self.selectors),
+            "per_rule": describe(self.rules),
+            "list_lengths": dict(self.lengths),
+            "largest_keys": [
+                {"name": name, "bytes": size}
+                for size, name in sorted(self.largest, reverse=True)
+            ],
+            "over_retained_keys": self.over_retained_keys,
+            "over_retained": list(self.over_retained),
+        })
+
+
+@coroutine
+def analyze_namespace(rate_limit, count=1000, top=20):
+    """
+    scans the namespace of rate_limit and returns its memory report,
+    see KeyspaceAnalyzer.
+    """
+
+    report = yield KeyspaceAnalyzer(rate_limit, count, top).run()
+    raise Return(report)
+
+
+def project_memory(rules, cardinality, key="", namespace="", value_size=16,
+                   sketch=None):
+    """
+    projects the memory rules take in Redis once every selector holds
+    its expected cardinality of values, every list is full and every
+    slot is taken, for each storage: "list" (RateLimit), "compact"
+    (CompactRateLimit) and "sketch" (the request count rules on a
+    selector counted by a CountMinSketch, in fixed memory).
+
+    weighted rules aren't projected, their logs grow with the requests
+    in their span rather than with their amount.
+
+    Args:
+        rules: a rule string or an And/Or tree, as given to RateLimit.limit
+        cardinality: a dict of selector:expected distinct values, e.g
+            {"ip": 10 ** 6}, selectors left out are assumed to have 1
+        key: the key the rules are defined for, for the identifier sizes
+        namespace: the namespace of the RateLimit
+        value_size: the average size of a selector value (Default: 16)
+        sketch: the CountMinSketch to project the "sketch" storage with
+            (Default: one with the default error, for all the request
+            count rules on a selector)
+    Returns:
+        a dict of storage:{"keys", "bytes", "rules"}, "rules" describes
+        every list (or sketch, or leases set) of the rules.
+    """
+
+    plan = Plan(rules)
+    counted = [
+        join_non_empty(":", rule.selector, rule.rate)
+        for layouts in plan.layouts.values() for layout in layouts
+        for rule in layout.rules if rule.selector is not None
+    ]
+
+    if sketch is None and counted:
+        sketch = CountMinSketch(counted)
+
+    def get_identifier_size(selector, suffix=""):
+        return len(join_non_empty(
+            ":", namespace, key, selector, "x" * value_size if selector
+            else None
+        ) + suffix)
+
+    def project(storage):
+        projected = []
+
+        for selector, layouts in plan.layouts.items():
+            for layout in layouts:
+                rules = [
+                    rule for rule in layout.rules if not (
+                        storage == "sketch" and sketch is not None and
+                        sketch.counts(rule)
+                    )
+                ]
+
+                if not rules:
+                    continue
+
+                length = max(rule.allowed_requests for rule in rules)
+
+                if storage == "compact":
+                    size = STRING_OVERHEAD + 16 + 4 * length
+                else:
+                    size = LIST_OVERHEAD + LIST_ENTRY * length
+
+                projected.append((
+                    selector, rules,
+                    KEY_OVERHEAD + get_identifier_size(selector, layout.suffix)
+                    + size
+                ))
+
+        for rule in plan.rules.values():
+            if rule.concurrency is not None:
+                projected.append((
+                    rule.selector, [rule],
+                    KEY_OVERHEAD + get_identifier_size(rule.selector) + 5 +
+                    ZSET_ENTRY * rule.concurrency
+                ))
+
+        res = []
+
+        for selector, selector_rules, bytes_per_key in projected:
+            keys = cardinality.get(selector, 1) if selector else 1
+            res.append({
+                "selector": selector,
+                "rules": sorted(
+                    join_non_empty(":", rule.selector, rule.rate)
+                    for rule in selector_rules
+                ),
+                "keys": keys,
+                "bytes_per_key": bytes_per_key,
+                "bytes": keys * bytes_per_key,
+            })
+
+        if storage == "sketch" and sketch is not None:
+            # 2 windows of every approximate rule, whatever the cardinality
+            for rule in sorted(sketch.rules):
+                bytes_per_key = (
+                    KEY_OVERHEAD + len(join_non_empty(
+                        ":", namespace, "cms", key, rule
+                    )) + 11 + HASH_FIELD * sketch.width * sketch.depth
+                )
+                res.append({
+                    "selector": Rule(rule).selector,
+                    "rules": [rule],
+                    "keys": 2,
+                    "bytes_per_key": bytes_per_key,
+                    "bytes": 2 * bytes_per_key,
+                })
+
+        return {
+            "keys": sum(item["keys"] for item in res),
+            "bytes": sum(item["bytes"] for item in res),
+            "rules": sorted(res, key=lambda item: -item["bytes"]),
+        }
+
+    return dict(
+        (storage, project(storage))
+        for storage in ("list", "compact", "sketch")
+    )
@@ -0,0 +1,96 @@
+from tornado.gen import coroutine, Return
+from rate_limit.metrics import NULL_METRICS
+
+
+def merge_selectors(res, selectors):
+    """
+    merges a get_relevant_selectors() dict into res, keeping the longest
+    requests span and highest allowed requests for each identifier,
+    and all of its spans.
+    """
+
+    for identifier, params in selectors.items():
+        if identifier in res:
+            for key, value in params.items():
+                if key == "spans":
+                    value = sorted(set(res[identifier][key]) | set(value))
+                else:
+                    value = max(res[identifier][key], value)
+
+                res[identifier][key] = value
+        else:
+            res[identifier] = dict(params)
+
+    return res
+
+
+class Batch(object):
+    """
+    a local stand-in for RateLimit, used by RateLimit.check_many.
+
+    holds a snapshot of the requests lists touched by a batch, Limit
+    instances created with a Batch as their client are evaluated against
+    that snapshot, and the requests they log are applied to it, so every
+    item sees the requests admitted before it in the same batch.
+    """
+
+    def __init__(self, now=None, metrics=NULL_METRICS, hash_tags=None):
+        self.metrics = metrics
+        self.hash_tags = hash_tags
+        self.now = now
+        self.logs = {}
+        self.pushed = {}
+        self.cost = 1
+
+    @coroutine
+    def is_rate_limit_reached(self, key, rule):
+        """
+        same as RateLimit.is_rate_limit_reached, only that a request
+        costing N needs the rule.allowed_requests-N slot to be free.
+        """
+
+        index = rule.allowed_requests - self.cost
+
+        if index < 0:
+            raise Return(True)
+
+        log = self.logs.get(key, [])
+
+        # compared in milliseconds, the resolution of the stored timestamps
+        if index < len(log) and int(round((self.now - log[index]) * 1000)) \
+                < rule.requests_span * 1000:
+            raise Return(True)
+
+        raise Return(False)
+
+    @coroutine
+    def log_request(self, selectors_to_update):
+        """
+        pushes cost timestamps to the head of every selector list, trims it
+        and remembers how many timestamps should be pushed to Redis.
+        """
+
+        for key, params in selectors_to_update.items():
+            log = self.logs.setdefault(key, [])
+            log[:0] = [self.now] * self.cost
+            del log[params["allowed_requests"]:]
+
+            self.pushed[key] = self.pushed.get(key, 0) + self.cost
+
+    @coroutine
+    def request_limit_reached(self, limit, cost=1, decision=None):
+        """
+        like Limit.request_limit_reached, without locking, since the
+        whole batch is evaluated under a single lock. decision is the
+        item's, resolved to its tenant's rules, a new one by default.
+        """
+
+        self.cost = cost
+        decision = decision or limit.create_decision()
+
+        if ((yield limit.rate_limit_reached(decision))):
+            raise Return(True)
+
+        yield limit.log_request(decision)
+
+        raise Return(False)
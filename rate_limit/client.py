@@ -1,10 +1,120 @@
 from __future__ import absolute_import
 from __future__ import division
-from .utils import join_non_empty
+from .utils import (
+    join_non_empty, get_window, get_sliding_estimate, encode_timestamp,
+    get_age, decode_timestamp, MIN_DELTA, MAX_DELTA
+)
 from .limit import Limit
+from .plan import Plan
+from .metrics import NULL_METRICS
+from .tracing import NULL_TRACER
+from .batch import Batch, merge_selectors
+from .cluster import SlotPipelines
+from .adaptive import AIMD, ADJUST_SCRIPT
+from .grammer import dump_rules
 from tornado.gen import coroutine, Task, Return
-from tornadoredis.exceptions import RedisError
 from time import time
+import math
+
+try:
+    from tornadoredis.exceptions import RedisError
+except ImportError:
+    # the in process backends don't need tornadoredis
+    class RedisError(Exception):
+        pass
+
+
+# pushes a weighted request to a sorted set scored by timestamp (ms), each
+# member is "<cumulative cost>:<request cost>", so the total cost of a window
+# is the newest cumulative cost minus the cumulative cost before the oldest
+# request in the window, two boundary reads instead of a scan. members of
+# the same score are ordered lexicographically, the cumulative cost is zero
+# padded so they're ordered as they were pushed. entries older than ARGV[3]
+# ms are removed, the set expires after ARGV[4] seconds.
+LOG_COST_SCRIPT = """
+local newest = redis.call('ZREVRANGE', KEYS[1], 0, 0)
+local total = tonumber(ARGV[2])
+
+if newest[1] then
+    total = total + tonumber(string.match(newest[1], '^(%d+)'))
+end
+
+local member = string.format('%020d:%s', total, ARGV[2])
+
+redis.call('ZADD', KEYS[1], ARGV[1], member)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1] - ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+
+return total
+"""
+
+
+# pushes ARGV[5] requests at ARGV[1] (ms) to the head of a requests list
+# holding up to ARGV[2] requests, expiring in ARGV[4] seconds.
+#
+# the last element of a list is its base timestamp, the others are deltas
+# from it (see utils.MIN_DELTA). a new list, or one whose deltas would
+# overflow, is (re)based so its oldest request, or now, is MIN_DELTA away
+# from the base, leaving ~49 days of pushes. requests older than ARGV[3] ms
+# (the span) only have to stay older than it, they're moved up to it.
+PUSH_SCRIPT = """
+local now = tonumber(ARGV[1])
+local base = tonumber(redis.call('LINDEX', KEYS[1], -1))
+
+if not base or now - base > %(max_delta)d then
+    local deltas = redis.call('LRANGE', KEYS[1], 0, -2)
+    local oldest = now
+
+    if base and #deltas > 0 then
+        oldest = math.min(base + tonumber(deltas[#deltas]), now)
+    end
+
+    local rebased = math.max(oldest, now - tonumber(ARGV[3])) - %(min_delta)d
+
+    redis.call('DEL', KEYS[1])
+
+    for i = 1, #deltas do
+        redis.call('RPUSH', KEYS[1], math.max(
+            base + tonumber(deltas[i]) - rebased, %(min_delta)d
+        ))
+    end
+
+    redis.call('RPUSH', KEYS[1], rebased)
+    base = rebased
+end
+
+local length = 0
+
+for i = 1, tonumber(ARGV[5]) do
+    length = redis.call('LPUSH', KEYS[1], now - base)
+end
+
+if length > tonumber(ARGV[2]) + 1 then
+    redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[2]) - 1)
+    redis.call('RPUSH', KEYS[1], base)
+end
+
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+""" % {"min_delta": MIN_DELTA, "max_delta": MAX_DELTA}
+
+
+def format_cost_entry(total, cost):
+    """
+    returns the weighted log entry of a request costing cost, total being
+    the cumulative cost up to and including it, as LOG_COST_SCRIPT does.
+    """
+
+    return "%020d:%d" % (total, cost)
+
+
+def parse_cost_entry(entry):
+    """
+    takes a weighted log entry and returns the cumulative cost
+    up to and including it and the cost of the request itself.
+    """
+
+    total, cost = entry.split(":")
+    return int(total), int(cost)
 
 
 class RateLimit(object):
@@ -13,7 +123,9 @@ class RateLimit(object):
     """
 
     def __init__(self, redis_conn, namespace="", disable_locks=False,
-                 lock_ttl=10, lock_polling_interval=0.1):
+                 lock_ttl=10, lock_polling_interval=0.1, identifiers=None,
+                 metrics=None, tracer=None, clock=time, lease_ttl=60,
+                 heavy_hitters=None, events=None, hash_tags=None):
         """
         Args:
             redis_conn: a tornadoredis connection handler
@@ -24,6 +136,26 @@ class RateLimit(object):
             lock_ttl: after how much seconds lock expires (Default: 10 sec)
             lock_polling_interval: how often to poll when waiting for a lock
                 shorter poll interval means more trips to Redis.
+            identifiers: an identifier scheme, such as HashedIdentifiers,
+                to store short keys instead of the full identifiers.
+                (Default: None, full identifiers)
+            metrics: a Metrics instance to instrument the hot path with,
+                see rate_limit.metrics. (Default: None, not instrumented)
+            tracer: a Tracer, to trace decisions with spans, see
+                rate_limit.tracing. (Default: None, not traced)
+            clock: a callable returning the current time in seconds,
+                e.g a VirtualClock for simulations. (Default: time.time)
+            lease_ttl: after how much seconds a slot of a concurrency rule
+                is reclaimed if it wasn't released, e.g by a crashed worker.
+                should be longer than the requests. (Default: 60 sec)
+            heavy_hitters: a HeavyHitters, to track the identifiers making
+                the most decisions and deny the hot ones locally, see
+                rate_limit.hitters. (Default: None, not tracked)
+            events: an EventStream to record every decision to, see
+                rate_limit.events. (Default: None, not recorded)
+            hash_tags: a HashTags layout for Redis Cluster, so the keys
+                of a decision share a slot, see rate_limit.cluster.
+                (Default: None, plain identifiers)
         Returns:
             a RateLimit instance
         """
@@ -34,32 +166,149 @@ class RateLimit(object):
         self.disable_locks = disable_locks
         self.lock_ttl = lock_ttl
         self.lock_polling_interval = lock_polling_interval
+        self.identifiers = identifiers
+        self.metrics = metrics or NULL_METRICS
+        self.tracer = tracer or NULL_TRACER
+        self.clock = clock
+        self.lease_ttl = lease_ttl
+        self.heavy_hitters = heavy_hitters
+        self.events = events
+        self.hash_tags = hash_tags
+
+        if identifiers is not None and hash_tags is not None:
+            raise RuntimeError(
+                "Short identifiers can't keep hash tags, use either"
+            )
 
         self._rules = {}
+        self._plans = {}
+        self._defaults = {}
+        self._adaptive = {}
+        self._tenants = {}
+        self._sketches = {}
+        self._priorities = {}
+        self.rules_version = 0
         self._keys_reached_rate_limit = {}
 
     @coroutine
     def is_rate_limit_reached(self, key, rule):
         """
-        get the rule.allowed_requests-1 slot in the key list
-        return if its timestamp greater than NOW() - rule.requests_span
+        get the rule.allowed_requests-1 delta in the key list, and the base
+        at its tail, return if the request is newer than
+        NOW() - rule.requests_span
+
+        timestamps are in milliseconds, see utils.MIN_DELTA.
         """
 
+        self.metrics.round_trip()
         response = yield Task(
-            self.redis_conn.lindex,
+            self.redis_conn.lrange,
             self.add_namespace(key),
-            rule.allowed_requests - 1
+            rule.allowed_requests - 1,
+            -1
         )
 
         if isinstance(response, RedisError):
             raise response
 
-        if response is not None:
-            if time() - int(response) < rule.requests_span:
+        # a delta is found only if the base follows it
+        if len(response) > 1:
+            age = get_age(self.clock(), response[-1], response[0])
+
+            if age < rule.requests_span:
                 raise Return(True)
 
         raise Return(False)
 
+    @coroutine
+    def is_cost_limit_reached(self, key, rule, cost):
+        """
+        sums the cost of the requests in the last rule.requests_span
+        from the newest entry and the oldest entry inside the window,
+        return if adding cost to it exceeds rule.allowed_requests.
+        """
+
+        key = self.add_namespace(key)
+        pipe = self.redis_conn.pipeline()
+
+        pipe.zrevrange(key, 0, 0, False)
+        pipe.zrangebyscore(
+            key, "(%d" % int((self.clock() - rule.requests_span) * 1000),
+            "+inf",
+            offset=0, limit=1
+        )
+
+        self.metrics.round_trip()
+        response = yield Task(pipe.execute)
+
+        if isinstance(response, RedisError):
+            raise response
+
+        newest, oldest = response
+        total = 0
+
+        if oldest:
+            oldest_total, oldest_cost = parse_cost_entry(oldest[0])
+            total = parse_cost_entry(newest[0])[0] - oldest_total + oldest_cost
+
+        raise Return(total + cost > rule.allowed_requests)
+
+    @coroutine
+    def is_concurrency_limit_reached(self, key, rule):
+        """
+        drops the expired leases of the key sorted set (scored by lease
+        expiration) and return if the leases left take all the slots.
+        """
+
+        key = self.add_namespace(key)
+        pipe = self.redis_conn.pipeline()
+
+        pipe.zremrangebyscore(key, "-inf", "%r" % self.clock())
+        pipe.zcard(key)
+
+        self.metrics.round_trip()
+        response = yield Task(pipe.execute)
+
+        if isinstance(response, RedisError):
+            raise response
+
+        raise Return(int(response[1]) >= rule.concurrency)
+
+    def get_sketch_key(self, key, window):
+        return self.add_namespace("%s:%d" % (key, window))
+
+    @coroutine
+    def is_sketch_limit_reached(self, key, rule, cells):
+        """
+        reads the cells of the current and previous window sketches of key
+        (hashes of cell:count), the smallest cell of each is the estimate
+        of the selector value, return if the requests estimated in the
+        last rule.requests_span reach rule.allowed_requests.
+        """
+
+        now = self.clock()
+        window = get_window(now, rule.requests_span)
+        pipe = self.redis_conn.pipeline()
+
+        pipe.hmget(self.get_sketch_key(key, window), cells)
+        pipe.hmget(self.get_sketch_key(key, window - 1), cells)
+
+        self.metrics.round_trip()
+        response = yield Task(pipe.execute)
+
+        if isinstance(response, RedisError):
+            raise response
+
+        current, previous = [
+            min(int(counts.get(cell) or 0) for cell in cells)
+            for counts in response
+        ]
+        estimate = get_sliding_estimate(
+            current, previous, now, rule.requests_span, strict=True
+        )
+
+        raise Return(estimate >= rule.allowed_requests)
+
     @coroutine
     def log_request(self, selectors_to_update):
         """
@@ -78,27 +327,306 @@ class RateLimit(object):
 
         so longest request span for 'user' is 60 seconds
         and the requests log length will be 100
+
+        weighted selectors (those carrying a cost) are logged with
+        LOG_COST_SCRIPT, and trimmed by time instead of length.
+
+        concurrency selectors (those carrying a lease) take a slot,
+        by adding the lease, expiring lease_ttl seconds from now.
+
+        sketch selectors (those carrying cells) increment their cells
+        in the current window sketch.
+
+        with hash tags, the writes are sent as a transaction per slot,
+        in parallel.
         """
 
-        pipe = self.redis_conn.pipeline()
+        now = self.clock()
+        pipes = SlotPipelines(self.redis_conn, self.hash_tags)
 
         for key, params in selectors_to_update.iteritems():
+            pipe = pipes.get(key)
+            self.pipe_reverse_lookup(pipe, key)
+
+            if "cells" in params:
+                self.pipe_sketch(pipe, key, params, now)
+                continue
+
             key = self.add_namespace(key)
 
-            pipe.lpush(key, int(time()))
-            pipe.ltrim(key, 0, params["allowed_requests"] - 1)
-            pipe.expire(key, params["requests_span"])
+            if "cost" in params:
+                if params["cost"] > 0:
+                    pipe.eval(LOG_COST_SCRIPT, [key], [
+                        int(now * 1000), params["cost"],
+                        int(params["requests_span"] * 1000),
+                        int(math.ceil(params["requests_span"]))
+                    ])
+
+                continue
+
+            if "lease" in params:
+                pipe.zadd(key, now + self.lease_ttl, params["lease"])
+                pipe.expire(key, self.lease_ttl)
+                continue
+
+            self.pipe_push(pipe, key, params, now)
+
+        self.metrics.round_trip(len(pipes))
+        yield pipes.execute()
+
+    @coroutine
+    def update_adaptive_limit(self, name, rule, adaptive, stats):
+        """
+        reports the (count, errors, latency sum) stats observed for the
+        adaptive rule name, adjusting it with ADJUST_SCRIPT when due,
+        returns its current limit.
+        """
 
+        self.metrics.round_trip()
+        response = yield Task(
+            self.redis_conn.eval,
+            ADJUST_SCRIPT,
+            [self.add_namespace("aimd:" + name)],
+            adaptive.get_script_args(rule, stats, self.clock())
+        )
+
+        if isinstance(response, RedisError):
+            raise response
+
+        raise Return(int(response))
+
+    @coroutine
+    def release_slots(self, leases):
+        """
+        releases the slots taken by leases, a dict of concurrency
+        selector:lease, in one pipeline.
+        """
+
+        pipe = self.redis_conn.pipeline()
+
+        for key, lease in leases.items():
+            pipe.zrem(self.add_namespace(key), lease)
+
+        self.metrics.round_trip()
         response = yield Task(pipe.execute)
 
         if isinstance(response, RedisError):
             raise response
 
+    @coroutine
+    def check_many(self, items, key=None):
+        """
+        rate limits a batch of requests sharing the same key, in arrival
+        order. each item is a (rules, selector, cost) tuple:
+
+        - rules, same as in limit(), or None to use the rules previously
+          defined for key.
+        - selector, an object or a dict holding the rules selectors.
+        - cost, the amount of requests the item stands for.
+
+        like in limit(), items are evaluated against the rules of their
+        tenant when key has tenants.
+
+        instead of a lock, lookups and a log per item, the whole batch
+        takes the key lock once, fetches all the lists it touches in one
+        pipeline, evaluates the items locally (an item sees the requests
+        admitted before it) and logs the admitted ones in another pipeline.
+
+        returns a list of booleans, True for every item that was allowed.
+        """
+
+        batch = Batch(metrics=self.metrics, hash_tags=self.hash_tags)
+        limits = []
+        selectors_to_update = {}
+
+        for rules, selector, cost in items:
+            if rules is None:
+                rules = self._rules[key]
+
+            # the rules of key were removed, see remove_rules
+            if rules is None:
+                limits.append((None, None, cost))
+                continue
+
+            limit = Limit(
+                batch, rules, key, selector, tenants=self._tenants.get(key),
+                sketch=self._sketches.get(key),
+                priorities=self._priorities.get(key)
+            )
+            decision = limit.create_decision()
+
+            if limit.tenants is not None:
+                limit.resolve_tenant(decision)
+
+            selectors = limit.get_relevant_selectors(decision)
+
+            if any("cost" in params or "lease" in params or
+                   "cells" in params for params in selectors.values()) or \
+                    decision.plan.adaptive_rules:
+                raise RuntimeError(
+                    "check_many doesn't support weighted, concurrency, "
+                    "adaptive or approximate rules"
+                )
+
+            merge_selectors(selectors_to_update, selectors)
+            limits.append((limit, decision, cost))
+
+        lock = yield self.get_lock(next((
+            limit.get_lock_identifier() for limit, _, _ in limits if limit
+        ), key or ""))
+
+        try:
+            batch.now = self.clock()
+            batch.logs = yield self.get_requests_logs(selectors_to_update)
+
+            res = []
+
+            for limit, decision, cost in limits:
+                reached = False
+
+                if limit is not None:
+                    reached = yield batch.request_limit_reached(
+                        limit, cost, decision
+                    )
+
+                res.append(not reached)
+
+            yield self.push_requests(
+                batch.pushed, selectors_to_update, batch.now
+            )
+        finally:
+            yield self.release_lock(lock)
+
+        raise Return(res)
+
+    @coroutine
+    def get_requests_logs(self, selectors):
+        """
+        fetches the requests lists of all selectors in one pipeline,
+        lists are trimmed to their allowed_requests on push, so they're
+        fetched whole, base included.
+
+        returns a dict of selector:list of timestamps (in seconds),
+        newest first, up to the selector's allowed_requests.
+        """
+
+        pipes = SlotPipelines(self.redis_conn, self.hash_tags)
+
+        for key in selectors:
+            pipes.get(key).lrange(self.add_namespace(key), 0, -1)
+
+        self.metrics.round_trip(len(pipes))
+        responses = yield pipes.execute()
+
+        raise Return(dict(
+            (key, [
+                decode_timestamp(log[-1], delta) for delta in
+                log[:-1][:selectors[key]["allowed_requests"]]
+            ])
+            for keys, response in responses
+            for key, log in zip(keys, response)
+        ))
+
+    @coroutine
+    def push_requests(self, pushed, selectors_to_update, now):
+        """
+        same as log_request, but pushes pushed[selector] timestamps
+        to each selector list, in one pipeline.
+        """
+
+        if not pushed:
+            raise Return(None)
+
+        pipes = SlotPipelines(self.redis_conn, self.hash_tags)
+
+        for key, count in pushed.items():
+            pipe = pipes.get(key)
+            self.pipe_reverse_lookup(pipe, key)
+            self.pipe_push(
+                pipe, self.add_namespace(key), selectors_to_update[key],
+                now, count
+            )
+
+        self.metrics.round_trip(len(pipes))
+        yield pipes.execute()
+
+    def pipe_push(self, pipe, key, params, now, count=1):
+        """
+        queues on pipe pushing count requests to the head of the key list
+        with PUSH_SCRIPT, trimming it to params["allowed_requests"] and
+        setting its expiration to params["requests_span"]. key should be
+        already namespaced.
+        """
+
+        pipe.eval(PUSH_SCRIPT, [key], [
+            encode_timestamp(now),
+            params["allowed_requests"],
+            min(encode_timestamp(params["requests_span"]),
+                MAX_DELTA - MIN_DELTA),
+            int(math.ceil(params["requests_span"])),
+            count
+        ])
+
+    def pipe_sketch(self, pipe, key, params, now):
+        """
+        queues on pipe incrementing params["cells"] in the current window
+        sketch of key, which expires once it can't be looked up anymore.
+        """
+
+        span = params["requests_span"]
+        key = self.get_sketch_key(key, get_window(now, span))
+
+        for cell in params["cells"]:
+            pipe.hincrby(key, cell, 1)
+
+        pipe.expire(key, int(2 * span) + 1)
+
+    def pipe_reverse_lookup(self, pipe, key):
+        """
+        queues on pipe recording the identifier behind the short key of
+        key, if the identifier scheme keeps a reverse lookup table.
+        """
+
+        if self.identifiers is None or not self.identifiers.reverse_lookup:
+            return
+
+        pipe.hset(
+            self.identifiers.get_table(self.namespace),
+            self.add_namespace(key),
+            key
+        )
+
+    @coroutine
+    def lookup_identifier(self, short_key):
+        """
+        returns the identifier behind a short key, if the identifier scheme
+        keeps a reverse lookup table and it was recorded, otherwise None.
+        """
+
+        if self.identifiers is None or not self.identifiers.reverse_lookup:
+            raise Return(None)
+
+        self.metrics.round_trip()
+        response = yield Task(
+            self.redis_conn.hget,
+            self.identifiers.get_table(self.namespace),
+            short_key
+        )
+
+        if isinstance(response, RedisError):
+            raise response
+
+        raise Return(response)
+
     def add_namespace(self, key):
         """
-        prefix key with a namespace to avoid collisions with other users
+        prefix key with a namespace to avoid collisions with other users,
+        or shorten it if an identifier scheme was given.
         """
 
+        if self.identifiers is not None:
+            return self.identifiers.shorten(self.namespace, key)
+
         return join_non_empty(":", self.namespace, key)
 
     @coroutine
@@ -119,6 +647,7 @@ class RateLimit(object):
             polling_interval=self.lock_polling_interval
         )
 
+        self.metrics.round_trip()
         result = yield Task(lock.acquire, blocking=True)
 
         if isinstance(result, RedisError):
@@ -136,9 +665,12 @@ class RateLimit(object):
         if self.disable_locks:
             raise Return(None)
 
+        self.metrics.round_trip()
         yield Task(lock.release)
 
-    def limit(self, rules=None, key=None, selector=None, **selectors):
+    def limit(self, rules=None, key=None, selector=None, cost=None,
+              shards=None, adaptive=None, tenants=None, sketch=None,
+              priorities=None, priority=None, **selectors):
         """
         a factory for Limit instances, that can be used as decorators
         or as context managers. takes the following arguments:
@@ -162,6 +694,40 @@ class RateLimit(object):
           member/method. for decorators, when decorating a bound method,
           the 'self' of the instance is used as a selector.
 
+        - cost, the cost of a request for weighted rules, such as
+          'apikey:10MB/m' or 'apikey:1000units/h'. can be a number,
+          a callable, or the name of a selector to take it from.
+          plain rules ignore it and count requests. (Default: 1)
+
+        - shards, split the budget of global rules (rules without a
+          selector, e.g '2000/s') across that many sub-keys, so a hot
+          limit can spread over a Redis cluster. each request goes to
+          a random shard allowing its share of the requests, and spills
+          over to the neighbour shard when it's full. (Default: None)
+
+        - adaptive, an AIMD adjusting the limits of adaptive rules (e.g
+          '20-200/s') by the latency and errors of the requests they guard,
+          see rate_limit.adaptive. like rules, it's kept for key.
+          (Default: an AIMD with the default settings)
+
+        - tenants, a TenantRules of per tenant overrides, the request's
+          tenant rules replace 'rules' for that request, see
+          rate_limit.tenants. like rules, it's kept for key.
+
+        - sketch, a CountMinSketch counting some of the rules (e.g rules
+          on IPs) approximately in fixed memory, instead of keeping
+          a requests list per selector value, see rate_limit.sketch.
+          like rules, it's kept for key.
+
+        - priorities, a PriorityClasses of the share of the allowed
+          requests each priority class may use, keeping headroom for
+          the classes above it, see rate_limit.priority. like rules,
+          it's kept for key.
+
+        - priority, the priority class of the request, can be a class
+          name, a callable returning one, or the name of a selector to
+          take it from. (Default: the default class of priorities)
+
         - **selectors, you could specify individual selectors, and they
           take precedence over the 'selector' argument.
         """
@@ -173,5 +739,99 @@ class RateLimit(object):
                 raise RuntimeError("Rules already defined for Key")
 
             self._rules[key] = rules
+            self._plans[key] = Plan(rules)
+            self._defaults[key] = rules
+            self._adaptive[key] = adaptive or AIMD()
+            self._tenants[key] = tenants
+            self._sketches[key] = sketch
+            self._priorities[key] = priorities
+
+        limit = Limit(
+            self, rules, key, selector, cost, shards,
+            adaptive or self._adaptive.get(key),
+            tenants or self._tenants.get(key),
+            sketch or self._sketches.get(key),
+            priorities or self._priorities.get(key), priority, **selectors
+        )
+        limit.plan = self._plans.get(key)
+
+        if key in self._plans:
+            limit.rules_version = self.rules_version
+
+        return limit
+
+    def set_rules(self, rules):
+        """
+        replaces the rules of keys, rules is a dict of key:rules, e.g
+        as loaded from a rule source (see rate_limit.sources). only keys
+        whose rules changed are recompiled, Limits of those keys, even
+        ones created earlier (like decorators), switch to the new rules
+        on their next decision.
+
+        returns the keys whose rules changed.
+        """
+
+        changed = [
+            key for key, key_rules in rules.items()
+            if self._rules.get(key) is None or
+            dump_rules(self._rules[key]) != dump_rules(key_rules)
+        ]
+
+        for key in changed:
+            self._rules[key] = rules[key]
+            self._plans[key] = Plan(rules[key])
+            self._adaptive.setdefault(key, AIMD())
+
+        if changed:
+            self.rules_version += 1
+
+        return changed
+
+    def remove_rules(self, keys):
+        """
+        removes the rules set by set_rules for keys, e.g keys deleted from
+        a rule source. keys defined with limit() get back the rules they
+        were defined with, the others don't limit requests anymore, until
+        they are set again. like with set_rules, Limits of those keys
+        switch on their next decision.
+
+        returns the keys whose rules changed.
+        """
+
+        changed = []
+
+        for key in keys:
+            rules, current = self._defaults.get(key), self._rules.get(key)
+
+            if current is None or (rules is not None and
+                                   dump_rules(rules) == dump_rules(current)):
+                continue
+
+            self._rules[key] = rules
+            self._plans[key] = Plan(rules) if rules is not None else None
+            changed.append(key)
+
+        if changed:
+            self.rules_version += 1
+
+        return changed
+
+    def get_heavy_hitters(self):
+        """
+        returns the identifiers making the most decisions, see
+        HeavyHitters.get_heavy_hitters, empty if they aren't tracked.
+        """
+
+        if self.heavy_hitters is None:
+            return []
+
+        return self.heavy_hitters.get_heavy_hitters()
+
+    def get_plan(self, key):
+        """
+        returns the compiled Plan of the rules defined for key, describing
+        how they are laid out in Redis, see Plan.describe. None once they
+        were removed, see remove_rules.
+        """
 
-        return Limit(self, rules, key, selector, **selectors)
+        return self._plans[key]
@@ -0,0 +1,225 @@
+from __future__ import absolute_import
+from .sharding import get_shard_identifier
+from .utils import join_non_empty
+from tornado.concurrent import TracebackFuture
+from tornado.gen import coroutine, Task, Return
+
+try:
+    from tornadoredis.exceptions import RedisError
+except ImportError:
+    class RedisError(Exception):
+        pass
+
+# Redis Cluster maps every key to one of SLOTS hash slots
+SLOTS = 16384
+
+# braces in a component would end its hash tag early, or start another
+# one, so they are escaped, and % first, so escaping is reversible.
+TAG_ESCAPES = (("%", "%25"), ("{", "%7B"), ("}", "%7D"))
+
+
+def crc16(data):
+    """
+    the CRC16 (XMODEM) Redis Cluster hashes keys with
+    """
+
+    crc = 0
+
+    for byte in bytearray(data.encode("utf-8")
+                          if not isinstance(data, bytes) else data):
+        crc ^= byte << 8
+
+        for _ in range(8):
+            crc = (crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1
+
+        crc &= 0xFFFF
+
+    return crc
+
+
+def get_hash_tag(key):
+    """
+    returns the part of key Redis Cluster hashes: the substring between
+    the first { and the next }, if it isn't empty, otherwise the whole key.
+    """
+
+    start = key.find("{")
+
+    if start != -1:
+        end = key.find("}", start + 1)
+
+        if end > start + 1:
+            return key[start + 1:end]
+
+    return key
+
+
+def get_slot(key):
+    return crc16(get_hash_tag(key)) % SLOTS
+
+
+def escape_tag(component):
+    """
+    escapes the braces of an identifier component, None stays None
+    """
+
+    if component is None:
+        return None
+
+    component = "%s" % (component,)
+
+    for char, escaped in TAG_ESCAPES:
+        component = component.replace(char, escaped)
+
+    return component
+
+
+def unescape_tag(identifier):
+    """
+    reverts escape_tag, on a whole identifier once its braces are removed
+    """
+
+    for char, escaped in reversed(TAG_ESCAPES):
+        identifier = identifier.replace(escaped, char)
+
+    return identifier
+
+
+class HashTags(object):
+    """
+    a Redis Cluster layout for RateLimit: identifiers start with a hash
+    tag chosen by policy, so keys that are used together live in the
+    same slot:
+
+    - "key", every identifier of a key shares the key's slot, e.g
+      "{login}:user:vova", so a decision, its lock included, touches
+      a single slot. a busy key is served by a single node.
+    - "selector", every selector value gets its own slot, e.g
+      "{login:user:vova}", shared by all of its lists (weighted logs,
+      leases and the lists of a split layout) and spreading a key over
+      the cluster. a decision touches a slot per selector value, global
+      rules and the lock share the key's slot, and the shards of a
+      sharded key get a slot each.
+
+    the writes of a decision are grouped by slot, each group is sent as
+    a MULTI/EXEC transaction, and the groups are sent in parallel.
+
+    braces in keys, selectors and selector values are escaped (see
+    escape_tag), so a value can't move or split a tag.
+    """
+
+    POLICIES = ("key", "selector")
+
+    def __init__(self, policy="key"):
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown hash tag policy %r" % policy)
+
+        self.policy = policy
+
+    def create_identifier(self, key, selector, selector_value):
+        """
+        returns the identifier of a selector value of key, tagged
+        """
+
+        key, selector, selector_value = [
+            escape_tag(c) for c in (key, selector, selector_value)
+        ]
+
+        if self.policy == "key" or selector is None:
+            return join_non_empty(
+                ":", "{%s}" % key, selector, selector_value
+            )
+
+        return "{%s}" % join_non_empty(":", key, selector, selector_value)
+
+    def get_shard_identifier(self, identifier, shard):
+        """
+        returns the identifier of a shard of a tagged identifier, under
+        the "selector" policy, the shard gets its own slot.
+        """
+
+        if self.policy == "key":
+            return get_shard_identifier(identifier, shard)
+
+        end = identifier.index("}")
+
+        return identifier[:end] + ":shard:%s" % shard + identifier[end:]
+
+
+class SlotPipelines(object):
+    """
+    a pipeline per hash slot of the keys queued, without hash tags every
+    key shares one plain pipeline. get(key) returns the pipeline to queue
+    the commands of key on.
+    """
+
+    def __init__(self, redis_conn, hash_tags=None):
+        self.redis_conn = redis_conn
+        self.hash_tags = hash_tags
+        self.pipes = {}
+        self.keys = {}
+
+    def get(self, key):
+        """
+        key is an identifier, its namespace doesn't change its slot
+        """
+
+        slot = None if self.hash_tags is None else get_slot(key)
+
+        if slot not in self.pipes:
+            if self.hash_tags is None:
+                self.pipes[slot] = self.redis_conn.pipeline()
+            else:
+                self.pipes[slot] = self.redis_conn.pipeline(
+                    transactional=True
+                )
+
+            self.keys[slot] = []
+
+        self.keys[slot].append(key)
+
+        return self.pipes[slot]
+
+    def __len__(self):
+        return len(self.pipes)
+
+    def execute(self):
+        """
+        executes the pipelines in parallel, returns a Future of a list of
+        (keys, responses) per pipeline, keys in the order they were got.
+        without hash tags, the single pipeline is executed without
+        a coroutine around it.
+        """
+
+        if self.hash_tags is not None:
+            return self.execute_slots()
+
+        future = TracebackFuture()
+
+        if None not in self.pipes:
+            future.set_result([])
+            return future
+
+        def on_response(response):
+            if isinstance(response, RedisError):
+                future.set_exception(response)
+            else:
+                future.set_result([(self.keys[None], response)])
+
+        self.pipes[None].execute(callback=on_response)
+
+        return future
+
+    @coroutine
+    def execute_slots(self):
+        slots = list(self.pipes)
+        responses = yield [Task(self.pipes[slot].execute) for slot in slots]
+
+        for response in responses:
+            if isinstance(response, RedisError):
+                raise response
+
+        raise Return([
+            (self.keys[slot], response)
+            for slot, response in zip(slots, responses)
+        ])
@@ -0,0 +1,195 @@
+from __future__ import absolute_import
+from __future__ import division
+from .client import RateLimit
+from tornado.gen import coroutine, Task, Return
+from tornadoredis.exceptions import RedisError
+import math
+import struct
+
+# every requests log is a single Redis string, a 16 bytes header followed
+# by a ring buffer of up to capacity 4 bytes slots:
+#
+# header: base timestamp (ms), slot of the newest request, number of requests
+# slots:  request timestamps, as ms deltas from the base timestamp
+#
+# all integers are unsigned big endian.
+HEADER = struct.Struct(">QII")
+SLOT = struct.Struct(">I")
+
+# deltas are 32 bit, so a log can hold requests up to ~49 days after its base
+MAX_DELTA = 2 ** 32 - 1
+
+# returns the timestamp (ms) of the ARGV[1]-th newest request, if logged.
+LOOKUP_SCRIPT = """
+local header = redis.call('GETRANGE', KEYS[1], 0, 15)
+
+if #header < 16 then
+    return false
+end
+
+local base, head, count = struct.unpack('>I8I4I4', header)
+local n = tonumber(ARGV[1])
+
+if count < n then
+    return false
+end
+
+local capacity = (redis.call('STRLEN', KEYS[1]) - 16) / 4
+local slot = (head - n + 1) % capacity
+local delta = struct.unpack(
+    '>I4', redis.call('GETRANGE', KEYS[1], 16 + slot * 4, 19 + slot * 4)
+)
+
+return base + delta
+"""
+
+# pushes ARGV[4] requests at ARGV[1] (ms) to a log holding up to ARGV[2]
+# requests, expiring in ARGV[3] seconds.
+#
+# a log grows by a slot per request until it reaches its capacity, holding
+# its requests oldest first, it's then used as a ring buffer. logs whose
+# capacity changed are re-packed, keeping their newest requests, and logs
+# whose deltas would overflow are rebased to their oldest request, requests
+# older than MAX_DELTA are moved up to the new base.
+LOG_SCRIPT = """
+local now = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local header = redis.call('GETRANGE', KEYS[1], 0, 15)
+local base, head, count, slots = now, -1, 0, 0
+
+if #header == 16 then
+    base, head, count = struct.unpack('>I8I4I4', header)
+    slots = (redis.call('STRLEN', KEYS[1]) - 16) / 4
+end
+
+local ordered = count == slots and head == slots - 1
+local repack = slots > capacity or (slots < capacity and not ordered)
+
+if repack or now - base > %(max_delta)d then
+    local buffer = redis.call('GET', KEYS[1])
+    local kept = math.min(count, capacity)
+    local timestamps = {}
+
+    for i = kept, 1, -1 do
+        local slot = (head - i + 1) %% slots
+        timestamps[#timestamps + 1] = base + struct.unpack(
+            '>I4', buffer, 17 + slot * 4
+        )
+    end
+
+    if now - base > %(max_delta)d then
+        base = math.max(timestamps[1] or now, now - %(max_delta)d)
+    end
+
+    for i = 1, kept do
+        timestamps[i] = struct.pack('>I4', math.max(timestamps[i] - base, 0))
+    end
+
+    head, count, slots = kept - 1, kept, kept
+    redis.call('SET', KEYS[1], string.rep('\\0', 16) ..
+               table.concat(timestamps))
+end
+
+local delta = struct.pack('>I4', math.max(now - base, 0))
+
+for i = 1, tonumber(ARGV[4]) do
+    head = (head + 1) %% capacity
+    redis.call('SETRANGE', KEYS[1], 16 + head * 4, delta)
+end
+
+count = math.min(count + tonumber(ARGV[4]), capacity)
+redis.call('SETRANGE', KEYS[1], 0, struct.pack('>I8I4I4', base, head, count))
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+""" % {"max_delta": MAX_DELTA}
+
+
+def decode_log(buffer):
+    """
+    takes a packed requests log and returns its timestamps
+    in seconds, newest first.
+    """
+
+    if not buffer or len(buffer) < HEADER.size:
+        return []
+
+    base, head, count = HEADER.unpack_from(buffer)
+    capacity = (len(buffer) - HEADER.size) // SLOT.size
+    res = []
+
+    for i in range(count):
+        slot = (head - i) % capacity
+        delta = SLOT.unpack_from(buffer, HEADER.size + slot * SLOT.size)[0]
+        res.append((base + delta) / 1000)
+
+    return res
+
+
+class CompactRateLimit(RateLimit):
+    """
+    RateLimit storing each requests log as a packed binary ring buffer
+    in a single Redis string, instead of a list of decimal timestamps.
+
+    a request costs 4 bytes, and timestamps have a millisecond resolution.
+    it is not compatible with the lists stored by RateLimit, so use a
+    different namespace when switching between the two.
+    """
+
+    @coroutine
+    def is_rate_limit_reached(self, key, rule):
+        """
+        get the timestamp of the rule.allowed_requests-th newest request
+        return if its timestamp greater than NOW() - rule.requests_span
+        """
+
+        self.metrics.round_trip()
+        response = yield Task(
+            self.redis_conn.eval,
+            LOOKUP_SCRIPT,
+            [self.add_namespace(key)],
+            [rule.allowed_requests]
+        )
+
+        if isinstance(response, RedisError):
+            raise response
+
+        if response is not None:
+            now = self.clock() * 1000
+            if now - int(response) < rule.requests_span * 1000:
+                raise Return(True)
+
+        raise Return(False)
+
+    @coroutine
+    def get_requests_logs(self, selectors):
+        """
+        fetches and decodes the requests logs of all selectors
+        in one pipeline.
+        """
+
+        keys = list(selectors)
+        pipe = self.redis_conn.pipeline()
+
+        for key in keys:
+            pipe.get(self.add_namespace(key))
+
+        self.metrics.round_trip()
+        response = yield Task(pipe.execute)
+
+        if isinstance(response, RedisError):
+            raise response
+
+        raise Return(dict(
+            (key, decode_log(buffer)) for key, buffer in zip(keys, response)
+        ))
+
+    def pipe_push(self, pipe, key, params, now, count=1):
+        """
+        queues on pipe pushing count requests to the key log with LOG_SCRIPT
+        """
+
+        pipe.eval(LOG_SCRIPT, [key], [
+            int(now * 1000),
+            params["allowed_requests"],
+            int(math.ceil(params["requests_span"])),
+            count
+        ])
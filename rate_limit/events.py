@@ -0,0 +1,263 @@
+from __future__ import absolute_import
+from .metrics import NULL_METRICS
+from tornado.concurrent import Future
+from tornado.gen import coroutine, Task
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornadoredis.exceptions import RedisError
+import threading
+import logging
+import json
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+logger = logging.getLogger(__name__)
+
+# the fields of a decision event tuple
+FIELDS = ("timestamp", "identifier", "reached", "rule", "latency")
+
+
+class EventRing(object):
+    """
+    a fixed size ring buffer of events, its slots are allocated upfront.
+    pushing to a full ring drops the event instead of waiting.
+    """
+
+    def __init__(self, size=65536):
+        self.size = size
+        self.slots = [None] * size
+        self.head = 0
+        self.length = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.length
+
+    def push(self, event):
+        """
+        appends event, returns False if the ring was full and it was
+        dropped.
+        """
+
+        if self.length == self.size:
+            self.dropped += 1
+            return False
+
+        self.slots[(self.head + self.length) % self.size] = event
+        self.length += 1
+
+        return True
+
+    def pop_many(self, count):
+        """
+        removes and returns up to count of the oldest events
+        """
+
+        count = min(count, self.length)
+        res = []
+
+        for _ in range(count):
+            res.append(self.slots[self.head])
+            self.slots[self.head] = None
+            self.head = (self.head + 1) % self.size
+
+        self.length -= count
+
+        return res
+
+
+class FileSink(object):
+    """
+    appends batches to a file, an event per line, as a JSON array of
+    FIELDS.
+
+    batches are encoded, written and flushed by a thread of the sink, so
+    a slow disk doesn't stall the IOLoop, write() returns a Future done
+    once its batch is flushed.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "a")
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="FileSink")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, events):
+        future = Future()
+        self.queue.put((events, future, IOLoop.current()))
+
+        return future
+
+    def run(self):
+        """
+        writes the queued batches, until close() queues None
+        """
+
+        while True:
+            item = self.queue.get()
+
+            if item is None:
+                return
+
+            events, future, io_loop = item
+
+            try:
+                self.file.write("".join(
+                    json.dumps(event, separators=(",", ":")) + "\n"
+                    for event in events
+                ))
+                self.file.flush()
+            except Exception as e:
+                io_loop.add_callback(future.set_exception, e)
+            else:
+                io_loop.add_callback(future.set_result, None)
+
+    def close(self):
+        """
+        waits for the queued batches to be written, and closes the file
+        """
+
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+
+class RedisStreamSink(object):
+    """
+    adds a batch per entry to a Redis Stream, under the "events" field,
+    as a JSON array of event arrays. the stream is capped at about maxlen
+    entries.
+    """
+
+    def __init__(self, redis_conn, stream="rate_limit:events", maxlen=10000):
+        self.redis_conn = redis_conn
+        self.stream = stream
+        self.maxlen = maxlen
+
+    @coroutine
+    def write(self, events):
+        response = yield Task(
+            self.redis_conn.execute_command,
+            "XADD", self.stream, "MAXLEN", "~", self.maxlen, "*",
+            "events", json.dumps(events, separators=(",", ":"))
+        )
+
+        if isinstance(response, RedisError):
+            raise response
+
+
+class CallbackSink(object):
+    """
+    calls callback with every batch, a list of event tuples, the callback
+    may return a Future to be waited on.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    @coroutine
+    def write(self, events):
+        res = self.callback(events)
+
+        if isinstance(res, Future):
+            yield res
+
+
+class EventStream(object):
+    """
+    exports every decision of a RateLimit as an event, a tuple of
+    (timestamp, identifier, reached, rule, latency): the identifier is the
+    key and the values of the rules' selectors, rule is the rule that
+    denied the request, or None, latency is the seconds the decision took.
+
+    decisions only push their event to an EventRing, a background task
+    drains it every interval seconds in batches of up to batch_size events,
+    and writes them to the sinks. when the sinks fall behind and the ring
+    fills up, events are dropped and counted (the "events_dropped_total"
+    metric), decisions never wait for them.
+    """
+
+    def __init__(self, sinks, size=65536, batch_size=1000, interval=1,
+                 metrics=None):
+        """
+        Args:
+            sinks: a list of sinks, such as FileSink, RedisStreamSink or
+                CallbackSink.
+            size: the number of events the ring holds (Default: 65536)
+            batch_size: the most events written at once (Default: 1000)
+            interval: seconds between drains of the ring (Default: 1)
+            metrics: a Metrics instance counting dropped and written events
+        """
+
+        self.sinks = sinks
+        self.ring = EventRing(size)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.metrics = metrics or NULL_METRICS
+
+        self.periodic = None
+        self.running = False
+
+    def record(self, timestamp, identifier, reached, rule, latency):
+        """
+        records a decision, without blocking
+        """
+
+        if not self.ring.push((timestamp, identifier, reached, rule, latency)):
+            self.metrics.increment("events_dropped_total")
+
+    @coroutine
+    def flush(self):
+        """
+        drains the events in the ring to the sinks, events recorded
+        meanwhile wait for the next drain. a failing sink loses its batch,
+        the others still get it.
+        """
+
+        remaining = len(self.ring)
+
+        while remaining > 0:
+            events = self.ring.pop_many(min(remaining, self.batch_size))
+            remaining -= len(events)
+
+            for sink in self.sinks:
+                name = type(sink).__name__
+
+                try:
+                    yield sink.write(events)
+                except Exception:
+                    logger.exception("failed writing decision events")
+                    self.metrics.increment(
+                        "events_lost_total", len(events), sink=name
+                    )
+                else:
+                    self.metrics.increment(
+                        "events_written_total", len(events), sink=name
+                    )
+
+    @coroutine
+    def check(self):
+        """
+        a drain, unless the previous one is still running
+        """
+
+        if self.running:
+            return
+
+        self.running = True
+
+        try:
+            yield self.flush()
+        finally:
+            self.running = False
+
+    def start(self):
+        self.periodic = PeriodicCallback(self.check, self.interval * 1000)
+        self.periodic.start()
+
+    def stop(self):
+        if self.periodic is not None:
+            self.periodic.stop()
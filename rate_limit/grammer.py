@@ -1,4 +1,6 @@
-from tornado.gen import coroutine, Return
+from rate_limit.utils import (
+    lazy_coroutine, coroutine_return, string_types
+)
 
 
 class Operator(object):
@@ -9,7 +11,7 @@ class Operator(object):
     def __init__(self, *args):
         self.operators = args
 
-    @coroutine
+    @lazy_coroutine
     def run(self, callback):
         """
         runs callback on each operator in the operators list according
@@ -26,7 +28,18 @@ class Operator(object):
             else:
                 res = yield self.logical_operator(res, callback, operator)
 
-        raise Return(res)
+        raise coroutine_return(res)
+
+    def evaluate(self, predicate):
+        """
+        same as run, with a synchronous predicate, no coroutines involved
+        """
+
+        return self.combine(
+            operator.evaluate(predicate) if isinstance(operator, Operator)
+            else predicate(operator)
+            for operator in self.operators
+        )
 
     def get_all(self):
         res = set()
@@ -53,19 +66,57 @@ class And(Operator):
     """
     Logical And, stops running on first non True value
     """
+    name = "and"
     initial_res = True
+    combine = staticmethod(all)
 
-    @coroutine
+    @lazy_coroutine
     def logical_operator(self, last_res, callback, node):
-        raise Return(last_res and (yield callback(node)))
+        raise coroutine_return(last_res and (yield callback(node)))
 
 
 class Or(Operator):
     """
     Logical Or, stops running on first True value
     """
+    name = "or"
     initial_res = False
+    combine = staticmethod(any)
 
-    @coroutine
+    @lazy_coroutine
     def logical_operator(self, last_res, callback, node):
-        raise Return(last_res or (yield callback(node)))
+        raise coroutine_return(last_res or (yield callback(node)))
+
+
+OPERATORS = dict((operator.name, operator) for operator in (And, Or))
+
+
+def dump_rules(rules):
+    """
+    turns a rule tree into JSON serializable objects: rules are kept as
+    strings, And/Or as {"and": [...]} and {"or": [...]}.
+    """
+
+    if isinstance(rules, string_types):
+        return rules
+
+    return {rules.name: [dump_rules(rule) for rule in rules.operators]}
+
+
+def load_rules(obj):
+    """
+    the reverse of dump_rules, raises a SyntaxError on malformed trees
+    """
+
+    if isinstance(obj, string_types):
+        return str(obj)
+
+    if not isinstance(obj, dict) or len(obj) != 1:
+        raise SyntaxError("Malformed rules")
+
+    name, operators = list(obj.items())[0]
+
+    if name not in OPERATORS:
+        raise SyntaxError("Malformed rules")
+
+    return OPERATORS[name](*[load_rules(rule) for rule in operators])
@@ -0,0 +1,160 @@
+from collections import OrderedDict
+
+
+class HeavyHitters(object):
+    """
+    tracks the identifiers making the most decisions (e.g a scraping
+    apikey), give it to RateLimit to serve their denials locally.
+
+    decisions are counted with a space-saving sketch of capacity entries:
+    an identifier that isn't tracked takes the place of the one with the
+    lowest count, inheriting its count as its error, so any identifier
+    making more than 1/capacity of the decisions is tracked, and
+    count - error is a lower bound of its decisions. tracked identifiers
+    are also grouped in buckets by count (a stream-summary), so the one
+    with the lowest count is found in constant time.
+
+    every interval seconds the counts start over, identifiers that made
+    at least threshold decisions in the last interval are hot, the others
+    are demoted. when a hot identifier is denied, its next decisions are
+    denied locally for block_ttl seconds, without a lock or a round trip,
+    so errors only deny requests for up to block_ttl longer.
+    """
+
+    def __init__(self, capacity=100, threshold=1000, interval=1,
+                 block_ttl=0.1):
+        """
+        Args:
+            capacity: the most identifiers tracked (Default: 100)
+            threshold: decisions per interval making an identifier hot.
+                (Default: 1000)
+            interval: seconds between rotations of the counts. (Default: 1)
+            block_ttl: seconds a denied hot identifier is denied locally.
+                (Default: 0.1)
+        """
+
+        self.capacity = capacity
+        self.threshold = threshold
+        self.interval = interval
+        self.block_ttl = block_ttl
+
+        self.counts = {}
+        self.buckets = {}
+        self.min_count = 0
+        self.hot = {}
+        self.blocked = {}
+        self.started = None
+
+    def rotate(self, now):
+        """
+        starts a new interval if the current one is over, promoting the
+        identifiers over the threshold and demoting the others.
+        """
+
+        if self.started is None:
+            self.started = now
+
+        if now - self.started < self.interval:
+            return
+
+        if now - self.started < 2 * self.interval:
+            self.hot = dict(
+                (identifier, count - error)
+                for identifier, (count, error) in self.counts.items()
+                if count - error >= self.threshold
+            )
+        else:
+            self.hot = {}
+
+        self.blocked = dict(
+            (identifier, until) for identifier, until in self.blocked.items()
+            if identifier in self.hot and until > now
+        )
+        self.counts = {}
+        self.buckets = {}
+        self.min_count = 0
+        self.started = now
+
+    def observe(self, identifier, now):
+        """
+        counts a decision of identifier, returns if it's denied locally
+        """
+
+        self.rotate(now)
+
+        entry = self.counts.get(identifier)
+
+        if entry is not None:
+            self.unbucket(identifier, entry[0])
+            entry[0] += 1
+        elif len(self.counts) < self.capacity:
+            entry = self.counts[identifier] = [1, 0]
+        else:
+            # the oldest of the identifiers with the lowest count
+            victim = next(iter(self.buckets[self.min_count]))
+            count = self.counts.pop(victim)[0]
+            self.unbucket(victim, count)
+            entry = self.counts[identifier] = [count + 1, count]
+
+        self.buckets.setdefault(entry[0], OrderedDict())[identifier] = None
+
+        # counts only grow by one, from the lowest count at most
+        if entry[0] == 1 or self.min_count not in self.buckets:
+            self.min_count = entry[0]
+
+        return self.blocked.get(identifier, 0) > now
+
+    def unbucket(self, identifier, count):
+        """
+        removes identifier from the bucket of count, and the bucket
+        once it's empty.
+        """
+
+        bucket = self.buckets[count]
+        del bucket[identifier]
+
+        if not bucket:
+            del self.buckets[count]
+
+    def is_hot(self, identifier):
+        return identifier in self.hot
+
+    def deny(self, identifier, now):
+        """
+        records a denied decision of identifier, blocking it locally
+        if it's hot.
+        """
+
+        if identifier in self.hot:
+            self.blocked[identifier] = now + self.block_ttl
+
+    def get_heavy_hitters(self):
+        """
+        returns the tracked identifiers, most decisions first, with their
+        estimated and guaranteed decisions in the current interval, and
+        for hot ones, their decisions in the last interval.
+        """
+
+        res = [{
+            "identifier": identifier,
+            "decisions": count,
+            "guaranteed_decisions": count - error,
+            "hot": identifier in self.hot,
+            "last_interval_decisions": self.hot.get(identifier),
+            "blocked": identifier in self.blocked,
+        } for identifier, (count, error) in self.counts.items()]
+
+        res.extend({
+            "identifier": identifier,
+            "decisions": 0,
+            "guaranteed_decisions": 0,
+            "hot": True,
+            "last_interval_decisions": decisions,
+            "blocked": identifier in self.blocked,
+        } for identifier, decisions in self.hot.items()
+            if identifier not in self.counts)
+
+        return sorted(res, key=lambda item: (
+            -item["decisions"], -(item["last_interval_decisions"] or 0),
+            item["identifier"]
+        ))
@@ -0,0 +1,126 @@
+from __future__ import absolute_import
+from .utils import join_non_empty
+from tornado.gen import coroutine, Task, Return
+from tornadoredis.exceptions import RedisError
+import hashlib
+
+
+def digest(value, size):
+    """
+    returns the first size bytes of the sha1 digest of value
+    """
+
+    return hashlib.sha1(str(value).encode("utf-8")).digest()[:size]
+
+
+class HashedIdentifiers(object):
+    """
+    an identifier scheme for RateLimit, turning the long
+    namespace:key:selector_name:selector_value identifiers into short
+    binary keys: a short code interned for the namespace, followed by
+    a fixed size digest of the rest of the identifier.
+    """
+
+    def __init__(self, digest_size=10, prefix=None, reverse_lookup=False):
+        """
+        Args:
+            digest_size: how many bytes of the identifier digest to keep,
+                the default of 10 bytes makes collisions unlikely up to
+                billions of identifiers. (Default: 10)
+            prefix: the code to use for the namespace, by default a 2 bytes
+                digest of the namespace is used.
+            reverse_lookup: keep a short key:identifier table in Redis, for
+                debugging, it grows with the number of identifiers.
+                (Default: False)
+        """
+
+        self.digest_size = digest_size
+        self.prefix = prefix
+        self.reverse_lookup = reverse_lookup
+
+        self._prefixes = {}
+
+    def get_prefix(self, namespace):
+        """
+        returns the short code interned for namespace
+        """
+
+        if self.prefix is not None:
+            return self.prefix
+
+        if namespace not in self._prefixes:
+            self._prefixes[namespace] = digest(namespace, 2)
+
+        return self._prefixes[namespace]
+
+    def shorten(self, namespace, identifier):
+        """
+        returns the short key of identifier in namespace
+        """
+
+        return self.get_prefix(namespace) + digest(
+            identifier, self.digest_size
+        )
+
+    def get_table(self, namespace):
+        """
+        returns the name of the reverse lookup table of namespace
+        """
+
+        return join_non_empty(":", namespace, "identifiers")
+
+
+@coroutine
+def migrate_identifiers(rate_limit, count=1000):
+    """
+    renames all the keys stored by RateLimit under its namespace in the
+    current format, to the short keys of rate_limit.identifiers.
+
+    scans the namespace count keys at a time and renames each batch
+    in a pipeline, keys that already exist in the new format aren't
+    overwritten. locks aren't renamed, they expire on their own.
+
+    switch the running processes to the new scheme first, then migrate,
+    requests logged in between are kept in the new keys.
+
+    the RateLimit must have a namespace, so its old keys can be told apart.
+    returns the number of keys renamed.
+    """
+
+    namespace = rate_limit.namespace
+
+    if not namespace:
+        raise RuntimeError("Can't migrate keys without a namespace")
+
+    table = rate_limit.identifiers.get_table(namespace)
+    match = namespace + ":*"
+    cursor = 0
+    renamed = 0
+
+    while True:
+        response = yield Task(
+            rate_limit.redis_conn.scan, cursor, count=count, match=match
+        )
+
+        if isinstance(response, RedisError):
+            raise response
+
+        cursor, keys = response
+        keys = [key for key in keys if key != table]
+
+        if keys:
+            pipe = rate_limit.redis_conn.pipeline()
+
+            for key in keys:
+                identifier = key[len(namespace) + 1:]
+                pipe.renamenx(key, rate_limit.add_namespace(identifier))
+
+            response = yield Task(pipe.execute)
+
+            if isinstance(response, RedisError):
+                raise response
+
+            renamed += len([res for res in response if res is True])
+
+        if cursor == 0:
+            raise Return(renamed)
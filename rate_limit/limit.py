@@ -1,16 +1,36 @@
 from tornado.concurrent import TracebackFuture
 from tornado.gen import coroutine, Return
-from functools import wraps
+from tornado.ioloop import IOLoop
+from functools import partial, wraps
 from contextlib import contextmanager
 from rate_limit.utils import join_non_empty
-from rate_limit.rule import Rule
-from six import string_types
+from rate_limit.plan import Plan
+from rate_limit.adaptive import AIMD, get_adaptive_rule
+from rate_limit.sketch import get_sketch_identifier
+from rate_limit.tracing import NULL_SPAN
+from rate_limit.sharding import (
+    pick_shard, get_shard_identifier, get_shard_rule, get_spill_order
+)
+from rate_limit.utils import string_types
+from timeit import default_timer
+from uuid import uuid4
 
 
 class RateLimitExceeded(RuntimeError):
     pass
 
 
+def resolved_future(result):
+    """
+    returns a Future already resolved to result
+    """
+
+    future = TracebackFuture()
+    future.set_result(result)
+
+    return future
+
+
 def is_empty(expr):
     return expr is None or expr == ""
 
@@ -19,6 +39,13 @@ def set_max(res, identifier, rule, key):
     res[identifier][key] = max(getattr(rule, key), res[identifier][key])
 
 
+def add_span(res, identifier, rule):
+    spans = res[identifier]["spans"]
+
+    if rule.requests_span not in spans:
+        res[identifier]["spans"] = sorted(spans + [rule.requests_span])
+
+
 def handle_callables(member):
     """
     if a member is callable, calls it, other wise just returns it
@@ -29,6 +56,46 @@ def handle_callables(member):
     return member
 
 
+def get_cost_identifier(identifier):
+    """
+    weighted rules keep their own log, next to the requests list
+    """
+
+    return "cost:" + identifier
+
+
+def get_concurrency_identifier(identifier):
+    """
+    concurrency rules keep the leases of their slots under their own
+    identifier
+    """
+
+    return "conc:" + identifier
+
+
+class Decision(object):
+    """
+    the state of a single decision of a Limit. a Limit is shared by
+    concurrent calls (a decorator, a context manager), so what a call
+    looks up and takes, from the rules it's evaluated against (e.g its
+    tenant's) to the slots of concurrency rules, is kept here.
+    """
+
+    def __init__(self, rules=None, plan=None, func_args=None):
+        self.rules = rules
+        self.plan = plan
+        self.func_args = func_args
+        self.selector_values = {}
+        self.cost = 1
+        self.priority = None
+        self.shard = None
+        self.spill_order = []
+        self.span = NULL_SPAN
+        self.leases = {}
+        self.reached = None
+        self.denied_rule = None
+
+
 class Limit(object):
     """
     Limit class used to create decorators and context managers,
@@ -36,16 +103,26 @@ class Limit(object):
     be instantiated manually.
     """
 
-    def __init__(self, client, rules, key=None, selector=None, **selectors):
+    def __init__(self, client, rules, key=None, selector=None, cost=None,
+                 shards=None, adaptive=None, tenants=None, sketch=None,
+                 priorities=None, priority=None, **selectors):
         self.client = client
         self.rules = rules
+        self.adaptive = adaptive
+        self.tenants = tenants
+        self.sketch = sketch
+        self.priorities = priorities
 
         self.key = key
         self.selector = selector
         self.selectors = selectors
+        self.cost = cost
+        self.shards = shards
+        self.priority = priority
 
         self.func_name = None
-        self.func_args = None
+        self.plan = None
+        self.rules_version = None
 
     @coroutine
     def request_limit_reached(self):
@@ -60,22 +137,165 @@ class Limit(object):
         3. if limit didn't exceed on any rule, log a new request into
            the requests list for relevant selector
         4. relase lock and return result.
+
+        the request cost and priority class are resolved once, before
+        taking the lock.
+        when sharded, the shard is picked before taking the lock too,
+        and the locks of the shards the request may go to are taken
+        instead of the key's, along with the key's if some of the rules
+        aren't split across shards (e.g selector rules).
+
+        concurrency rules take a slot with the log, the leases taken are
+        kept in the Decision (see decide), to be released with
+        release_slots.
+
+        limits of a key whose rules were replaced since the last decision
+        (see RateLimit.set_rules) switch to the new rules first, then
+        decisions of limits with tenants are evaluated against the rules
+        of the request's tenant.
+
+        when the client tracks heavy hitters, decisions of a hot identifier
+        that was just denied are denied locally, see HeavyHitters.
+
+        when the client has an EventStream, every decision is recorded
+        to it, see rate_limit.events.
         """
 
-        lock = yield self.client.get_lock(self.get_key())
+        decision = yield self.decide()
 
-        try:
-            if ((yield self.rate_limit_reached())):
-                raise Return(True)
+        raise Return(decision.reached)
 
-            yield self.log_request()
-        finally:
-            yield self.client.release_lock(lock)
+    @coroutine
+    def decide(self, func_args=None):
+        """
+        decides whether a request is allowed (see request_limit_reached),
+        and returns its Decision, carrying the result in reached, the rule
+        that denied it in denied_rule and the slots taken in leases.
+
+        func_args are the arguments of a decorated function, whose first
+        one is looked up for selectors.
+        """
+
+        start = default_timer()
+
+        if (self.rules_version is not None and
+                self.rules_version != self.client.rules_version):
+            self.plan = self.client.get_plan(self.key)
+            self.rules = self.plan.tree if self.plan is not None else None
+            self.rules_version = self.client.rules_version
+
+        # the rules of the key were removed, see RateLimit.remove_rules
+        if self.rules is None:
+            decision = Decision(func_args=func_args)
+            decision.reached = False
+            raise Return(decision)
+
+        metrics = self.client.metrics
+        decision = self.create_decision(func_args)
+
+        if self.tenants is not None:
+            self.resolve_tenant(decision)
+
+        decision.cost = self.get_cost(decision)
+        decision.priority = self.get_priority(decision)
+
+        if self.shards:
+            decision.shard = pick_shard(self.shards)
+            decision.spill_order = get_spill_order(
+                decision.shard, self.shards
+            )
+
+        hitters = self.client.heavy_hitters
+        identifier = None
+
+        if hitters is not None:
+            identifier = self.get_decision_identifier(decision)
+            blocked = hitters.observe(identifier, self.client.clock())
+
+            if hitters.is_hot(identifier):
+                metrics.cache("heavy_hitter", blocked)
+
+            if blocked:
+                decision.reached = True
+                metrics.decision(self.get_key(), True)
+                self.record_event(decision, identifier, start)
+                raise Return(decision)
+
+        span = decision.span = self.client.tracer.trace(
+            "rate_limit", key=self.get_key()
+        )
+
+        # without metrics or a sampled span, the decision isn't timed
+        if metrics.enabled or span is not NULL_SPAN:
+            reached = yield self.run_instrumented(decision)
+        else:
+            locks = yield self.get_locks(decision)
+
+            try:
+                reached = yield self.rate_limit_reached(decision)
+
+                if not reached:
+                    yield self.log_request(decision)
+            finally:
+                yield self.release_locks(locks)
+
+        if reached and identifier is not None:
+            hitters.deny(identifier, self.client.clock())
+
+        decision.reached = reached
+        metrics.decision(self.get_key(), reached)
+        self.record_event(decision, identifier, start)
 
-        raise Return(False)
+        raise Return(decision)
 
     @coroutine
-    def rate_limit_reached(self):
+    def run_instrumented(self, decision):
+        """
+        takes the locks of decision, looks its rules up and logs it if
+        it's allowed, like decide, timing every phase and tracing it
+        under decision.span. returns whether the limit was reached.
+        """
+
+        metrics = self.client.metrics
+        span = decision.span
+
+        with span:
+            with metrics.timer("lock"), span.child("lock"):
+                locks = yield self.get_locks(decision)
+
+            try:
+                with metrics.timer("lookup"):
+                    reached = yield self.rate_limit_reached(decision)
+
+                if not reached:
+                    with metrics.timer("log"), span.child("log"):
+                        yield self.log_request(decision)
+            finally:
+                with metrics.timer("release"), span.child("release"):
+                    yield self.release_locks(locks)
+
+            span.set_tag("reached", reached)
+
+        raise Return(reached)
+
+    def record_event(self, decision, identifier, start):
+        """
+        records the decision to the client's EventStream, if it has one
+        """
+
+        events = self.client.events
+
+        if events is not None:
+            events.record(
+                self.client.clock(),
+                identifier or self.get_decision_identifier(decision),
+                decision.reached,
+                decision.denied_rule,
+                default_timer() - start
+            )
+
+    @coroutine
+    def rate_limit_reached(self, decision):
         """
         traverses the rule tree and stops on first rule for which
         rate limit has exceeded.
@@ -83,34 +303,190 @@ class Limit(object):
         skips rules that indicate selectors but their selectors return None.
         """
 
-        if isinstance(self.rules, string_types):
-            res = yield self.is_rule_rate_limit_reached(self.rules)
+        if isinstance(decision.rules, string_types):
+            res = yield self.is_rule_rate_limit_reached(
+                decision, decision.rules
+            )
         else:
-            res = yield self.rules.run(self.is_rule_rate_limit_reached)
+            res = yield decision.rules.run(
+                partial(self.is_rule_rate_limit_reached, decision)
+            )
 
         raise Return(res)
 
     @coroutine
-    def is_rule_rate_limit_reached(self, rule):
+    def is_rule_rate_limit_reached(self, decision, rule):
         """
         a predicate that takes a rule and returns if rate
         limit reached for this rule.
         """
 
-        rule = Rule(rule)
+        rule = decision.plan.get_rule(rule)
 
-        selector_value = self.get_selector(rule.selector)
+        selector_value = self.get_selector(rule.selector, decision)
 
         if rule.selector is not None and is_empty(selector_value):
             raise Return(False)
 
-        res = yield self.client.is_rate_limit_reached(
-            self.create_identifier(rule.selector, selector_value),
-            rule,
+        identifier = decision.plan.get_list_identifier(
+            self.create_identifier(rule.selector, selector_value), rule
+        )
+
+        span = decision.span.child(
+            "rule",
+            rule=join_non_empty(":", rule.selector, rule.rate),
+            identifier=identifier
         )
 
+        if rule.adaptive:
+            rule = yield self.get_adaptive_rule(rule)
+
+        if self.priorities is not None:
+            rule = self.priorities.get_rule(rule, decision.priority)
+
+        with span:
+            if rule.concurrency is not None:
+                res = yield self.client.is_concurrency_limit_reached(
+                    get_concurrency_identifier(identifier), rule
+                )
+            elif self.is_approximate(rule):
+                res = yield self.client.is_sketch_limit_reached(
+                    self.get_sketch_identifier(rule),
+                    rule,
+                    self.sketch.get_cells(selector_value),
+                )
+            elif rule.unit is not None:
+                res = yield self.client.is_cost_limit_reached(
+                    get_cost_identifier(identifier),
+                    rule,
+                    decision.cost,
+                )
+            elif self.is_sharded(rule):
+                res = yield self.is_shard_rate_limit_reached(
+                    decision, identifier, rule
+                )
+            else:
+                res = yield self.client.is_rate_limit_reached(identifier, rule)
+
+            span.set_tag("reached", res)
+
+        if res:
+            decision.denied_rule = join_non_empty(
+                ":", rule.selector, rule.rate
+            )
+            self.client.metrics.rule_denied(
+                self.get_key(), decision.denied_rule
+            )
+
         raise Return(res)
 
+    def is_sharded(self, rule):
+        """
+        only global request count rules (the ones without a selector)
+        are split across shards.
+        """
+
+        return (bool(self.shards) and rule.selector is None and
+                rule.unit is None and rule.concurrency is None and
+                not rule.adaptive and not self.is_approximate(rule))
+
+    def is_approximate(self, rule):
+        """
+        returns if rule is counted by the limit's count-min sketch
+        """
+
+        return self.sketch is not None and self.sketch.counts(rule)
+
+    @coroutine
+    def is_shard_rate_limit_reached(self, decision, identifier, rule):
+        """
+        checks rule on the request's shard, which allows its share of
+        rule.allowed_requests, if it's full, spills over to the neighbour
+        shard, and logs the request there instead. only the shards of
+        the decision's spill order, whose locks it holds, are checked.
+        """
+
+        shards = sorted(
+            decision.spill_order, key=lambda shard: shard != decision.shard
+        )
+
+        for shard in shards:
+            reached = yield self.client.is_rate_limit_reached(
+                self.get_shard_identifier(identifier, shard),
+                get_shard_rule(rule, shard, self.shards),
+            )
+
+            if not reached:
+                decision.shard = shard
+                raise Return(False)
+
+        raise Return(True)
+
+    def resolve_tenant(self, decision):
+        """
+        switches decision to the rules and plan of the request's tenant,
+        it keeps the limit's own rules if the tenant has no override.
+        """
+
+        override = self.tenants.get(
+            self.get_selector(self.tenants.selector, decision),
+            self.client.metrics
+        )
+
+        if override is not None:
+            decision.rules, decision.plan = override
+
+    def get_adaptive(self):
+        """
+        returns the AIMD adjusting the adaptive rules, a default one
+        unless it was given.
+        """
+
+        if self.adaptive is None:
+            self.adaptive = AIMD()
+
+        return self.adaptive
+
+    def get_adaptive_name(self, rule):
+        return join_non_empty(":", self.get_key(), rule.selector, rule.rate)
+
+    @coroutine
+    def get_adaptive_rule(self, rule):
+        """
+        returns a copy of an adaptive rule allowing its current limit,
+        reporting the requests observed by this process when it's due.
+        """
+
+        adaptive = self.get_adaptive()
+        name = self.get_adaptive_name(rule)
+        now = self.client.clock()
+        limit = adaptive.get_limit(name, now)
+
+        if limit is None:
+            limit = yield self.client.update_adaptive_limit(
+                name, rule, adaptive, adaptive.flush(name)
+            )
+            adaptive.set_limit(name, limit, now)
+
+        raise Return(get_adaptive_rule(rule, limit))
+
+    def observe(self, latency, error, decision=None):
+        """
+        records the latency of a guarded request, and whether it raised,
+        for the adaptive rules of its decision (by default, of the limit's
+        rules). the plan is compiled by the decision.
+        """
+
+        plan = decision.plan if decision is not None else self.plan
+
+        if plan is None:
+            return
+
+        for rule in plan.adaptive_rules:
+            self.get_adaptive().observe(
+                self.get_adaptive_name(rule), latency, error
+            )
+
     def get_rules(self):
         """
         returns a list of Rule objects, single instance of each rule,
@@ -118,12 +494,27 @@ class Limit(object):
         5/m and 1/s.
         """
 
-        if isinstance(self.rules, string_types):
-            return [Rule(self.rules)]
+        return self.get_plan().get_rules()
+
+    def get_plan(self):
+        """
+        returns the compiled Plan of the rules, compiled on first use
+        unless it was given by RateLimit.
+        """
+
+        if self.plan is None:
+            self.plan = Plan(self.rules)
+
+        return self.plan
 
-        return [Rule(rule) for rule in self.rules.get_all()]
+    def create_decision(self, func_args=None):
+        """
+        returns a new Decision, evaluated against the limit's rules
+        """
 
-    def get_relevant_selectors(self):
+        return Decision(self.rules, self.get_plan(), func_args)
+
+    def get_relevant_selectors(self, decision=None):
         """
         returns a dict with are selectors:selector value
         and the values are the maximum allowed request and span
@@ -131,36 +522,114 @@ class Limit(object):
 
         i.e given this empty selector, 1/m and 10/s, the maximum
         allowed requests is 10, and the maximum span is 60 seconds.
+        the spans of all the rules sharing the list are given too,
+        for backends counting requests per window.
+
+        weighted rules (e.g 10MB/m) are logged under their own identifier,
+        and instead of allowed requests they carry the request cost.
+
+        concurrency rules (e.g conc=5) carry a lease, a new one per call,
+        to take a slot under.
+
+        approximate rules (see CountMinSketch) carry the sketch cells
+        of the selector value, under the rule's sketch identifier.
         """
 
+        decision = decision or self.create_decision()
         res = {}
+        lease = None
 
-        for rule in self.get_rules():
-            selector_value = self.get_selector(rule.selector)
+        for rule in decision.plan.get_rules():
+            selector_value = self.get_selector(rule.selector, decision)
 
             if rule.selector is not None and is_empty(selector_value):
                 continue
 
-            identifier = self.create_identifier(rule.selector, selector_value)
-
-            if identifier in res:
+            identifier = decision.plan.get_list_identifier(
+                self.create_identifier(rule.selector, selector_value), rule
+            )
+
+            if self.is_sharded(rule):
+                identifier = self.get_shard_identifier(
+                    identifier, decision.shard
+                )
+                rule = get_shard_rule(rule, decision.shard, self.shards)
+
+            if rule.concurrency is not None:
+                lease = lease or uuid4().hex
+                res[get_concurrency_identifier(identifier)] = {"lease": lease}
+            elif self.is_approximate(rule):
+                res[self.get_sketch_identifier(rule)] = {
+                    "requests_span": rule.requests_span,
+                    "cells": self.sketch.get_cells(selector_value)
+                }
+            elif rule.unit is not None:
+                identifier = get_cost_identifier(identifier)
+
+                if identifier in res:
+                    set_max(res, identifier, rule, "requests_span")
+                else:
+                    res[identifier] = {
+                        "requests_span": rule.requests_span,
+                        "cost": decision.cost
+                    }
+            elif identifier in res:
                 set_max(res, identifier, rule, "requests_span")
                 set_max(res, identifier, rule, "allowed_requests")
+                add_span(res, identifier, rule)
             else:
                 res[identifier] = {
                     "requests_span": rule.requests_span,
-                    "allowed_requests": rule.allowed_requests
+                    "allowed_requests": rule.allowed_requests,
+                    "spans": [rule.requests_span]
                 }
 
         return res
 
     @coroutine
-    def log_request(self):
+    def log_request(self, decision):
         """
-        log request to relevant selectors lists
+        log request to relevant selectors lists, and take the slots
+        of concurrency rules, keeping their leases in decision.
         """
 
-        yield self.client.log_request(self.get_relevant_selectors())
+        selectors = self.get_relevant_selectors(decision)
+
+        decision.leases = dict(
+            (key, params["lease"]) for key, params in selectors.items()
+            if "lease" in params
+        )
+
+        yield self.client.log_request(selectors)
+
+    def release_slots(self, leases):
+        """
+        releases the slots of leases (taken by a decision, see
+        request_limit_reached) in a single round trip, returns a Future.
+        """
+
+        if not leases:
+            return resolved_future(None)
+
+        return self.client.release_slots(leases)
+
+    def get_decision_identifier(self, decision):
+        """
+        identifies whose requests a decision is about: the key, and the
+        value of every selector of the rules.
+        """
+
+        selectors = set(
+            rule.selector for rule in decision.plan.get_rules()
+        )
+        selectors.discard(None)
+
+        return join_non_empty(":", self.get_key(), *[
+            join_non_empty(
+                ":", selector, self.get_selector(selector, decision)
+            )
+            for selector in sorted(selectors)
+        ])
 
     def get_key(self):
         """
@@ -169,7 +638,40 @@ class Limit(object):
         """
         return self.key or self.func_name or ""
 
-    def _find_selector(self, selector):
+    def get_cost(self, decision=None):
+        """
+        returns the cost of the current request, used by weighted rules.
+
+        cost can be a number, a callable, or the name of a selector
+        (looked up like any other selector), defaults to 1.
+        """
+
+        if self.cost is None:
+            return 1
+
+        if isinstance(self.cost, string_types):
+            return int(self.get_selector(self.cost, decision))
+
+        return int(handle_callables(self.cost))
+
+    def get_priority(self, decision=None):
+        """
+        returns the priority class of the current request, used with
+        priority classes (see PriorityClasses).
+
+        priority can be a class name, a callable, or the name of a selector
+        (a name that isn't a class is looked up like any other selector),
+        defaults to None, the default class.
+        """
+
+        if (isinstance(self.priority, string_types) and
+                self.priorities is not None and
+                self.priority not in self.priorities.shares):
+            return self.get_selector(self.priority, decision)
+
+        return handle_callables(self.priority)
+
+    def _find_selector(self, selector, func_args):
         """
         looking for the selector, in order specified at get_selector,
         this extra function is needed so not to write handle_callables
@@ -188,12 +690,12 @@ class Limit(object):
 
         # check if func_args are set, and look in the first argument
         # if it has the selector we're looking for.
-        if self.func_args and hasattr(self.func_args[0], selector):
-            return getattr(self.func_args[0], selector)
+        if func_args and hasattr(func_args[0], selector):
+            return getattr(func_args[0], selector)
 
         raise RuntimeError("Selector was specified but not found")
 
-    def get_selector(self, selector):
+    def get_selector(self, selector, decision=None):
         """
         Figures out what selector to return.
 
@@ -201,17 +703,30 @@ class Limit(object):
         2. if selector found in self.selectors, it takes priority,
         3. if not found, look in selector object, if was passed
         4. if not found/no selector object, see if we're decorating a bound
-            method with a self, and look into that self (heh) for the selector.
+            method with a self (the decision's func_args), and look into
+            that self (heh) for the selector.
         5. if selector not found, raise an exception
 
         if selector found, and it's a callable, call it, otherwise use its
         string representation.
 
+        given a decision, a selector is looked up (and called) once, its
+        value is kept in decision.selector_values for the rest of it.
         """
         if selector is None:
             return None
 
-        return handle_callables(self._find_selector(selector))
+        if decision is None:
+            return handle_callables(self._find_selector(selector, None))
+
+        values = decision.selector_values
+
+        if selector not in values:
+            values[selector] = handle_callables(
+                self._find_selector(selector, decision.func_args)
+            )
+
+        return values[selector]
 
     def create_identifier(self, selector, selector_value):
         """
@@ -229,8 +744,119 @@ class Limit(object):
         """
 
         key = self.get_key()
+        hash_tags = self.get_hash_tags()
+
+        if hash_tags is not None:
+            return hash_tags.create_identifier(key, selector, selector_value)
+
         return join_non_empty(":", key, selector, selector_value)
 
+    def get_hash_tags(self):
+        """
+        returns the client's HashTags, None without a cluster layout
+        """
+
+        return getattr(self.client, "hash_tags", None)
+
+    def get_sketch_identifier(self, rule):
+        """
+        returns the identifier of the sketch of an approximate rule
+        """
+
+        return get_sketch_identifier(self.create_identifier(None, None), rule)
+
+    def get_shard_identifier(self, identifier, shard):
+        """
+        returns the identifier of a shard of identifier, with hash tags,
+        as their policy lays shards out.
+        """
+
+        hash_tags = self.get_hash_tags()
+
+        if hash_tags is not None:
+            return hash_tags.get_shard_identifier(identifier, shard)
+
+        return get_shard_identifier(identifier, shard)
+
+    def get_lock_identifier(self, shard=None):
+        """
+        the lock of the key, or of one of its shards. with hash tags,
+        it shares the slot of the key (or shard) lists.
+        """
+
+        if self.get_hash_tags() is None:
+            return join_non_empty(":", self.get_key(), shard)
+
+        identifier = self.create_identifier(None, None)
+
+        if shard is None:
+            return identifier
+
+        return self.get_shard_identifier(identifier, shard)
+
+    def get_lock_identifiers(self, decision):
+        """
+        the locks a decision takes, in the order every decision takes
+        them: the key's, or when sharded, the locks of the shards it may
+        read or log. the key's lock is taken too if some of its rules
+        aren't split across shards, since decisions on other shards
+        share them.
+        """
+
+        if decision.shard is None:
+            return [self.get_lock_identifier()]
+
+        res = [
+            self.get_lock_identifier(shard)
+            for shard in sorted(decision.spill_order)
+        ]
+
+        if not all(self.is_sharded(rule)
+                   for rule in decision.plan.get_rules()):
+            res.insert(0, self.get_lock_identifier())
+
+        return res
+
+    def get_locks(self, decision):
+        """
+        takes the locks of decision (see get_lock_identifiers) one after
+        the other, returns a Future of them. with locks disabled, no lock
+        is taken and no coroutine is run.
+        """
+
+        if self.client.disable_locks:
+            return resolved_future([])
+
+        return self.take_locks(decision)
+
+    @coroutine
+    def take_locks(self, decision):
+        locks = []
+
+        try:
+            for identifier in self.get_lock_identifiers(decision):
+                locks.append((yield self.client.get_lock(identifier)))
+        except Exception:
+            yield self.release_locks(locks)
+            raise
+
+        raise Return(locks)
+
+    def release_locks(self, locks):
+        """
+        releases locks taken by get_locks, returns a Future
+        """
+
+        if not locks:
+            return resolved_future(None)
+
+        return self.release_taken_locks(locks)
+
+    @coroutine
+    def release_taken_locks(self, locks):
+        for lock in reversed(locks):
+            yield self.client.release_lock(lock)
+
     @coroutine
     def cm(self):
         """
@@ -241,14 +867,37 @@ class Limit(object):
 
         with (yield Limit(...).cm()) as ctx:
             do_stuff()
+
+        slots of concurrency rules are held until the body exits, their
+        release is sent in the background, errors are logged by the IOLoop.
+        the body is measured for adaptive rules.
         """
 
-        if (yield self.request_limit_reached()):
+        decision = yield self.decide()
+
+        if decision.reached:
             raise RateLimitExceeded
 
+        leases = decision.leases
+
         @contextmanager
         def func():
-            yield self
+            start = default_timer()
+            error = False
+
+            try:
+                yield self
+            except Exception:
+                error = True
+                raise
+            finally:
+                self.observe(default_timer() - start, error, decision)
+
+                if leases:
+                    IOLoop.current().add_future(
+                        self.release_slots(leases),
+                        lambda future: future.result()
+                    )
 
         raise Return(func())
 
@@ -256,7 +905,9 @@ class Limit(object):
         """
         decorates func with a context manager that guards the rate limit
         func can either be a regular function, or a function that returns
-        a Future, the Future will be ran for you.
+        a Future, the Future will be ran for you. slots of concurrency
+        rules are held until it's done, and it's measured (latency and
+        whether it raised) for adaptive rules.
 
         also, remembers the decorated function name, to be used as the
         rate limit identifier
@@ -272,17 +923,31 @@ class Limit(object):
         @coroutine
         def wrapper(*args, **kwargs):
             """
-            remembers function args, to inspect for 'self', to be used as
-            a selector object.
+            passes function args to the decision, to inspect for 'self',
+            to be used as a selector object.
             """
-            self.func_args = args
 
-            with (yield self.cm()):
+            decision = yield self.decide(args)
+
+            if decision.reached:
+                raise RateLimitExceeded
+
+            leases = decision.leases
+            start = default_timer()
+            error = False
+
+            try:
                 res = func(*args, **kwargs)
 
                 if isinstance(res, TracebackFuture):
                     res = yield res
-
-                raise Return(res)
+            except Exception:
+                error = True
+                raise
+            finally:
+                self.observe(default_timer() - start, error, decision)
+                yield self.release_slots(leases)
+
+            raise Return(res)
 
         return wrapper
@@ -0,0 +1,277 @@
+from __future__ import absolute_import
+from .client import RateLimit
+from .utils import get_window, get_sliding_estimate
+from tornado.gen import coroutine, moment, Return
+from tornado.locks import Lock
+from collections import deque
+
+
+class MemoryRateLimit(RateLimit):
+    """
+    RateLimit keeping the requests logs in process memory, no Redis
+    involved, so limits are per process. useful for limits local to a
+    process, tests and simulations.
+
+    keys expire like they do in Redis, lazily on access, or all at once
+    with purge().
+    """
+
+    def __init__(self, namespace="", disable_locks=False, interleave=False,
+                 **kwargs):
+        """
+        Args:
+            interleave: yield to the IOLoop before every storage operation,
+                like a Redis round trip would, so concurrent decisions
+                interleave. (Default: False)
+
+            the rest of the arguments are the same as RateLimit's.
+        """
+
+        super(MemoryRateLimit, self).__init__(
+            None, namespace, disable_locks, **kwargs
+        )
+
+        self.interleave = interleave
+
+        self.logs = {}
+        self.expires = {}
+        self.locks = {}
+        self.slots = {}
+        self.adaptive_state = {}
+
+    @coroutine
+    def round_trip(self):
+        """
+        accounts for a storage operation, yielding to the IOLoop
+        if interleaving.
+        """
+
+        self.metrics.round_trip()
+
+        if self.interleave:
+            yield moment
+
+    def get_log(self, key):
+        """
+        returns the log of key, None if it doesn't exist or expired
+        """
+
+        if key in self.expires and self.expires[key] <= self.clock():
+            del self.logs[key]
+            del self.expires[key]
+
+        return self.logs.get(key)
+
+    def purge(self):
+        """
+        removes all the expired logs and leases
+        """
+
+        now = self.clock()
+
+        for key, expires in list(self.expires.items()):
+            if expires <= now:
+                del self.logs[key]
+                del self.expires[key]
+
+        for key in list(self.slots):
+            if not self.get_leases(key):
+                del self.slots[key]
+
+    @coroutine
+    def is_rate_limit_reached(self, key, rule):
+        yield self.round_trip()
+
+        log = self.get_log(self.add_namespace(key))
+
+        if log is not None and len(log) >= rule.allowed_requests:
+            timestamp = log[rule.allowed_requests - 1]
+
+            if self.clock() - timestamp < rule.requests_span:
+                raise Return(True)
+
+        raise Return(False)
+
+    @coroutine
+    def is_cost_limit_reached(self, key, rule, cost):
+        """
+        weighted logs hold (timestamp, cumulative cost, cost) entries,
+        newest first, summed like RateLimit.is_cost_limit_reached does.
+        """
+
+        yield self.round_trip()
+
+        log = self.get_log(self.add_namespace(key)) or ()
+        since = self.clock() - rule.requests_span
+        oldest = None
+
+        for entry in log:
+            if entry[0] <= since:
+                break
+
+            oldest = entry
+
+        total = 0
+
+        if oldest is not None:
+            total = log[0][1] - oldest[1] + oldest[2]
+
+        raise Return(total + cost > rule.allowed_requests)
+
+    @coroutine
+    def is_concurrency_limit_reached(self, key, rule):
+        yield self.round_trip()
+
+        raise Return(
+            len(self.get_leases(self.add_namespace(key))) >= rule.concurrency
+        )
+
+    @coroutine
+    def is_sketch_limit_reached(self, key, rule, cells):
+        yield self.round_trip()
+
+        now = self.clock()
+        window = get_window(now, rule.requests_span)
+
+        current, previous = [
+            min((self.get_log(self.get_sketch_key(key, w)) or {}).get(cell, 0)
+                for cell in cells)
+            for w in (window, window - 1)
+        ]
+        estimate = get_sliding_estimate(
+            current, previous, now, rule.requests_span, strict=True
+        )
+
+        raise Return(estimate >= rule.allowed_requests)
+
+    def get_leases(self, key):
+        """
+        returns the lease:expiration dict of key, without expired leases
+        """
+
+        now = self.clock()
+        leases = self.slots.get(key, {})
+
+        for lease, expires in list(leases.items()):
+            if expires <= now:
+                del leases[lease]
+
+        return leases
+
+    @coroutine
+    def log_request(self, selectors_to_update):
+        yield self.round_trip()
+
+        now = self.clock()
+
+        for key, params in selectors_to_update.items():
+            if "lease" in params:
+                self.slots.setdefault(self.add_namespace(key), {})[
+                    params["lease"]
+                ] = now + self.lease_ttl
+                continue
+
+            if "cells" in params:
+                self.push_sketch(key, params, now)
+                continue
+
+            self.push(self.add_namespace(key), params, now)
+
+    @coroutine
+    def update_adaptive_limit(self, name, rule, adaptive, stats):
+        yield self.round_trip()
+
+        state = self.adaptive_state.setdefault(self.add_namespace(name), {})
+        raise Return(adaptive.adjust(state, rule, stats, self.clock()))
+
+    @coroutine
+    def release_slots(self, leases):
+        yield self.round_trip()
+
+        for key, lease in leases.items():
+            self.get_leases(self.add_namespace(key)).pop(lease, None)
+
+    @coroutine
+    def get_requests_logs(self, selectors):
+        yield self.round_trip()
+
+        raise Return(dict(
+            (key, list(self.get_log(self.add_namespace(key)) or ()))
+            for key in selectors
+        ))
+
+    @coroutine
+    def push_requests(self, pushed, selectors_to_update, now):
+        yield self.round_trip()
+
+        for key, count in pushed.items():
+            self.push(
+                self.add_namespace(key), selectors_to_update[key], now, count
+            )
+
+    def push(self, key, params, now, count=1):
+        """
+        pushes count requests to the key log, trims it and sets its
+        expiration, like RateLimit.pipe_push and LOG_COST_SCRIPT.
+        """
+
+        log = self.get_log(key)
+
+        if log is None:
+            log = self.logs[key] = deque()
+
+        if "cost" in params:
+            if params["cost"] > 0:
+                total = log[0][1] if log else 0
+                log.appendleft(
+                    (now, total + params["cost"], params["cost"])
+                )
+
+                while log and log[-1][0] <= now - params["requests_span"]:
+                    log.pop()
+        else:
+            log.extendleft([now] * count)
+
+            while len(log) > params["allowed_requests"]:
+                log.pop()
+
+        self.expires[key] = now + params["requests_span"]
+
+    def push_sketch(self, key, params, now):
+        """
+        increments params["cells"] in the current window sketch of key,
+        a dict of cell:count, like RateLimit.pipe_sketch.
+        """
+
+        span = params["requests_span"]
+        key = self.get_sketch_key(key, get_window(now, span))
+        sketch = self.get_log(key)
+
+        if sketch is None:
+            sketch = self.logs[key] = {}
+
+        for cell in params["cells"]:
+            sketch[cell] = sketch.get(cell, 0) + 1
+
+        self.expires[key] = now + 2 * span
+
+    @coroutine
+    def get_lock(self, key):
+        if self.disable_locks:
+            raise Return(None)
+
+        yield self.round_trip()
+
+        lock = self.locks.setdefault(self.add_namespace(key), Lock())
+        yield lock.acquire()
+
+        raise Return(lock)
+
+    @coroutine
+    def release_lock(self, lock):
+        if self.disable_locks:
+            raise Return(None)
+
+        yield self.round_trip()
+
+        lock.release()
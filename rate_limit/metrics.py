@@ -0,0 +1,223 @@
+from tornado.web import RequestHandler
+from timeit import default_timer
+import bisect
+
+# histogram buckets upper bounds, in seconds
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1, 2.5, 5, 10
+)
+
+
+class Histogram(object):
+    """
+    a fixed buckets histogram
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def get_cumulative_counts(self):
+        """
+        returns (upper bound, cumulative count) pairs, ending with +Inf
+        """
+
+        res = []
+        total = 0
+
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            res.append((bound, total))
+
+        return res
+
+
+class Timer(object):
+    """
+    a context manager observing how long its body took
+    """
+
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+        self.start = None
+
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.phase, default_timer() - self.start)
+
+
+class NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = NullTimer()
+
+
+def format_labels(labels):
+    """
+    formats a sorted (name, value) tuple as prometheus labels
+    """
+
+    if not labels:
+        return ""
+
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\")
+                     .replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+
+
+class Metrics(object):
+    """
+    in process metrics of the rate limiter hot path:
+
+    - phase_seconds, a latency histogram per phase of a decision
+      (lock, lookup, log, release)
+    - decisions_total, allowed and denied requests per key
+    - rule_denies_total, denied requests per key and the rule that denied
+    - redis_round_trips_total, divide by decisions_total for round trips
+      per decision
+    - cache_requests_total, hits and misses per cache
+    """
+
+    enabled = True
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = {}
+
+    def timer(self, phase):
+        """
+        returns a context manager timing phase
+        """
+
+        return Timer(self, phase)
+
+    def observe(self, phase, seconds):
+        if phase not in self.histograms:
+            self.histograms[phase] = Histogram(self.buckets)
+
+        self.histograms[phase].observe(seconds)
+
+    def increment(self, name, amount=1, **labels):
+        counter = (name, tuple(sorted(labels.items())))
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def decision(self, key, reached):
+        self.increment(
+            "decisions_total", key=key, result="deny" if reached else "allow"
+        )
+
+    def rule_denied(self, key, rule):
+        self.increment("rule_denies_total", key=key, rule=rule)
+
+    def round_trip(self, count=1):
+        self.increment("redis_round_trips_total", count)
+
+    def cache(self, name, hit):
+        self.increment(
+            "cache_requests_total", cache=name, result="hit" if hit else "miss"
+        )
+
+    def get_counter(self, name, **labels):
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def to_prometheus(self, prefix="rate_limit"):
+        """
+        returns the metrics in the prometheus text exposition format
+        """
+
+        lines = []
+
+        if self.histograms:
+            name = prefix + "_phase_seconds"
+            lines.append("# TYPE %s histogram" % name)
+
+            for phase, histogram in sorted(self.histograms.items()):
+                for bound, count in histogram.get_cumulative_counts():
+                    lines.append("%s_bucket%s %d" % (name, format_labels(
+                        (("le", bound), ("phase", phase))
+                    ), count))
+
+                labels = format_labels((("phase", phase),))
+                lines.append("%s_sum%s %r" % (name, labels, histogram.sum))
+                lines.append("%s_count%s %d" % (name, labels, histogram.count))
+
+        typed = set()
+
+        for (name, labels), value in sorted(self.counters.items()):
+            name = prefix + "_" + name
+
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE %s counter" % name)
+
+            lines.append("%s%s %s" % (name, format_labels(labels), value))
+
+        return "\n".join(lines) + "\n"
+
+
+class NullMetrics(Metrics):
+    """
+    the default metrics sink, ignores everything.
+    """
+
+    enabled = False
+
+    def timer(self, phase):
+        return _NULL_TIMER
+
+    def observe(self, phase, seconds):
+        pass
+
+    def increment(self, name, amount=1, **labels):
+        pass
+
+    def decision(self, key, reached):
+        pass
+
+    def rule_denied(self, key, rule):
+        pass
+
+    def round_trip(self, count=1):
+        pass
+
+    def cache(self, name, hit):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+class MetricsHandler(RequestHandler):
+    """
+    serves metrics in the prometheus text format, e.g:
+
+    Application([(r"/metrics", MetricsHandler, {"metrics": metrics})])
+    """
+
+    def initialize(self, metrics, prefix="rate_limit"):
+        self.metrics = metrics
+        self.prefix = prefix
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.finish(self.metrics.to_prometheus(self.prefix))
@@ -0,0 +1,179 @@
+from rate_limit.rule import Rule
+from rate_limit.utils import string_types
+
+# the cost model is in units of list elements walked by the lookup LRANGE,
+# Redis walks a list from its nearest end, so looking up slot i of a list
+# holding n requests walks min(i, n - 1 - i) elements.
+#
+# WRITE_COST is the cost of keeping another list per request (a PUSH_SCRIPT
+# call), MEMORY_COST is the cost of every request kept.
+WRITE_COST = 100
+MEMORY_COST = 0
+
+
+def lookup_cost(allowed_requests, length):
+    """
+    how many elements LRANGE walks to check a rule allowing
+    allowed_requests in a (full) list of length.
+    """
+
+    return min(allowed_requests - 1, length - allowed_requests)
+
+
+class ListLayout(object):
+    """
+    a requests list, shared by one or more rules on the same selector
+    """
+
+    def __init__(self, selector, rules, suffix):
+        self.selector = selector
+        self.rules = rules
+        self.suffix = suffix
+        self.length = max(rule.allowed_requests for rule in rules)
+
+    def get_identifier(self, identifier):
+        """
+        returns the identifier of this list for a rule identifier
+        """
+
+        return identifier + self.suffix
+
+    def describe(self):
+        return {
+            "selector": self.selector,
+            "suffix": self.suffix,
+            "length": self.length,
+            "rules": [rule.rate for rule in self.rules],
+            "lookup_costs": [
+                lookup_cost(rule.allowed_requests, self.length)
+                for rule in self.rules
+            ]
+        }
+
+
+class Plan(object):
+    """
+    a compiled rule set: every rule is parsed once, and the request count
+    rules on each selector are laid out in one or more requests lists.
+
+    sharing a list costs a single write per request, but rules whose
+    allowed_requests fall in the middle of a long list make LINDEX walk
+    deep, separate lists are always looked up at their tail, but each one
+    costs another write per request. the layout minimizing the total cost,
+    as modeled by WRITE_COST, MEMORY_COST and lookup_cost, is chosen.
+
+    the list holding the largest rule keeps the plain identifier, so a
+    selector with a single list is stored as it always was.
+    """
+
+    def __init__(self, rules, write_cost=WRITE_COST, memory_cost=MEMORY_COST):
+        self.write_cost = write_cost
+        self.memory_cost = memory_cost
+        self.tree = rules
+
+        if isinstance(rules, string_types):
+            rules = set([rules])
+        else:
+            rules = rules.get_all()
+
+        self.rules = dict((rule, Rule(rule)) for rule in rules)
+        self.adaptive_rules = [
+            rule for rule in self.rules.values() if rule.adaptive
+        ]
+        self.layouts = {}
+        self._rule_layouts = {}
+
+        by_selector = {}
+
+        for rule in self.rules.values():
+            if rule.unit is None and rule.concurrency is None:
+                by_selector.setdefault(rule.selector, []).append(rule)
+
+        for selector, selector_rules in by_selector.items():
+            self.layouts[selector] = self.plan_selector(
+                selector, selector_rules
+            )
+
+            for layout in self.layouts[selector]:
+                for rule in layout.rules:
+                    self._rule_layouts[rule.rate, selector] = layout
+
+    def group_cost(self, group):
+        """
+        the cost of a list shared by group, a list of rules sorted by
+        allowed_requests.
+        """
+
+        length = group[-1].allowed_requests
+
+        return (self.write_cost + self.memory_cost * length + sum(
+            lookup_cost(rule.allowed_requests, length) for rule in group
+        ))
+
+    def plan_selector(self, selector, rules):
+        """
+        splits rules into lists of consecutive allowed_requests with
+        the lowest total cost, returns their ListLayouts.
+        """
+
+        rules = sorted(rules, key=lambda rule: rule.allowed_requests)
+
+        # best[j] is the (cost, groups) of the best layout of rules[:j]
+        best = [(0, [])]
+
+        for j in range(1, len(rules) + 1):
+            best.append(min(
+                ((best[i][0] + self.group_cost(rules[i:j]),
+                  best[i][1] + [rules[i:j]])
+                 for i in range(j)),
+                key=lambda layout: layout[0]
+            ))
+
+        groups = best[-1][1]
+
+        return [
+            ListLayout(
+                selector,
+                group,
+                "" if group is groups[-1] else
+                "#%d" % group[-1].allowed_requests
+            )
+            for group in groups
+        ]
+
+    def get_rule(self, rule):
+        """
+        returns the compiled Rule of a rule string
+        """
+
+        return self.rules[rule]
+
+    def get_rules(self):
+        """
+        returns the compiled Rules, single instance of each rule
+        """
+
+        return list(self.rules.values())
+
+    def get_list_identifier(self, identifier, rule):
+        """
+        returns the identifier of the list rule is looked up in and
+        logged to, identifier is the rule identifier of the request.
+        """
+
+        layout = self._rule_layouts.get((rule.rate, rule.selector))
+
+        if layout is None:
+            return identifier
+
+        return layout.get_identifier(identifier)
+
+    def describe(self):
+        """
+        returns the layout of every selector, for inspection
+        """
+
+        return dict(
+            (selector, [layout.describe() for layout in layouts])
+            for selector, layouts in self.layouts.items()
+        )
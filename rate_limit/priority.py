@@ -0,0 +1,76 @@
+from __future__ import absolute_import
+import copy
+
+
+class PriorityClasses(object):
+    """
+    priority classes sharing the rules of a key, each class may use up to
+    its share of a rule's allowed requests, e.g with {"bulk": 0.7,
+    "interactive": 1}, bulk requests are denied once the window holds 70%
+    of the allowed requests, keeping the rest as headroom for interactive
+    requests, which may use all of it.
+
+    every class is checked against the same stored window in the same
+    lookup, a class with a smaller share just looks at a newer slot of
+    the requests list, and every request is logged to it whatever its
+    class. the share applies to weighted, concurrency, sketch and
+    adaptive rules (of their current limit) too.
+    """
+
+    def __init__(self, shares, default=None):
+        """
+        Args:
+            shares: a dict of class name:share of the allowed requests,
+                between 0 and 1
+            default: the class of requests not given one, they may use all
+                of the allowed requests if it's None (Default: None)
+        """
+
+        for name, share in shares.items():
+            if not 0 < share <= 1:
+                raise ValueError(
+                    "Share of priority class %r should be in (0, 1]" % name
+                )
+
+        if default is not None and default not in shares:
+            raise ValueError("Unknown default priority class %r" % default)
+
+        self.shares = dict(shares)
+        self.default = default
+
+    def get_share(self, priority):
+        """
+        returns the share of priority, the default class's if it's None
+        """
+
+        if priority is None:
+            priority = self.default
+
+            if priority is None:
+                return 1
+
+        try:
+            return self.shares[priority]
+        except KeyError:
+            raise RuntimeError("Unknown priority class %r" % priority)
+
+    def get_rule(self, rule, priority):
+        """
+        returns a copy of rule, allowing priority's share of
+        rule.allowed_requests, every class is allowed at least one request.
+        """
+
+        share = self.get_share(priority)
+
+        if share == 1:
+            return rule
+
+        res = copy.copy(rule)
+        res.allowed_requests = max(
+            1, int(round(rule.allowed_requests * share, 6))
+        )
+
+        if rule.concurrency is not None:
+            res.concurrency = res.allowed_requests
+
+        return res
@@ -0,0 +1,305 @@
+from __future__ import absolute_import
+from __future__ import division
+from .client import RateLimit, RedisError
+from .metrics import NULL_METRICS
+from .utils import join_non_empty, get_window, get_sliding_estimate
+from tornado.gen import coroutine, Task, Return
+from tornado.ioloop import PeriodicCallback
+from collections import deque
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MultiRegionRateLimit(RateLimit):
+    """
+    RateLimit for deployments spanning several regions (datacenters),
+    each with its own Redis, sharing limits without cross region round
+    trips on decisions.
+
+    instead of a requests list, every rule span of an identifier keeps
+    a grow-only counter per fixed window: a Redis hash of region:requests,
+    where each region only increments its own field. decisions read the
+    merged view from the local Redis, the sum over all regions, and
+    estimate the sliding window from the current and previous windows,
+    the previous one counting in full until it rolls over, so a region
+    never admits more than the limit in a span by itself.
+
+    a Replicator ships the counters this region changed to the other
+    regions. until they arrive, other regions don't see this region's
+    requests, so every region can admit up to the whole limit minus what
+    it has seen, over-admission is bounded by the requests admitted
+    during the replication lag.
+
+    weighted, concurrency and approximate rules, and check_many,
+    aren't supported.
+    """
+
+    def __init__(self, redis_conn, region, namespace="", disable_locks=False,
+                 **kwargs):
+        """
+        Args:
+            redis_conn: a tornadoredis connection to this region's Redis
+            region: the name of this region, unique among the regions
+
+            the rest of the arguments are the same as RateLimit's.
+        """
+
+        super(MultiRegionRateLimit, self).__init__(
+            redis_conn, namespace, disable_locks, **kwargs
+        )
+
+        self.region = region
+        self.dirty_key = join_non_empty(":", namespace, "crdt:dirty")
+
+    def get_counter_key(self, key, span, window):
+        return self.add_namespace("crdt:%s:%s:%d" % (key, span, window))
+
+    @coroutine
+    def is_rate_limit_reached(self, key, rule):
+        """
+        sums the counters of all regions for the current and the previous
+        window, return if the requests estimated in the last
+        rule.requests_span reach rule.allowed_requests.
+        """
+
+        now = self.clock()
+        span = rule.requests_span
+        window = get_window(now, span)
+
+        pipe = self.redis_conn.pipeline()
+        pipe.hgetall(self.get_counter_key(key, span, window))
+        pipe.hgetall(self.get_counter_key(key, span, window - 1))
+
+        self.metrics.round_trip()
+        response = yield Task(pipe.execute)
+
+        if isinstance(response, RedisError):
+            raise response
+
+        current, previous = [
+            sum(int(count) for count in counters.values())
+            for counters in response
+        ]
+        estimate = get_sliding_estimate(
+            current, previous, now, span, strict=True
+        )
+
+        raise Return(estimate >= rule.allowed_requests)
+
+    @coroutine
+    def is_cost_limit_reached(self, key, rule, cost):
+        raise RuntimeError(
+            "MultiRegionRateLimit doesn't support weighted rules"
+        )
+
+    @coroutine
+    def is_concurrency_limit_reached(self, key, rule):
+        raise RuntimeError(
+            "MultiRegionRateLimit doesn't support concurrency rules"
+        )
+
+    @coroutine
+    def is_sketch_limit_reached(self, key, rule, cells):
+        raise RuntimeError(
+            "MultiRegionRateLimit doesn't support approximate rules"
+        )
+
+    @coroutine
+    def get_requests_logs(self, selectors):
+        raise RuntimeError("MultiRegionRateLimit doesn't support check_many")
+
+    @coroutine
+    def log_request(self, selectors_to_update):
+        """
+        increments this region's field of the current window counter
+        of every span of every selector, and marks the counters dirty
+        for the Replicator. counters expire once their window can't
+        be looked up anymore.
+        """
+
+        now = self.clock()
+        pipe = self.redis_conn.pipeline()
+
+        for key, params in selectors_to_update.items():
+            for span in params.get("spans", ()):
+                counter = self.get_counter_key(
+                    key, span, get_window(now, span)
+                )
+
+                pipe.hincrby(counter, self.region, 1)
+                pipe.expire(counter, int(2 * span) + 1)
+                pipe.sadd(self.dirty_key, counter)
+
+        self.metrics.round_trip()
+        response = yield Task(pipe.execute)
+
+        if isinstance(response, RedisError):
+            raise response
+
+
+class Replicator(object):
+    """
+    ships the counters a MultiRegionRateLimit's region changed to the
+    Redis of every other region, asynchronously from decisions. run one
+    per region.
+
+    each round drains the region's dirty counters, reads its own field of
+    each (the delta: the other fields belong to other regions) and writes
+    it to the same field in the other regions. a region's field only
+    grows and is only written by its own replicator, in order, so writing
+    it is the merge of the grow-only counter, and redelivery is harmless.
+    deltas a region failed to receive are retried on the next round.
+    """
+
+    def __init__(self, rate_limit, remotes, interval=0.1, delay=0,
+                 metrics=None):
+        """
+        Args:
+            rate_limit: this region's MultiRegionRateLimit
+            remotes: a dict of region:tornadoredis connection to the
+                Redis of every other region
+            interval: seconds between rounds (Default: 0.1)
+            delay: seconds deltas are held before being shipped, to inject
+                replication lag in tests. (Default: 0)
+            metrics: a Metrics instance, the lag from draining to applying
+                deltas is observed as the "replication" phase.
+        """
+
+        self.rate_limit = rate_limit
+        self.remotes = remotes
+        self.interval = interval
+        self.delay = delay
+        self.metrics = metrics or NULL_METRICS
+
+        self.pending = deque()
+        self.outboxes = dict((region, {}) for region in remotes)
+        self.periodic = None
+        self.running = False
+
+    @coroutine
+    def drain(self):
+        """
+        takes the dirty counters of this region, returns a dict of
+        counter:(this region's count, ttl)
+        """
+
+        redis_conn = self.rate_limit.redis_conn
+        dirty_key = self.rate_limit.dirty_key
+
+        pipe = redis_conn.pipeline(transactional=True)
+        pipe.smembers(dirty_key)
+        pipe.delete(dirty_key)
+
+        response = yield Task(pipe.execute)
+
+        if isinstance(response, RedisError):
+            raise response
+
+        counters = sorted(response[0])
+
+        if not counters:
+            raise Return({})
+
+        pipe = redis_conn.pipeline()
+
+        for counter in counters:
+            pipe.hget(counter, self.rate_limit.region)
+            pipe.ttl(counter)
+
+        response = yield Task(pipe.execute)
+
+        if isinstance(response, RedisError):
+            raise response
+
+        raise Return(dict(
+            (counter, (int(count), int(ttl)))
+            for counter, count, ttl in zip(
+                counters, response[::2], response[1::2]
+            )
+            if count is not None and ttl is not None and int(ttl) > 0
+        ))
+
+    @coroutine
+    def ship(self, region, remote):
+        """
+        writes the outbox of region to its Redis, keeps it on failure
+        """
+
+        outbox = self.outboxes[region]
+        pipe = remote.pipeline()
+
+        for counter, (count, ttl, _) in sorted(outbox.items()):
+            pipe.hset(counter, self.rate_limit.region, count)
+            pipe.expire(counter, ttl)
+
+        try:
+            response = yield Task(pipe.execute)
+
+            if isinstance(response, RedisError):
+                raise response
+        except Exception:
+            logger.exception("failed replicating to %s", region)
+            raise Return(False)
+
+        now = self.rate_limit.clock()
+        self.metrics.observe(
+            "replication", now - min(entry[2] for entry in outbox.values())
+        )
+        self.metrics.increment(
+            "replicated_counters_total", len(outbox), region=region
+        )
+        self.outboxes[region] = {}
+
+        raise Return(True)
+
+    @coroutine
+    def replicate(self):
+        """
+        runs a round: drains the dirty counters, and ships the deltas
+        held for delay seconds to every other region.
+        """
+
+        now = self.rate_limit.clock()
+        deltas = yield self.drain()
+
+        if deltas:
+            self.pending.append((now + self.delay, now, deltas))
+
+        while self.pending and self.pending[0][0] <= now:
+            _, drained_at, deltas = self.pending.popleft()
+
+            for outbox in self.outboxes.values():
+                for counter, (count, ttl) in deltas.items():
+                    if counter not in outbox or outbox[counter][0] < count:
+                        outbox[counter] = (count, ttl, drained_at)
+
+        for region, remote in sorted(self.remotes.items()):
+            if self.outboxes[region]:
+                yield self.ship(region, remote)
+
+    @coroutine
+    def check(self):
+        """
+        a round, unless the previous one is still running
+        """
+
+        if self.running:
+            return
+
+        self.running = True
+
+        try:
+            yield self.replicate()
+        except Exception:
+            logger.exception("failed replicating")
+        finally:
+            self.running = False
+
+    def start(self):
+        self.periodic = PeriodicCallback(self.check, self.interval * 1000)
+        self.periodic.start()
+
+    def stop(self):
+        if self.periodic is not None:
+            self.periodic.stop()
@@ -4,46 +4,87 @@ import re
 _MODIFIERS = {
     's': 1,
     'm': 60,
-    'h': 60 * 60
+    'h': 60 * 60,
+    'd': 24 * 60 * 60
+}
+
+_UNITS = {
+    'B': 1,
+    'KB': 1024,
+    'MB': 1024 * 1024,
+    'GB': 1024 * 1024 * 1024
 }
 
 # Some people, when confronted with a problem, think "I know, I'll use
 # regular expressions." Now they have two problems.
-_EXPRESSION_RE = re.compile(r"^(?:(\w+):)?(\d+/\w+){1}$")
+_EXPRESSION_RE = re.compile(
+    r"^(?:(\w+):)?(\d+[a-zA-Z]*/[\d.]*[a-zA-Z]+|\d+-\d+/[\d.]*[a-zA-Z]+|"
+    r"conc=\d+){1}$"
+)
+_AMOUNT_RE = re.compile(r"^(\d+)([a-zA-Z]*)$")
+_SPAN_RE = re.compile(r"^(\d+(?:\.\d+)?)?(ms|s|m|h|d)$")
 
 
 def to_seconds(fmt_time):
     """
-    takes formated time like s, 10s, m, 5m
-    and returns it in seconds
+    takes formated time like s, 10s, m, 5m, 100ms, 1.5s or 7d
+    and returns it in seconds, a float if it's fractional
+    """
+
+    match = _SPAN_RE.match(fmt_time)
+
+    if match is None:
+        raise SyntaxError("Malformed rule")
+
+    amount, modifier = match.groups()
+    amount = float(amount) if "." in (amount or "") else int(amount or 1)
+
+    if modifier == "ms":
+        seconds = amount / 1000
+    else:
+        seconds = amount * _MODIFIERS[modifier]
+
+    return int(seconds) if seconds == int(seconds) else seconds
+
+
+def parse_amount(amount):
+    """
+    takes an amount like 10, 10MB or 1000units and returns
+    the amount and its unit (None for plain request counts).
+
+    byte units (B, KB, MB, GB) are converted to bytes, any other
+    unit is just a name for the cost of a request.
     """
-    modifier = _MODIFIERS[fmt_time[-1]]
-    amount = int(fmt_time[:-1] or 1)
 
-    return modifier * amount
+    count, unit = _AMOUNT_RE.match(amount).groups()
+
+    return int(count) * _UNITS.get(unit, 1), unit or None
 
 
 def parse_rate_string(rate):
     """
-    takes a rate string, like 10/15m or 5/s
+    takes a rate string, like 10/15m, 5/s or 10MB/m
     and returns:
-    1. maximum number of requests
+    1. maximum number of requests (or total cost, for weighted rates)
     2. seconds from now when requests counter resets
 
-    valid time modifiers:
+    valid time modifiers, after an optional (fractional) amount:
+    ms - milliseconds
     s - seconds
     m - minutes
     h - hours
+    d - days
     """
 
     requests, time_to_reset = rate.split("/")
 
-    return int(requests), to_seconds(time_to_reset)
+    return parse_amount(requests)[0], to_seconds(time_to_reset)
 
 
 def parse_expression(expression):
     """
-    takes expressions like 'vova:10/s' and returns selector and rate.
+    takes expressions like 'vova:10/s', 'vova:10-100/s' or 'vova:conc=5'
+    and returns selector and rate.
     raises an exception on malformed rules.
     """
 
@@ -54,11 +95,48 @@ def parse_expression(expression):
 
 
 class Rule(object):
+    """
+    a parsed rule, either a rate (allowed_requests per requests_span),
+    or a concurrency rule like 'user:conc=5', allowing that many requests
+    in flight, which has a concurrency and no requests_span.
+
+    an adaptive rate, like '20-200/s', allows between min_requests and
+    max_requests per requests_span, as adjusted at runtime, see
+    rate_limit.adaptive. its allowed_requests is max_requests.
+    """
+
     def __init__(self, rule):
         selector, rate = parse_expression(rule)
-        allowed_requests, requests_span = parse_rate_string(rate)
 
         self.selector = selector
         self.rate = rate
+        self.adaptive = False
+        self.min_requests = None
+        self.max_requests = None
+
+        if rate.startswith("conc="):
+            self.concurrency = int(rate[len("conc="):])
+            self.unit = None
+            self.allowed_requests = self.concurrency
+            self.requests_span = None
+            return
+
+        amount, span = rate.split("/")
+
+        if "-" in amount:
+            self.adaptive = True
+            self.min_requests, self.max_requests = [
+                int(bound) for bound in amount.split("-")
+            ]
+
+            if self.min_requests > self.max_requests:
+                raise SyntaxError("Malformed rule")
+
+            rate = "%d/%s" % (self.max_requests, span)
+
+        allowed_requests, requests_span = parse_rate_string(rate)
+
+        self.concurrency = None
+        self.unit = parse_amount(rate.split("/")[0])[1]
         self.allowed_requests = allowed_requests
         self.requests_span = requests_span
@@ -0,0 +1,46 @@
+from rate_limit.utils import join_non_empty
+import random
+import copy
+
+
+def pick_shard(shards):
+    """
+    picks the shard a request goes to
+    """
+
+    return random.randrange(shards)
+
+
+def get_shard_identifier(identifier, shard):
+    """
+    returns the identifier of one of the sub-keys of identifier
+    """
+
+    return join_non_empty(":", identifier, "shard", shard)
+
+
+def get_shard_rule(rule, shard, shards):
+    """
+    returns a copy of rule, allowing the shard's share of
+    rule.allowed_requests. the remainder is spread over the first shards,
+    and every shard allows at least one request.
+    """
+
+    allowed_requests, remainder = divmod(rule.allowed_requests, shards)
+
+    res = copy.copy(rule)
+    res.allowed_requests = max(1, allowed_requests + (shard < remainder))
+
+    return res
+
+
+def get_spill_order(shard, shards):
+    """
+    returns the shards a request may go to, its own shard first
+    and then its neighbour, to even out skew between shards.
+    """
+
+    if shards == 1:
+        return [shard]
+
+    return [shard, (shard + 1) % shards]
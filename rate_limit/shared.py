@@ -0,0 +1,559 @@
+from __future__ import absolute_import
+from .client import RateLimit
+from .limit import Limit, is_empty
+from .identifiers import digest
+from .utils import string_types
+from tornado.gen import coroutine, Return, sleep
+from tornado.locks import Lock
+from contextlib import contextmanager
+import tempfile
+import struct
+import fcntl
+import errno
+import mmap
+import os
+
+# the table file starts with a header: magic, sets, ways, ring capacity.
+# it's followed by sets * ways buckets, a set is the ways buckets an
+# identifier can live in, guarded by its own lock.
+#
+# bucket: identifier hash (0 when empty), expiration time, slot of the
+# newest request, number of requests, followed by a ring buffer of capacity
+# request timestamps. all in native byte order, timestamps are doubles.
+MAGIC = b"RLSM"
+HEADER = struct.Struct("=4sIIII")
+BUCKET = struct.Struct("=QdII")
+SLOT = struct.Struct("=d")
+
+
+def hash_identifier(identifier):
+    """
+    returns a non zero 64 bit hash of identifier
+    """
+
+    return struct.unpack("=Q", digest(identifier, 8))[0] or 1
+
+
+class SharedMemoryTable(object):
+    """
+    a fixed size, set associative hash table of requests logs in a memory
+    mapped file, shared by the processes mapping it.
+
+    an identifier is hashed to a set and kept in one of its buckets,
+    when all of them are taken the bucket expiring first is evicted.
+    every set is guarded by an fcntl lock on its own byte, so processes
+    only contend on identifiers of the same set.
+    """
+
+    def __init__(self, path=None, sets=4096, ways=4, capacity=64,
+                 lock_stripes=1024):
+        """
+        Args:
+            path: the file backing the table, workers that open the same
+                path share it. by default an anonymous temporary file is
+                used, so the table has to be created before forking.
+            sets: the number of sets (Default: 4096)
+            ways: buckets per set (Default: 4)
+            capacity: the most requests a bucket logs, rules can't allow
+                more requests than that. (Default: 64)
+            lock_stripes: the number of locks RateLimit.get_lock keys are
+                spread over. (Default: 1024)
+        """
+
+        self.sets = sets
+        self.ways = ways
+        self.capacity = capacity
+        self.lock_stripes = lock_stripes
+
+        self.bucket_size = BUCKET.size + capacity * SLOT.size
+        self.size = HEADER.size + sets * ways * self.bucket_size
+
+        if path is None:
+            self.file = tempfile.TemporaryFile()
+        else:
+            self.file = os.fdopen(
+                os.open(path, os.O_RDWR | os.O_CREAT, 0o600), "r+b"
+            )
+
+        self.fd = self.file.fileno()
+
+        # set locks are the bytes [0, sets), key locks follow them and
+        # the last byte guards initialization. fcntl locks are advisory,
+        # so they don't have to lie within the file.
+        with self.locked(sets + lock_stripes):
+            self.initialize()
+
+        self.mmap = mmap.mmap(self.fd, self.size)
+
+        self._locks = {}
+
+    def initialize(self):
+        """
+        sizes and stamps a new table file, checks an existing one
+        was created with the same dimensions.
+        """
+
+        header = HEADER.pack(MAGIC, self.sets, self.ways, self.capacity, 0)
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        existing = os.read(self.fd, HEADER.size)
+
+        if existing and existing != header:
+            raise ValueError("shared memory table has different dimensions")
+
+        if not existing:
+            os.ftruncate(self.fd, self.size)
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            os.write(self.fd, header)
+
+    @contextmanager
+    def locked(self, offset):
+        """
+        holds the fcntl lock of the byte at offset
+        """
+
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, offset, os.SEEK_SET)
+
+        try:
+            yield
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, offset, os.SEEK_SET)
+
+    def find_bucket(self, key_hash, now, claim=False):
+        """
+        returns the offset of the bucket holding key_hash, call under the
+        set lock. if claim, a free, expired, or expiring first bucket of
+        the set is taken for it, otherwise None is returned.
+        """
+
+        first = (key_hash % self.sets) * self.ways
+        victim, victim_expires = None, None
+
+        for way in range(self.ways):
+            offset = HEADER.size + (first + way) * self.bucket_size
+            bucket_hash, expires, _, _ = BUCKET.unpack_from(self.mmap, offset)
+
+            if bucket_hash == key_hash and expires > now:
+                return offset
+
+            if victim is None or expires < victim_expires:
+                victim, victim_expires = offset, expires
+
+        if not claim:
+            return None
+
+        BUCKET.pack_into(self.mmap, victim, key_hash, 0, self.capacity - 1, 0)
+
+        return victim
+
+    def check_capacity(self, allowed_requests):
+        if allowed_requests > self.capacity:
+            raise RuntimeError(
+                "rule allows more requests than the table capacity"
+            )
+
+    def lookup(self, identifier, index, now):
+        """
+        returns the timestamp of the index-th (0 based) newest request
+        logged for identifier, None if there is none.
+        """
+
+        self.check_capacity(index + 1)
+        key_hash = hash_identifier(identifier)
+
+        with self.locked(key_hash % self.sets):
+            offset = self.find_bucket(key_hash, now)
+
+            if offset is None:
+                return None
+
+            _, _, head, count = BUCKET.unpack_from(self.mmap, offset)
+
+            if count <= index:
+                return None
+
+            slot = (head - index) % self.capacity
+
+            return SLOT.unpack_from(
+                self.mmap, offset + BUCKET.size + slot * SLOT.size
+            )[0]
+
+    def get_log(self, identifier, now):
+        """
+        returns the timestamps logged for identifier, newest first
+        """
+
+        key_hash = hash_identifier(identifier)
+
+        with self.locked(key_hash % self.sets):
+            offset = self.find_bucket(key_hash, now)
+
+            if offset is None:
+                return []
+
+            _, _, head, count = BUCKET.unpack_from(self.mmap, offset)
+
+            return [SLOT.unpack_from(
+                self.mmap,
+                offset + BUCKET.size + ((head - i) % self.capacity) * SLOT.size
+            )[0] for i in range(count)]
+
+    def push(self, identifier, params, now, count=1):
+        """
+        logs count requests at now for identifier, which expires
+        params["requests_span"] seconds later.
+        """
+
+        self.check_capacity(params["allowed_requests"])
+        key_hash = hash_identifier(identifier)
+
+        with self.locked(key_hash % self.sets):
+            offset = self.find_bucket(key_hash, now, claim=True)
+            _, _, head, logged = BUCKET.unpack_from(self.mmap, offset)
+
+            for _ in range(min(count, self.capacity)):
+                head = (head + 1) % self.capacity
+                SLOT.pack_into(
+                    self.mmap, offset + BUCKET.size + head * SLOT.size, now
+                )
+
+            BUCKET.pack_into(
+                self.mmap, offset, key_hash, now + params["requests_span"],
+                head, min(logged + count, self.capacity)
+            )
+
+    @coroutine
+    def acquire(self, key, exclusive=True, polling_interval=0.1):
+        """
+        takes the lock of key, a tornado Lock excludes the coroutines
+        of this process, and if exclusive, an fcntl lock the other
+        processes. the fcntl lock is tried without blocking, and retried
+        every polling_interval seconds, so a busy stripe doesn't stall
+        the IOLoop. returns the stripe that was locked.
+        """
+
+        stripe = self.get_stripe(key)
+        lock = self._locks.setdefault(stripe, Lock())
+
+        yield lock.acquire()
+
+        try:
+            while exclusive and not self.try_lock(self.sets + stripe):
+                yield sleep(polling_interval)
+        except Exception:
+            lock.release()
+            raise
+
+        raise Return(stripe)
+
+    def get_stripe(self, key):
+        return hash_identifier(key) % self.lock_stripes
+
+    def lock_key(self, key):
+        """
+        takes the fcntl lock of key's stripe, blocking until it's free,
+        for synchronous callers, returns the stripe that was locked.
+        fcntl locks are per process, so this process's coroutines aren't
+        excluded, they don't hold a stripe across a yield though.
+        """
+
+        stripe = self.get_stripe(key)
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, self.sets + stripe,
+                    os.SEEK_SET)
+
+        return stripe
+
+    def unlock_key(self, stripe):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, self.sets + stripe,
+                    os.SEEK_SET)
+
+    def try_lock(self, offset):
+        """
+        takes the fcntl lock of the byte at offset if it's free,
+        returns whether it was taken.
+        """
+
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, offset,
+                        os.SEEK_SET)
+        except IOError as e:
+            if e.errno in (errno.EACCES, errno.EAGAIN):
+                return False
+
+            raise
+
+        return True
+
+    def release(self, stripe, exclusive=True):
+        if exclusive:
+            self.unlock_key(stripe)
+
+        self._locks[stripe].release()
+
+    def close(self):
+        self.mmap.close()
+        self.file.close()
+
+
+class SharedMemoryRateLimit(RateLimit):
+    """
+    RateLimit keeping the requests logs in a SharedMemoryTable, so
+    processes forked on the same host share limits without a network
+    round trip.
+
+    given a remote RateLimit, it's a tier in front of it: every request
+    is logged in both, and since the host's requests are a subset of the
+    remote's, a rule reached locally is reached remotely too, so those
+    requests are denied without asking the remote. the coroutines of a
+    process queue on a local lock before taking the remote one, instead
+    of all polling the remote lock.
+
+    weighted, concurrency, adaptive and approximate rules are only
+    supported with a remote, which handles them.
+    """
+
+    def __init__(self, table=None, namespace="", disable_locks=False,
+                 remote=None, **kwargs):
+        """
+        Args:
+            table: a SharedMemoryTable, created before forking or opened
+                by path in every worker. (Default: a new anonymous table)
+            remote: a RateLimit to tier in front of. (Default: None)
+
+            the rest of the arguments are the same as RateLimit's.
+        """
+
+        super(SharedMemoryRateLimit, self).__init__(
+            None, namespace, disable_locks, **kwargs
+        )
+
+        self.table = table or SharedMemoryTable()
+        self.remote = remote
+
+    def get_local_plan(self, key):
+        """
+        returns the Plan of key for check, None if its rules were removed,
+        raises a RuntimeError if its decisions need more than the table.
+        """
+
+        plan = self._plans[key]
+
+        if plan is None:
+            return None
+
+        if (self.remote is not None or self.heavy_hitters is not None or
+                self.events is not None or plan.adaptive_rules or
+                self._tenants.get(key) is not None or
+                self._sketches.get(key) is not None or
+                self._priorities.get(key) is not None or
+                any(rule.unit is not None or rule.concurrency is not None
+                    for rule in plan.rules.values())):
+            raise RuntimeError(
+                "check only supports request count rules, without a remote"
+            )
+
+        return plan
+
+    def check(self, key, selector=None, **selectors):
+        """
+        decides on a request of key against the rules defined for it, like
+        Limit.request_limit_reached does, but synchronously: the request
+        is logged if it's allowed, and whether the limit was reached is
+        returned.
+
+        no coroutines are involved, so a decision is a few table lookups,
+        for host-local limits on a hot path. only request count rules are
+        supported, and no remote, tenants, sketches, priorities, heavy
+        hitters or events. the key's stripe is locked, blocking, across
+        the lookups and the log, unless locks are disabled.
+        """
+
+        plan = self.get_local_plan(key)
+
+        # the rules of the key were removed, see RateLimit.remove_rules
+        if plan is None:
+            return False
+
+        limit = Limit(self, plan.tree, key, selector, **selectors)
+        limit.plan = plan
+        decision = limit.create_decision()
+        now = self.clock()
+
+        def is_rule_reached(rule):
+            rule = plan.get_rule(rule)
+            selector_value = limit.get_selector(rule.selector, decision)
+
+            if rule.selector is not None and is_empty(selector_value):
+                return False
+
+            timestamp = self.table.lookup(
+                self.add_namespace(plan.get_list_identifier(
+                    limit.create_identifier(rule.selector, selector_value),
+                    rule
+                )),
+                rule.allowed_requests - 1,
+                now
+            )
+
+            return (timestamp is not None and
+                    now - timestamp < rule.requests_span)
+
+        if not self.disable_locks:
+            stripe = self.table.lock_key(
+                self.add_namespace(limit.get_lock_identifier())
+            )
+
+        try:
+            if isinstance(plan.tree, string_types):
+                reached = is_rule_reached(plan.tree)
+            else:
+                reached = plan.tree.evaluate(is_rule_reached)
+
+            if not reached:
+                selectors_to_update = limit.get_relevant_selectors(decision)
+
+                for identifier, params in selectors_to_update.items():
+                    self.table.push(self.add_namespace(identifier), params,
+                                    now)
+        finally:
+            if not self.disable_locks:
+                self.table.unlock_key(stripe)
+
+        self.metrics.decision(key, reached)
+
+        return reached
+
+    @coroutine
+    def is_rate_limit_reached(self, key, rule):
+        timestamp = self.table.lookup(
+            self.add_namespace(key), rule.allowed_requests - 1, self.clock()
+        )
+
+        if timestamp is not None:
+            if self.clock() - timestamp < rule.requests_span:
+                raise Return(True)
+
+        if self.remote is not None:
+            res = yield self.remote.is_rate_limit_reached(key, rule)
+            raise Return(res)
+
+        raise Return(False)
+
+    @coroutine
+    def is_cost_limit_reached(self, key, rule, cost):
+        if self.remote is None:
+            raise RuntimeError(
+                "SharedMemoryRateLimit doesn't support weighted rules"
+            )
+
+        res = yield self.remote.is_cost_limit_reached(key, rule, cost)
+        raise Return(res)
+
+    @coroutine
+    def is_concurrency_limit_reached(self, key, rule):
+        if self.remote is None:
+            raise RuntimeError(
+                "SharedMemoryRateLimit doesn't support concurrency rules"
+            )
+
+        res = yield self.remote.is_concurrency_limit_reached(key, rule)
+        raise Return(res)
+
+    @coroutine
+    def is_sketch_limit_reached(self, key, rule, cells):
+        if self.remote is None:
+            raise RuntimeError(
+                "SharedMemoryRateLimit doesn't support approximate rules"
+            )
+
+        res = yield self.remote.is_sketch_limit_reached(key, rule, cells)
+        raise Return(res)
+
+    @coroutine
+    def update_adaptive_limit(self, name, rule, adaptive, stats):
+        if self.remote is None:
+            raise RuntimeError(
+                "SharedMemoryRateLimit doesn't support adaptive rules"
+            )
+
+        res = yield self.remote.update_adaptive_limit(
+            name, rule, adaptive, stats
+        )
+        raise Return(res)
+
+    @coroutine
+    def release_slots(self, leases):
+        yield self.remote.release_slots(leases)
+
+    @coroutine
+    def log_request(self, selectors_to_update):
+        now = self.clock()
+
+        for key, params in selectors_to_update.items():
+            if not set(params) & set(["cost", "lease", "cells"]):
+                self.table.push(self.add_namespace(key), params, now)
+
+        if self.remote is not None:
+            yield self.remote.log_request(selectors_to_update)
+
+    @coroutine
+    def get_requests_logs(self, selectors):
+        if self.remote is not None:
+            res = yield self.remote.get_requests_logs(selectors)
+            raise Return(res)
+
+        now = self.clock()
+
+        raise Return(dict(
+            (key, self.table.get_log(self.add_namespace(key), now))
+            for key in selectors
+        ))
+
+    @coroutine
+    def push_requests(self, pushed, selectors_to_update, now):
+        for key, count in pushed.items():
+            self.table.push(
+                self.add_namespace(key), selectors_to_update[key], now, count
+            )
+
+        if self.remote is not None:
+            yield self.remote.push_requests(pushed, selectors_to_update, now)
+
+    @coroutine
+    def get_lock(self, key):
+        """
+        queues the coroutines of this process on the key's stripe, other
+        processes are excluded by the fcntl lock of the stripe, or given a
+        remote, by its lock. the fcntl lock is then not taken, so it's
+        never held across a round trip.
+        """
+
+        if self.disable_locks:
+            raise Return(None)
+
+        exclusive = self.remote is None
+        stripe = yield self.table.acquire(
+            self.add_namespace(key), exclusive, self.lock_polling_interval
+        )
+        remote_lock = None
+
+        if self.remote is not None:
+            try:
+                remote_lock = yield self.remote.get_lock(key)
+            except Exception:
+                self.table.release(stripe, exclusive)
+                raise
+
+        raise Return((stripe, remote_lock))
+
+    @coroutine
+    def release_lock(self, lock):
+        if self.disable_locks:
+            raise Return(None)
+
+        stripe, remote_lock = lock
+
+        try:
+            if self.remote is not None:
+                yield self.remote.release_lock(remote_lock)
+        finally:
+            self.table.release(stripe, self.remote is None)
@@ -0,0 +1,269 @@
+"""
+replays traffic through rate limiters on a virtual clock, at full speed,
+and compares what each configuration admitted with what an exact limiter
+(a sequential MemoryRateLimit with locks) would have admitted.
+
+e.g, to measure the over admissions of disabling locks:
+
+    simulator = Simulator(And('user:10/s', '100/m'), generate_traffic(
+        rate=50, duration=600, selectors={"user": 20}, seed=1
+    ))
+
+    for report in simulator.compare([
+        ("locks", lambda **kwargs: MemoryRateLimit(
+            interleave=True, **kwargs), 16),
+        ("no locks", lambda **kwargs: MemoryRateLimit(
+            interleave=True, disable_locks=True, **kwargs), 16),
+    ]):
+        print(report)
+"""
+from __future__ import absolute_import
+from __future__ import division
+from .memory import MemoryRateLimit
+from .metrics import Metrics
+from .plan import Plan
+from .utils import join_non_empty
+from tornado.gen import coroutine, Return
+from tornado.ioloop import IOLoop
+from timeit import default_timer
+from collections import deque
+import random
+
+
+class VirtualClock(object):
+    """
+    a clock that only moves when told to, pass it as RateLimit's clock.
+    """
+
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def set(self, now):
+        self.now = now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def generate_traffic(rate, duration, selectors=None, start=0, seed=None):
+    """
+    generates a Poisson arrivals of rate requests per second for duration
+    seconds, returns a list of (timestamp, selectors dict) tuples.
+
+    selectors maps a selector name to its cardinality, every request gets
+    a uniformly random value out of cardinality values for each selector.
+    """
+
+    rand = random.Random(seed)
+    selectors = selectors or {}
+    res = []
+    timestamp = start
+
+    while True:
+        timestamp += rand.expovariate(rate)
+
+        if timestamp >= start + duration:
+            return res
+
+        res.append((timestamp, dict(
+            (name, "%s%d" % (name, rand.randrange(cardinality)))
+            for name, cardinality in selectors.items()
+        )))
+
+
+def read_access_log(lines):
+    """
+    parses recorded traffic, a request per line, its timestamp (seconds)
+    followed by its selectors as name=value pairs:
+
+    1500000000.25 user=vova ip=8.8.8.8
+
+    empty lines and lines starting with # are skipped.
+    """
+
+    res = []
+
+    for line in lines:
+        line = line.strip()
+
+        if not line or line.startswith("#"):
+            continue
+
+        timestamp, _, pairs = line.partition(" ")
+        res.append((float(timestamp), dict(
+            pair.split("=", 1) for pair in pairs.split()
+        )))
+
+    return res
+
+
+def get_max_window_count(timestamps, span):
+    """
+    returns the most timestamps (sorted) falling within any span seconds
+    """
+
+    window = deque()
+    res = 0
+
+    for timestamp in timestamps:
+        window.append(timestamp)
+
+        while timestamp - window[0] >= span:
+            window.popleft()
+
+        res = max(res, len(window))
+
+    return res
+
+
+class Simulator(object):
+    """
+    replays traffic through rate limiter configurations.
+
+    a configuration is a (name, factory, concurrency) tuple, factory is
+    called with the clock and metrics keyword arguments and returns
+    a RateLimit (or a subclass). the traffic is replayed concurrency
+    requests at a time, the clock set to the latest arrival of each chunk.
+    """
+
+    def __init__(self, rules, traffic, key="simulation"):
+        self.rules = rules
+        self.traffic = sorted(traffic, key=lambda request: request[0])
+        self.key = key
+
+        self._ideal = None
+
+    @coroutine
+    def replay(self, factory, concurrency=1):
+        """
+        returns a list of booleans, True for every admitted request,
+        the metrics of the run and how long it took.
+        """
+
+        clock = VirtualClock()
+        metrics = Metrics()
+        rl = factory(clock=clock, metrics=metrics)
+        rl.limit(self.rules, key=self.key)
+
+        admitted = []
+
+        @coroutine
+        def decide(selectors):
+            limit = rl.limit(key=self.key, **selectors)
+            reached = yield limit.request_limit_reached()
+            raise Return(not reached)
+
+        start = default_timer()
+
+        for i in range(0, len(self.traffic), concurrency):
+            chunk = self.traffic[i:i + concurrency]
+            clock.set(chunk[-1][0])
+
+            res = yield [decide(selectors) for _, selectors in chunk]
+            admitted.extend(res)
+
+        raise Return((admitted, metrics, default_timer() - start))
+
+    @coroutine
+    def get_ideal(self):
+        """
+        returns what an exact limiter admits, computed once
+        """
+
+        if self._ideal is None:
+            self._ideal, _, _ = yield self.replay(MemoryRateLimit)
+
+        raise Return(self._ideal)
+
+    def get_window_excess(self, admitted, rules):
+        """
+        returns, per rate rule, the most admitted requests within any
+        window of the rule, beyond the rule's allowed requests.
+        """
+
+        res = {}
+
+        for rule in rules:
+            if rule.concurrency is not None:
+                continue
+
+            timestamps = {}
+
+            for (timestamp, selectors), allowed in zip(self.traffic,
+                                                       admitted):
+                if not allowed:
+                    continue
+
+                if rule.selector is not None:
+                    if rule.selector not in selectors:
+                        continue
+
+                    value = selectors[rule.selector]
+                else:
+                    value = None
+
+                timestamps.setdefault(value, []).append(timestamp)
+
+            count = max([
+                get_max_window_count(values, rule.requests_span)
+                for values in timestamps.values()
+            ] or [0])
+
+            res[join_non_empty(":", rule.selector, rule.rate)] = max(
+                0, count - rule.allowed_requests
+            )
+
+        return res
+
+    @coroutine
+    def run(self, name, factory, concurrency=1):
+        """
+        replays the traffic through one configuration, returns its report
+        """
+
+        ideal = yield self.get_ideal()
+        admitted, metrics, elapsed = yield self.replay(factory, concurrency)
+        rules = Plan(self.rules).get_rules()
+        requests = len(self.traffic)
+
+        over = sum(1 for a, i in zip(admitted, ideal) if a and not i)
+        under = sum(1 for a, i in zip(admitted, ideal) if i and not a)
+
+        raise Return({
+            "name": name,
+            "concurrency": concurrency,
+            "requests": requests,
+            "admitted": sum(admitted),
+            "ideal_admitted": sum(ideal),
+            "over_admitted": over,
+            "under_admitted": under,
+            "error": (sum(admitted) - sum(ideal)) / max(sum(ideal), 1),
+            "window_excess": self.get_window_excess(admitted, rules),
+            "ideal_window_excess": self.get_window_excess(ideal, rules),
+            "round_trips_per_decision": (
+                metrics.get_counter("redis_round_trips_total") /
+                max(requests, 1)
+            ),
+            "seconds_per_decision": elapsed / max(requests, 1),
+        })
+
+    def compare(self, configurations):
+        """
+        runs every (name, factory, concurrency) configuration on the
+        current IOLoop, returns their reports.
+        """
+
+        @coroutine
+        def run_all():
+            res = []
+
+            for name, factory, concurrency in configurations:
+                report = yield self.run(name, factory, concurrency)
+                res.append(report)
+
+            raise Return(res)
+
+        return IOLoop.current().run_sync(run_all)
@@ -0,0 +1,109 @@
+from __future__ import division
+from rate_limit.rule import Rule
+from rate_limit.utils import join_non_empty, string_types
+import hashlib
+import struct
+import math
+
+
+def get_sketch_identifier(key, rule):
+    """
+    approximate rules keep a sketch per key and rule, instead of
+    a requests list per selector value
+    """
+
+    return join_non_empty(":", "cms", key, rule.selector, rule.rate)
+
+
+class CountMinSketch(object):
+    """
+    approximate counting for rules on selectors of huge cardinality,
+    e.g 'ip:100/m' during an attack. give it to RateLimit.limit with the
+    rules to approximate.
+
+    instead of a requests list per selector value, each of those rules
+    keeps a count-min sketch per fixed window: depth rows of width
+    counters, a request increments one counter per row, picked by hashing
+    the selector value. the smallest of its counters is the estimate of
+    a selector value, it can only be too high, by colliding values, so
+    errors deny requests rather than admit them. windows rotate like
+    keys expire, and the previous window counts in full until it rolls
+    over, so the sliding window isn't under-counted either.
+
+    memory is fixed, 2 windows of width * depth counters per rule, no
+    matter how many selector values there are. with probability
+    confidence, an estimate is over by less than error times the requests
+    of the window.
+    """
+
+    def __init__(self, rules, error=0.001, confidence=0.99,
+                 max_counters=None):
+        """
+        Args:
+            rules: the rules to count approximately, a rule string or
+                a list of them, e.g ['ip:100/m']
+            error: the over-count bound, as a fraction of the requests
+                in a window. (Default: 0.001)
+            confidence: the probability an estimate is within the bound.
+                (Default: 0.99)
+            max_counters: the memory budget, counters per window. narrows
+                the sketch, loosening the error bound, if it needs more.
+                (Default: None, no budget)
+        """
+
+        if isinstance(rules, string_types):
+            rules = [rules]
+
+        self.rules = set()
+
+        for rule in rules:
+            rule = Rule(rule)
+
+            if (rule.unit is not None or rule.concurrency is not None or
+                    rule.adaptive):
+                raise RuntimeError(
+                    "only request count rules can be counted approximately"
+                )
+
+            self.rules.add(join_non_empty(":", rule.selector, rule.rate))
+
+        self.depth = max(1, int(math.ceil(math.log(1 / (1 - confidence)))))
+        self.width = int(math.ceil(math.e / error))
+
+        if max_counters is not None:
+            self.width = max(1, min(self.width, max_counters // self.depth))
+
+        self.error = math.e / self.width
+        self.confidence = confidence
+
+    def counts(self, rule):
+        """
+        returns if rule (a compiled Rule) is counted approximately
+        """
+
+        return join_non_empty(":", rule.selector, rule.rate) in self.rules
+
+    def get_cells(self, value):
+        """
+        returns the counters of value, one per row, as indexes into
+        the flattened rows.
+        """
+
+        first, second = struct.unpack(
+            "=QQ", hashlib.sha1(str(value).encode("utf-8")).digest()[:16]
+        )
+
+        return [
+            row * self.width + (first + row * second) % self.width
+            for row in range(self.depth)
+        ]
+
+    def describe(self):
+        return {
+            "rules": sorted(self.rules),
+            "width": self.width,
+            "depth": self.depth,
+            "counters_per_window": self.width * self.depth,
+            "error": self.error,
+            "confidence": self.confidence,
+        }
@@ -0,0 +1,217 @@
+from __future__ import absolute_import
+from .grammer import dump_rules, load_rules
+from .utils import join_non_empty
+from tornado.gen import coroutine, Task, Return
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornadoredis.exceptions import RedisError
+import logging
+import json
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class FileRuleSource(object):
+    """
+    rules stored in a JSON file, a key:rules object, where rules are
+    serialized with dump_rules, e.g:
+
+    {"search": {"and": ["user:5/s", "100/m"]}, "login": "ip:10/m"}
+
+    the file is versioned by its modification time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @coroutine
+    def get_version(self):
+        raise Return(os.stat(self.path).st_mtime)
+
+    @coroutine
+    def load(self):
+        """
+        returns the version and the key:rules dict
+        """
+
+        version = os.stat(self.path).st_mtime
+
+        with open(self.path) as source:
+            rules = json.load(source)
+
+        raise Return((version, dict(
+            (str(key), load_rules(key_rules))
+            for key, key_rules in rules.items()
+        )))
+
+
+class RedisRuleSource(object):
+    """
+    rules stored in a Redis hash of key:JSON serialized rules, versioned
+    by a counter bumped on every change, changes are also published to
+    a channel named after the counter.
+
+    name tells sources in the same namespace apart, e.g use "tenants"
+    for the rules of a TenantRules, stored by tenant instead of key.
+    """
+
+    def __init__(self, redis_conn, namespace="", name="rules"):
+        self.redis_conn = redis_conn
+        self.table = join_non_empty(":", namespace, name)
+        self.version_key = self.table + ":version"
+
+    @coroutine
+    def get_version(self):
+        response = yield Task(self.redis_conn.get, self.version_key)
+
+        if isinstance(response, RedisError):
+            raise response
+
+        raise Return(int(response or 0))
+
+    @coroutine
+    def load(self):
+        """
+        returns the version and the key:rules dict
+        """
+
+        pipe = self.redis_conn.pipeline()
+        pipe.get(self.version_key)
+        pipe.hgetall(self.table)
+
+        response = yield Task(pipe.execute)
+
+        if isinstance(response, RedisError):
+            raise response
+
+        version, rules = response
+
+        raise Return((int(version or 0), dict(
+            (key, load_rules(json.loads(key_rules)))
+            for key, key_rules in rules.items()
+        )))
+
+    @coroutine
+    def store(self, key, rules):
+        """
+        stores the rules of key, bumps the version and notifies
+        the processes listening (with the key). returns the new version.
+        """
+
+        pipe = self.redis_conn.pipeline()
+        pipe.hset(self.table, key, json.dumps(dump_rules(rules)))
+        pipe.incr(self.version_key)
+        pipe.publish(self.version_key, key)
+
+        response = yield Task(pipe.execute)
+
+        if isinstance(response, RedisError):
+            raise response
+
+        raise Return(response[1])
+
+    @coroutine
+    def delete(self, key):
+        """
+        deletes the rules of key, bumps the version and notifies the
+        processes listening. returns the new version.
+        """
+
+        pipe = self.redis_conn.pipeline()
+        pipe.hdel(self.table, key)
+        pipe.incr(self.version_key)
+        pipe.publish(self.version_key, key)
+
+        response = yield Task(pipe.execute)
+
+        if isinstance(response, RedisError):
+            raise response
+
+        raise Return(response[1])
+
+
+class RuleReloader(object):
+    """
+    keeps the rules of a RateLimit (or a TenantRules) in sync with
+    a rule source.
+
+    the source is polled for its version every interval seconds, and
+    reloaded when it changes. with RedisRuleSource, a pub/sub connection
+    can also be given to listen(), to reload as soon as rules are stored.
+    decisions never touch the source, they use the compiled plans of the
+    last reload. keys deleted from the source are removed on reload (see
+    RateLimit.remove_rules).
+    """
+
+    def __init__(self, rate_limit, source, interval=5):
+        self.rate_limit = rate_limit
+        self.source = source
+        self.interval = interval
+
+        self.version = None
+        self.periodic = None
+        self.keys = set()
+
+    @coroutine
+    def reload(self):
+        """
+        loads the rules from the source, returns the keys that changed,
+        removed keys included.
+        """
+
+        version, rules = yield self.source.load()
+        changed = self.rate_limit.set_rules(rules)
+        changed += self.rate_limit.remove_rules(
+            sorted(self.keys - set(rules))
+        )
+        self.keys = set(rules)
+        self.version = version
+
+        if changed:
+            logger.info("reloaded %d rules, version %s", len(changed), version)
+
+        raise Return(changed)
+
+    @coroutine
+    def check(self):
+        """
+        reloads the rules if the source version changed
+        """
+
+        try:
+            version = yield self.source.get_version()
+
+            if version != self.version:
+                yield self.reload()
+        except Exception:
+            logger.exception("failed reloading rules")
+
+    @coroutine
+    def start(self):
+        """
+        loads the rules and starts polling the source
+        """
+
+        yield self.reload()
+
+        self.periodic = PeriodicCallback(self.check, self.interval * 1000)
+        self.periodic.start()
+
+    def stop(self):
+        if self.periodic is not None:
+            self.periodic.stop()
+
+    def listen(self, pubsub_conn):
+        """
+        subscribes a dedicated tornadoredis connection to the changes
+        published by a RedisRuleSource.
+        """
+
+        def on_message(message):
+            if message.kind == "message":
+                IOLoop.current().add_future(self.check(), lambda f: None)
+
+        pubsub_conn.subscribe(
+            self.source.version_key,
+            callback=lambda _: pubsub_conn.listen(on_message)
+        )
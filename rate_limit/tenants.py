@@ -0,0 +1,139 @@
+from __future__ import absolute_import
+from .grammer import dump_rules
+from .metrics import NULL_METRICS
+from .plan import Plan
+from collections import OrderedDict
+from .utils import string_types
+import json
+
+
+def get_plan_key(rules):
+    """
+    returns a canonical string of a rule tree, equal trees
+    share a compiled plan.
+    """
+
+    return json.dumps(dump_rules(rules), sort_keys=True)
+
+
+class TenantRules(object):
+    """
+    per tenant rule overrides, a tenant being a value of selector
+    (e.g an apikey). give it to RateLimit.limit, and every decision uses
+    the rules of the request's tenant, tenants without an override use
+    the rules of the limit.
+
+    a tenant's rules are either a rule tree or the name of a tier, a rule
+    tree shared by many tenants (e.g free, paid). tenants are looked up in
+    a dict, and compiled plans are kept in an LRU of capacity plans shared
+    by equal rule trees, so the number of live plans is bounded no matter
+    how many tenants there are.
+    """
+
+    def __init__(self, selector, tiers=None, tenants=None, capacity=1000):
+        """
+        Args:
+            selector: the selector telling tenants apart, e.g "apikey"
+            tiers: a dict of tier name:rules
+            tenants: a dict of tenant:rules or tier name
+            capacity: the most compiled plans to keep (Default: 1000)
+        """
+
+        self.selector = selector
+        self.tiers = dict(tiers or {})
+        self.capacity = capacity
+
+        self.index = {}
+        self.plans = OrderedDict()
+        self._tenants = {}
+
+        self.set_rules(tenants or {})
+
+    def resolve(self, rules):
+        """
+        returns the rule tree and plan key of a tenant's rules
+        """
+
+        if isinstance(rules, string_types) and rules in self.tiers:
+            rules = self.tiers[rules]
+
+        return rules, get_plan_key(rules)
+
+    def set_rules(self, tenants):
+        """
+        sets the rules of tenants, a dict of tenant:rules or tier name,
+        e.g as loaded by a RedisRuleSource with name="tenants", so it can
+        be kept in sync by a RuleReloader. returns the tenants whose rules
+        changed.
+        """
+
+        changed = []
+
+        for tenant, rules in tenants.items():
+            tenant = str(tenant)
+            entry = self.resolve(rules)
+
+            if self.index.get(tenant, (None, None))[1] != entry[1]:
+                self.index[tenant] = entry
+                changed.append(tenant)
+
+            self._tenants[tenant] = rules
+
+        return changed
+
+    def set_tier(self, name, rules):
+        """
+        sets the rules of a tier, and of the tenants in it
+        """
+
+        self.tiers[name] = rules
+        self.set_rules(dict(
+            (tenant, tier) for tenant, tier in self._tenants.items()
+            if tier == name
+        ))
+
+    def remove(self, tenant):
+        """
+        removes the override of tenant
+        """
+
+        self.index.pop(str(tenant), None)
+        self._tenants.pop(str(tenant), None)
+
+    def remove_rules(self, tenants):
+        """
+        removes the overrides of tenants, e.g tenants deleted from a rule
+        source, returns the tenants that had one.
+        """
+
+        removed = [t for t in tenants if str(t) in self.index]
+
+        for tenant in removed:
+            self.remove(tenant)
+
+        return removed
+
+    def get(self, tenant, metrics=NULL_METRICS):
+        """
+        returns the rule tree and compiled plan of tenant,
+        None if it has no override.
+        """
+
+        entry = self.index.get(str(tenant))
+
+        if entry is None:
+            return None
+
+        rules, plan_key = entry
+        plan = self.plans.pop(plan_key, None)
+        metrics.cache("tenant_plan", plan is not None)
+
+        if plan is None:
+            plan = Plan(rules)
+
+            if len(self.plans) >= self.capacity:
+                self.plans.popitem(last=False)
+
+        self.plans[plan_key] = plan
+
+        return rules, plan
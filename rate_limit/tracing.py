@@ -0,0 +1,132 @@
+from timeit import default_timer
+import random
+
+
+class Span(object):
+    """
+    a timed operation, with tags and child spans. used as a context
+    manager, when a root span exits it's reported to its tracer.
+    """
+
+    def __init__(self, name, tracer=None, parent=None, **tags):
+        self.name = name
+        self.tracer = tracer
+        self.parent = parent
+        self.tags = tags
+        self.children = []
+
+        self.start = None
+        self.end = None
+
+    def child(self, name, **tags):
+        """
+        returns a new span, child of this span
+        """
+
+        span = Span(name, self.tracer, self, **tags)
+        self.children.append(span)
+
+        return span
+
+    def set_tag(self, key, value):
+        self.tags[key] = value
+
+    @property
+    def duration(self):
+        if self.start is None or self.end is None:
+            return None
+
+        return self.end - self.start
+
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = default_timer()
+
+        if exc_type is not None:
+            self.tags["error"] = exc_type.__name__
+
+        if self.parent is None and self.tracer is not None:
+            self.tracer.report(self)
+
+    def to_dict(self):
+        """
+        returns the span and its children as nested dicts
+        """
+
+        return {
+            "name": self.name,
+            "tags": self.tags,
+            "duration": self.duration,
+            "children": [child.to_dict() for child in self.children]
+        }
+
+
+class NullSpan(object):
+    """
+    a span that isn't recorded, its children are itself.
+    """
+
+    def child(self, name, **tags):
+        return self
+
+    def set_tag(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer(object):
+    """
+    traces a sample of the rate limit decisions, every decision gets
+    a span with child spans for taking the lock, every rule lookup
+    (with its identifier, rule and result), logging and releasing the lock.
+
+    finished decision spans are passed to reporter, subclass and override
+    report to forward them to a tracing system.
+    """
+
+    def __init__(self, sample_rate=1.0, reporter=None):
+        """
+        Args:
+            sample_rate: the fraction of decisions to trace (Default: 1.0)
+            reporter: a callable, called with every finished root Span
+        """
+
+        self.sample_rate = sample_rate
+        self.reporter = reporter
+
+    def trace(self, name, **tags):
+        """
+        returns a root span, or NULL_SPAN if this one isn't sampled
+        """
+
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return NULL_SPAN
+
+        return Span(name, self, **tags)
+
+    def report(self, span):
+        if self.reporter is not None:
+            self.reporter(span)
+
+
+class NullTracer(Tracer):
+    """
+    the default tracer, traces nothing.
+    """
+
+    def trace(self, name, **tags):
+        return NULL_SPAN
+
+
+NULL_TRACER = NullTracer()
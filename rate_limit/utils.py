@@ -1,3 +1,12 @@
+from __future__ import division
+from functools import wraps
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
 def join_non_empty(delimiter, *args):
     """
     join the string representation of all non empty args with delimiter.
@@ -5,3 +14,113 @@ def join_non_empty(delimiter, *args):
     """
 
     return delimiter.join([str(x) for x in args if x is not None and x != ""])
+
+
+# requests lists hold their base timestamp (ms) as their last element, and
+# each request as a millisecond delta from it, newest first. deltas are
+# signed 32 bit integers, which Redis keeps in the 4 bytes integer encoding
+# of a listpack, where a plain ms timestamp takes 8. a list is rebased once
+# its deltas would overflow, see client.PUSH_SCRIPT.
+MIN_DELTA = -2 ** 31
+MAX_DELTA = 2 ** 31 - 1
+
+
+def encode_timestamp(now):
+    """
+    returns the time (in milliseconds) of a request at now
+    """
+
+    return int(round(now * 1000))
+
+
+def get_age_ms(now, base, delta):
+    """
+    returns the milliseconds from the request stored as delta to now
+    """
+
+    return encode_timestamp(now) - int(base) - int(delta)
+
+
+def get_age(now, base, delta):
+    """
+    returns the seconds from the request stored as delta to now
+    """
+
+    return get_age_ms(now, base, delta) / 1000
+
+
+def decode_timestamp(base, delta):
+    """
+    returns the time (in seconds) of the request stored as delta
+    """
+
+    return (int(base) + int(delta)) / 1000
+
+
+def get_window(now, span):
+    """
+    returns the index of the fixed window of span seconds now falls in
+    """
+
+    return int(now // span)
+
+
+def get_sliding_estimate(current, previous, now, span, strict=False):
+    """
+    estimates the requests in the span seconds up to now from the counts
+    of the current and previous fixed windows, assuming the previous
+    window's requests were spread evenly over it. a burst at the end of
+    the previous window is under-counted then, admitting up to twice the
+    limit. if strict, the previous window counts in full until it rolls
+    over, so the estimate is never too low.
+    """
+
+    if strict:
+        return current + previous
+
+    overlap = 1 - (now - get_window(now, span) * span) / span
+
+    return current + previous * overlap
+
+
+# tornado.gen, once a lazy_coroutine was called
+_gen = []
+
+
+def import_gen():
+    """
+    returns tornado.gen, imported on the first call only
+    """
+
+    if not _gen:
+        from tornado import gen
+        _gen.append(gen)
+
+    return _gen[0]
+
+
+def lazy_coroutine(func):
+    """
+    same as tornado.gen.coroutine, only tornado is imported on the first
+    call, so modules of the core don't import it. use coroutine_return
+    instead of tornado.gen.Return in func.
+    """
+
+    wrapped = []
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not wrapped:
+            wrapped.append(import_gen().coroutine(func))
+
+        return wrapped[0](*args, **kwargs)
+
+    return wrapper
+
+
+def coroutine_return(value):
+    """
+    returns tornado.gen.Return(value), for lazy_coroutine functions
+    """
+
+    return import_gen().Return(value)
@@ -0,0 +1,156 @@
+from __future__ import absolute_import
+from .rule import Rule
+from timeit import default_timer
+from tornado.gen import coroutine
+from tornado.ioloop import IOLoop
+import math
+
+
+def get_request_selector(handler, source):
+    """
+    returns a callable taking a selector value from the request of
+    handler, by source:
+
+    - "header:<name>", the value of a request header
+    - "path:<index or name>", a positional or named group of the url
+    - "query:<name>", a query string argument (never the body)
+    - "remote_ip", the client's address
+    - a callable, called with the handler
+    """
+
+    if callable(source):
+        return lambda: source(handler)
+
+    if source == "remote_ip":
+        return lambda: handler.request.remote_ip
+
+    kind, _, name = source.partition(":")
+
+    if kind == "header":
+        return lambda: handler.request.headers.get(name)
+
+    if kind == "query":
+        return lambda: handler.get_query_argument(name, None)
+
+    if kind == "path":
+        if name.isdigit():
+            return lambda: (
+                handler.path_args[int(name)]
+                if int(name) < len(handler.path_args) else None
+            )
+
+        return lambda: handler.path_kwargs.get(name)
+
+    raise ValueError("Unknown selector source %r" % source)
+
+
+class RateLimitMixin(object):
+    """
+    a mixin for tornado RequestHandlers, deciding in prepare(), before
+    the handler's methods run, whether the request is allowed by the
+    rules defined for rate_limit_key:
+
+    class UploadHandler(RateLimitMixin, RequestHandler):
+        rate_limit = rl
+        rate_limit_key = "upload"
+        rate_limit_selectors = {"apikey": "header:X-Api-Key"}
+
+    selectors are taken from the request by rate_limit_selectors (see
+    get_request_selector), or from members of the handler, like
+    decorated bound methods.
+
+    a rejected request is finished with a 429, a Retry-After header of
+    the span of the rule that denied it and an X-RateLimit-Limit header
+    of its allowed requests (the share of the request's priority class,
+    see PriorityClasses), its handler methods are never called. with
+    tornado.web.stream_request_body, prepare() runs before the body is
+    read, so rejected uploads aren't read or parsed, otherwise tornado
+    has already read the body (but not the handler).
+
+    slots of concurrency rules are held until the request finishes,
+    and adaptive rules observe its latency, responses of 500 and up
+    count as errors.
+    """
+
+    rate_limit = None
+    rate_limit_key = None
+    rate_limit_selectors = {}
+
+    # Retry-After of denials without a span, such as concurrency rules
+    rate_limit_retry_after = 1
+
+    _limit = None
+    _limit_decision = None
+    _limit_start = None
+
+    def get_rate_limit_key(self):
+        """
+        the key the rules were defined for, defaults to the class name
+        """
+
+        return self.rate_limit_key or type(self).__name__
+
+    @coroutine
+    def prepare(self):
+        self._limit = self.rate_limit.limit(
+            key=self.get_rate_limit_key(),
+            selector=self,
+            **dict(
+                (name, get_request_selector(self, source))
+                for name, source in self.rate_limit_selectors.items()
+            )
+        )
+
+        decision = self._limit_decision = yield self._limit.decide()
+
+        if decision.reached:
+            self.on_rate_limited(decision.denied_rule)
+            return
+
+        self._limit_start = default_timer()
+
+    def on_rate_limited(self, denied_rule):
+        """
+        finishes a rejected request, denied_rule is the rule that denied
+        it, e.g "user:10/m", None if it was denied locally (see
+        HeavyHitters).
+        """
+
+        retry_after = self.rate_limit_retry_after
+
+        if denied_rule is not None:
+            rule = Rule(denied_rule)
+            priorities = self._limit.priorities
+
+            if priorities is not None:
+                rule = priorities.get_rule(
+                    rule, self._limit_decision.priority
+                )
+
+            if rule.requests_span is not None:
+                retry_after = rule.requests_span
+
+            self.set_header("X-RateLimit-Limit", rule.allowed_requests)
+
+        self.set_status(429, reason="Too Many Requests")
+        self.set_header("Retry-After", int(math.ceil(retry_after)))
+        self.finish()
+
+    def on_finish(self):
+        start, self._limit_start = self._limit_start, None
+
+        if start is not None:
+            self._limit.observe(
+                default_timer() - start, self.get_status() >= 500,
+                self._limit_decision
+            )
+
+            leases = self._limit_decision.leases
+
+            if leases:
+                IOLoop.current().add_future(
+                    self._limit.release_slots(leases),
+                    lambda future: future.result()
+                )
+
+        super(RateLimitMixin, self).on_finish()
@@ -1,7 +1,15 @@
 from tornado.concurrent import Future
+from fnmatch import fnmatchcase
 from mock import Mock
 import random
 import string
+import struct
+import re
+
+try:
+    import lupa
+except ImportError:
+    lupa = None
 
 
 def mocked_future_response(*args):
@@ -19,8 +27,289 @@ def mocked_future_response(*args):
     return Mock(side_effect=lambda *_: res)
 
 
+def lua_struct_format(fmt):
+    """
+    turns a Redis struct format of unsigned big endian integers, e.g
+    '>I8I4', into a python one
+    """
+
+    return ">" + "".join(
+        {"4": "I", "8": "Q"}[size] for size in re.findall(r"I(\d)", fmt)
+    )
+
+
 def gen_random_string():
     """
     returns a random string
     """
     return ''.join(random.choice(string.ascii_uppercase) for _ in range(5))
+
+
+class FakeRedis(object):
+    """
+    a tiny in memory stand-in for a tornadoredis client, implements
+    the commands used by RateLimit, calls callbacks synchronously and
+    counts round trips to Redis.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+        self.round_trips = 0
+
+    def __getattr__(self, name):
+        if name.startswith("do_"):
+            raise AttributeError(name)
+
+        command = getattr(self, "do_" + name)
+
+        def execute(*args, **kwargs):
+            callback = kwargs.pop("callback", None)
+            self.round_trips += 1
+            result = command(*args, **kwargs)
+
+            if callback is not None:
+                callback(result)
+
+        return execute
+
+    def pipeline(self, transactional=False):
+        return FakePipeline(self)
+
+    def do_scan(self, cursor, count=None, match="*"):
+        return [0, set(k for k in self.data if fnmatchcase(k, match))]
+
+    def do_renamenx(self, src, dst):
+        if dst in self.data:
+            return False
+
+        self.data[dst] = self.data.pop(src)
+        return True
+
+    def do_hset(self, key, field, value):
+        self.data.setdefault(key, {})[field] = str(value)
+
+    def do_hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    def do_hdel(self, key, *fields):
+        hash_ = self.data.get(key, {})
+        return len([hash_.pop(f) for f in fields if f in hash_])
+
+    def do_hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def do_hmget(self, key, fields):
+        return dict((field, self.do_hget(key, field)) for field in fields)
+
+    def do_hincrby(self, key, field, amount=1):
+        counters = self.data.setdefault(key, {})
+        counters[field] = str(int(counters.get(field, 0)) + amount)
+        return int(counters[field])
+
+    def do_sadd(self, key, *values):
+        members = self.data.setdefault(key, set())
+        added = set(values) - members
+        members.update(added)
+        return len(added)
+
+    def do_smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    def do_delete(self, *keys):
+        return len([self.data.pop(key) for key in keys if key in self.data])
+
+    def do_del(self, *keys):
+        return self.do_delete(*keys)
+
+    def do_incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+    def do_publish(self, channel, message):
+        self.published = getattr(self, "published", []) + [(channel, message)]
+        return 0
+
+    def do_execute_command(self, command, *args):
+        """
+        only XADD with an auto generated id, and MEMORY USAGE, are supported.
+        the memory of a key is 50 bytes, plus the size of its name and of
+        every element.
+        """
+
+        if command == "MEMORY":
+            assert args[0] == "USAGE"
+            value = self.data.get(args[1])
+
+            if value is None:
+                return None
+
+            if not isinstance(value, (list, set, dict)):
+                value = [value]
+
+            return 50 + len(args[1]) + sum(len(str(e)) for e in value)
+
+        assert command == "XADD"
+        stream = self.data.setdefault(args[0], [])
+        fields = args[list(args).index("*") + 1:]
+        stream.append(dict(zip(fields[::2], fields[1::2])))
+
+        return "%d-0" % len(stream)
+
+    def do_type(self, key):
+        value = self.data.get(key)
+
+        if value is None:
+            return "none"
+
+        # sorted sets are kept as sorted lists of (score, member)
+        if isinstance(value, list) and value and isinstance(value[0], tuple):
+            return "zset"
+
+        return {list: "list", dict: "hash", set: "set"}.get(
+            type(value), "string"
+        )
+
+    def do_eval(self, script, keys, args):
+        """
+        runs script with lupa, only the string and list commands and the
+        unsigned big endian integers of Redis's struct library are supported.
+        """
+
+        lua = lupa.LuaRuntime(encoding=None, unpack_returned_tuples=True)
+
+        def call(command, *args):
+            res = getattr(self, "do_" + command.lower())(
+                *[int(a) if isinstance(a, float) else a for a in args]
+            )
+
+            return lua.table(*res) if isinstance(res, list) else res
+
+        lua.globals().KEYS = lua.table(*keys)
+        lua.globals().ARGV = lua.table(*[str(arg) for arg in args])
+        lua.globals().redis = lua.table(call=call)
+        lua.globals().struct = lua.table(
+            pack=lambda fmt, *values: struct.pack(
+                lua_struct_format(fmt), *[int(v) for v in values]
+            ),
+            unpack=lambda fmt, data, pos=1: struct.unpack_from(
+                lua_struct_format(fmt), data, int(pos) - 1
+            ) + (int(pos) + struct.calcsize(lua_struct_format(fmt)),)
+        )
+
+        res = lua.execute(script)
+
+        if isinstance(res, float):
+            return int(res)
+
+        return None if res is False else res
+
+    def do_getrange(self, key, start, end):
+        return self.data.get(key, b"")[start:end + 1]
+
+    def do_set(self, key, value):
+        self.data[key] = value
+
+    def do_setrange(self, key, offset, value):
+        data = self.data.get(key, b"").ljust(offset, b"\0")
+        self.data[key] = data[:offset] + value + data[offset + len(value):]
+        return len(self.data[key])
+
+    def do_llen(self, key):
+        return len(self.data.get(key, []))
+
+    def do_hlen(self, key):
+        return len(self.data.get(key, {}))
+
+    def do_scard(self, key):
+        return len(self.data.get(key, set()))
+
+    def do_strlen(self, key):
+        return len(str(self.data.get(key, "")))
+
+    def do_get(self, key):
+        return self.data.get(key)
+
+    def do_lindex(self, key, index):
+        try:
+            return self.data.get(key, [])[index]
+        except IndexError:
+            return None
+
+    def do_lrange(self, key, start, end):
+        return self.data.get(key, [])[start:end + 1 if end != -1 else None]
+
+    def do_lpush(self, key, *values):
+        self.data.setdefault(key, [])[:0] = reversed([str(v) for v in values])
+        return len(self.data[key])
+
+    def do_rpush(self, key, *values):
+        self.data.setdefault(key, []).extend(str(v) for v in values)
+        return len(self.data[key])
+
+    def do_ltrim(self, key, start, end):
+        self.data[key] = self.do_lrange(key, start, end)
+        return True
+
+    def do_expire(self, key, ttl):
+        self.ttls[key] = int(ttl)
+        return key in self.data
+
+    def do_ttl(self, key):
+        return self.ttls.get(key) if key in self.data else -2
+
+    def do_zadd(self, key, score, member):
+        zset = [e for e in self.data.get(key, []) if e[1] != member]
+        self.data[key] = sorted(zset + [(float(score), member)])
+
+    def do_zrem(self, key, *members):
+        zset = self.data.get(key, [])
+        self.data[key] = [e for e in zset if e[1] not in members]
+        return len(zset) - len(self.data[key])
+
+    def do_zremrangebyscore(self, key, start, end):
+        """
+        only removing up to an inclusive maximum is supported
+        """
+
+        zset = self.data.get(key, [])
+        self.data[key] = [e for e in zset if e[0] > float(end)]
+        return len(zset) - len(self.data[key])
+
+    def do_zcard(self, key):
+        return len(self.data.get(key, []))
+
+    def do_zrevrange(self, key, start, end, with_scores):
+        members = [m for _, m in reversed(self.data.get(key, []))]
+        return members[start:end + 1 if end != -1 else None]
+
+    def do_zrangebyscore(self, key, start, end, offset=None, limit=None):
+        """
+        only exclusive minimums and an infinite maximum are supported
+        """
+
+        members = [m for score, m in self.data.get(key, [])
+                   if score > float(start.lstrip("("))]
+        return members[offset or 0:][:limit]
+
+
+class FakePipeline(object):
+    """
+    queues commands and runs them against a FakeRedis on execute,
+    in a single round trip.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.redis, "do_" + name)
+        return lambda *args, **kwargs: self.commands.append(
+            (command, args, kwargs)
+        )
+
+    def execute(self, callback=None):
+        self.redis.round_trips += 1
+        callback([command(*args, **kwargs)
+                  for command, args, kwargs in self.commands])
@@ -0,0 +1,148 @@
+from rate_limit.adaptive import AIMD, ADJUST_SCRIPT
+from rate_limit.memory import MemoryRateLimit
+from rate_limit.simulator import VirtualClock
+from rate_limit.rule import Rule
+from rate_limit import RateLimit, RateLimitExceeded
+from helpers import FakeRedis
+from tornado.testing import AsyncTestCase, gen_test
+from tornado.gen import coroutine
+from unittest import TestCase
+from mock import Mock
+
+
+class AIMDTestCase(TestCase):
+    def setUp(self):
+        self.aimd = AIMD(latency_target=0.1, error_threshold=0.1, interval=1)
+        self.rule = Rule("20-200/s")
+
+    def test_default_increase(self):
+        self.assertEqual(self.aimd.get_increase(self.rule), 9)
+        self.assertEqual(self.aimd.get_increase(Rule("1-5/s")), 1)
+        self.assertEqual(AIMD(increase=3).get_increase(self.rule), 3)
+
+    def test_starts_at_max(self):
+        state = {}
+
+        self.assertEqual(self.aimd.adjust(state, self.rule, (1, 0, 1), 0), 200)
+        self.assertEqual(state["count"], 1)
+
+    def test_adjusts_once_per_interval(self):
+        state = {"limit": 100, "start": 0}
+
+        self.assertEqual(self.aimd.adjust(state, self.rule, (5, 0, 5), 0.5),
+                         100)
+        self.assertEqual(self.aimd.adjust(state, self.rule, (5, 0, 0), 1), 50)
+        self.assertEqual(state["count"], 0)
+        self.assertEqual(self.aimd.adjust(state, self.rule, (5, 0, 0), 1.5),
+                         50)
+        self.assertEqual(self.aimd.adjust(state, self.rule, (5, 0, 0), 2), 59)
+
+    def test_errors_decrease(self):
+        state = {"limit": 100, "start": 0}
+
+        self.assertEqual(self.aimd.adjust(state, self.rule, (10, 2, 0), 1), 50)
+
+    def test_bounds(self):
+        state = {"limit": 30, "start": 0}
+        self.assertEqual(self.aimd.adjust(state, self.rule, (1, 1, 0), 1), 20)
+
+        state = {"limit": 195, "start": 0}
+        self.assertEqual(self.aimd.adjust(state, self.rule, (1, 0, 0), 1), 200)
+
+    def test_idle_window_keeps_limit(self):
+        state = {"limit": 100, "start": 0}
+
+        self.assertEqual(self.aimd.adjust(state, self.rule, (0, 0, 0), 5), 100)
+
+    def test_get_limit(self):
+        self.assertEqual(self.aimd.get_limit("k", 0), None)
+
+        self.aimd.set_limit("k", 50, 10)
+        self.assertEqual(self.aimd.get_limit("k", 10.5), 50)
+        self.assertEqual(self.aimd.get_limit("k", 11), None)
+
+    def test_flush(self):
+        self.aimd.observe("k", 0.5, False)
+        self.aimd.observe("k", 0.25, True)
+
+        self.assertEqual(self.aimd.flush("k"), (2, 1, 0.75))
+        self.assertEqual(self.aimd.flush("k"), (0, 0, 0))
+
+
+class AdaptiveLimitTestCase(AsyncTestCase):
+    @gen_test
+    def test_update_adaptive_limit(self):
+        redis = FakeRedis()
+        redis.eval = Mock(side_effect=lambda *args, **kwargs:
+                          kwargs["callback"](40))
+        rl = RateLimit(redis, namespace="ns", clock=lambda: 100)
+        aimd = AIMD(interval=2)
+
+        limit = yield rl.update_adaptive_limit(
+            "k:20-200/s", Rule("20-200/s"), aimd, (3, 1, 0.5)
+        )
+
+        self.assertEqual(limit, 40)
+        self.assertEqual(redis.eval.call_args[0], (
+            ADJUST_SCRIPT, ["ns:aimd:k:20-200/s"],
+            ["100", 2, 3, 1, "0.5", 20, 200, 0.5, 0.05, 9, 0.5, 3600]
+        ))
+
+    @gen_test
+    def test_sheds_load_when_slow(self):
+        clock = VirtualClock(100)
+        rl = MemoryRateLimit(clock=clock)
+        aimd = AIMD(latency_target=0.1, increase=1, interval=1)
+        limit = rl.limit('2-4/s', key="k", adaptive=aimd)
+
+        @limit
+        @coroutine
+        def call():
+            pass
+
+        # the backend is healthy, max_requests are allowed
+        for _ in range(4):
+            yield call()
+
+        with self.assertRaises(RateLimitExceeded):
+            yield call()
+
+        # the next window, the backend slows down
+        clock.advance(1)
+        yield call()
+        aimd.observe("k:2-4/s", 1, False)
+
+        clock.advance(1)
+
+        for _ in range(2):
+            yield call()
+
+        with self.assertRaises(RateLimitExceeded):
+            yield call()
+
+        self.assertEqual(rl.adaptive_state["k:2-4/s"]["limit"], 2)
+
+    @gen_test
+    def test_observes_errors(self):
+        rl = MemoryRateLimit(clock=VirtualClock(100))
+        aimd = AIMD()
+        limit = rl.limit('2-4/s', key="k", adaptive=aimd)
+
+        @limit
+        def fail():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            yield fail()
+
+        with (yield limit.cm()):
+            pass
+
+        self.assertEqual(aimd.flush("k:2-4/s")[:2], (2, 1))
+
+    @gen_test
+    def test_check_many_rejects_adaptive_rules(self):
+        rl = MemoryRateLimit()
+
+        with self.assertRaises(RuntimeError):
+            yield rl.check_many([('2-4/s', {}, 1)], key="k")
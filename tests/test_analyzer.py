@@ -0,0 +1,170 @@
+from rate_limit import RateLimit, HashedIdentifiers, Or
+from rate_limit.analyzer import (
+    KeyspaceAnalyzer, analyze_namespace, project_memory, get_length_bucket
+)
+from rate_limit.cluster import HashTags
+from rate_limit.sketch import CountMinSketch
+from rate_limit.simulator import VirtualClock
+from helpers import FakeRedis
+from tornado.testing import AsyncTestCase, gen_test
+from unittest import TestCase
+
+
+class AnalyzerTestCase(AsyncTestCase):
+    def setUp(self):
+        super(AnalyzerTestCase, self).setUp()
+
+        self.redis = FakeRedis()
+        self.rl = RateLimit(self.redis, namespace="ns", disable_locks=True,
+                            clock=VirtualClock(1000))
+        self.rl.limit(Or('user:5/s', 'user:10/m', '100/m'), key="api")
+
+    @gen_test
+    def test_report(self):
+        for user in ("a", "a", "b"):
+            yield self.rl.limit(key="api", user=user).request_limit_reached()
+
+        # left behind by rules that used to be longer, and a key
+        # with no rules defined
+        self.redis.data["ns:api:user:old"] = ["-60000"] * 20 + ["1000000"]
+        self.redis.data["ns:login:user:a"] = ["0", "1000"]
+        self.redis.data["other:api:user:a"] = ["0", "1000"]
+
+        report = yield analyze_namespace(self.rl, count=2)
+
+        self.assertEqual(report["keys"], 5)
+        self.assertEqual(report["per_key"]["api"]["keys"], 4)
+        self.assertEqual(report["per_key"]["login"]["keys"], 1)
+        self.assertEqual(report["per_selector"]["api:user"]["keys"], 3)
+        self.assertEqual(report["per_selector"]["api"]["keys"], 1)
+        self.assertEqual(report["per_rule"]["api:user:10/m,user:5/s"], {
+            "keys": 3,
+            "bytes": 3 * 50 + 13 + 13 + 15 + 3 * 11 + 2 * 10 + 20 * 6 + 7,
+            "bytes_per_key": (
+                3 * 50 + 13 + 13 + 15 + 3 * 11 + 2 * 10 + 20 * 6 + 7
+            ) // 3,
+        })
+        self.assertEqual(report["list_lengths"], {1: 2, 2: 1, 4: 1, 32: 1})
+        self.assertEqual(report["kinds"]["list"]["keys"], 5)
+        self.assertEqual(report["largest_keys"][0]["name"], "ns:api:user:old")
+
+        self.assertEqual(report["over_retained_keys"], 1)
+        self.assertEqual(report["over_retained"][0]["name"], "ns:api:user:old")
+        self.assertEqual(report["over_retained"][0]["reason"],
+                         "no expiration")
+
+    @gen_test
+    def test_retention(self):
+        analyzer = KeyspaceAnalyzer(self.rl)
+        rules = ["user:10/m", "user:5/s"]
+
+        self.assertIsNone(analyzer.check_retention("list", rules, 10, 60))
+        self.assertEqual(analyzer.check_retention("list", rules, 10, 120),
+                         "expires after the longest span")
+        self.assertEqual(analyzer.check_retention("list", rules, 11, 60),
+                         "longer than the allowed requests")
+        self.assertIsNone(analyzer.check_retention("list", [], 11, None))
+
+    def test_parse(self):
+        self.rl.limit(Or('ip:1KB/m', 'ip:conc=2', 'ip:500/s', 'ip:1000/s'),
+                      key="api:upload")
+        analyzer = KeyspaceAnalyzer(self.rl)
+
+        self.assertEqual(analyzer.parse("api:user:a"),
+                         ("list", "api", "user", ["user:10/m", "user:5/s"]))
+        self.assertEqual(analyzer.parse("api"),
+                         ("list", "api", None, ["100/m"]))
+        self.assertEqual(analyzer.parse("api:upload:ip:a#500"),
+                         ("list", "api:upload", "ip", ["ip:500/s"]))
+        self.assertEqual(analyzer.parse("cost:api:upload:ip:a"),
+                         ("cost", "api:upload", "ip", ["ip:1KB/m"]))
+        self.assertEqual(analyzer.parse("conc:api:upload:ip:a"),
+                         ("concurrency", "api:upload", "ip", ["ip:conc=2"]))
+        self.assertEqual(analyzer.parse("cms:api:ip:1/s:1000"),
+                         ("sketch", "api", "ip", ["ip:1/s"]))
+        self.assertEqual(analyzer.parse("{api:user:a}"),
+                         ("list", "api", "user", ["user:10/m", "user:5/s"]))
+        self.assertEqual(analyzer.parse("func:user:a"),
+                         ("list", "func", None, []))
+
+    def test_parse_escaped(self):
+        rl = RateLimit(self.redis, hash_tags=HashTags("selector"))
+        rl.limit('user:5/s', key="a}pi")
+
+        self.assertEqual(KeyspaceAnalyzer(rl).parse("{a%7Dpi:user:b%25}"),
+                         ("list", "a}pi", "user", ["user:5/s"]))
+
+    def test_bounded_groups(self):
+        analyzer = KeyspaceAnalyzer(self.rl, max_groups=2, top=1)
+
+        for i in range(5):
+            analyzer.add("ns:func%d" % i, "list", 100 + i, 1, 1)
+
+        report = analyzer.report()
+
+        self.assertEqual(sorted(report["per_key"]),
+                         ["<other>", "func0", "func1"])
+        self.assertEqual(report["per_key"]["<other>"]["keys"], 3)
+        self.assertEqual(report["largest_keys"],
+                         [{"name": "ns:func4", "bytes": 104}])
+
+    @gen_test
+    def test_stream(self):
+        keys = []
+        yield self.rl.limit(key="api", user="a").request_limit_reached()
+        yield KeyspaceAnalyzer(self.rl, on_key=keys.append).run()
+
+        self.assertEqual(sorted(key["name"] for key in keys),
+                         ["ns:api", "ns:api:user:a"])
+        self.assertTrue(all(key["ttl"] == 60 for key in keys))
+
+    def test_hashed_identifiers(self):
+        rl = RateLimit(FakeRedis(), namespace="ns",
+                       identifiers=HashedIdentifiers())
+
+        with self.assertRaises(RuntimeError):
+            KeyspaceAnalyzer(rl)
+
+
+class ProjectMemoryTestCase(TestCase):
+    def test_storages(self):
+        projection = project_memory(
+            Or('ip:100/m', '1000/s'), {"ip": 10 ** 6}, key="login"
+        )
+
+        lists, compact, sketch = [
+            projection[storage] for storage in ("list", "compact", "sketch")
+        ]
+
+        self.assertEqual(lists["keys"], 10 ** 6 + 1)
+        self.assertEqual(lists["rules"][0]["rules"], ["ip:100/m"])
+        self.assertEqual(lists["rules"][0]["bytes_per_key"],
+                         80 + len("login:ip:") + 16 + 74 + 6 * 100)
+        self.assertLess(compact["bytes"], lists["bytes"])
+
+        # the sketch doesn't grow with the number of ips
+        self.assertEqual(sketch["keys"], 3)
+        self.assertLess(sketch["bytes"], compact["bytes"])
+
+    def test_cardinality(self):
+        sketch = CountMinSketch('ip:100/m', max_counters=1000)
+
+        def project(ips):
+            return project_memory('ip:100/m', {"ip": ips}, sketch=sketch)
+
+        self.assertEqual(project(2000)["list"]["bytes"],
+                         2 * project(1000)["list"]["bytes"])
+        self.assertEqual(project(2000)["sketch"]["bytes"],
+                         project(1000)["sketch"]["bytes"])
+
+    def test_concurrency(self):
+        projection = project_memory('user:conc=5', {"user": 10})["list"]
+
+        self.assertEqual(projection["keys"], 10)
+        self.assertEqual(projection["rules"][0]["rules"], ["user:conc=5"])
+
+
+class LengthBucketTestCase(TestCase):
+    def test_buckets(self):
+        self.assertEqual([get_length_bucket(n) for n in (0, 1, 2, 3, 4, 5)],
+                         [0, 1, 2, 4, 4, 8])
@@ -0,0 +1,86 @@
+from rate_limit import RateLimit
+from rate_limit.batch import Batch, merge_selectors
+from rate_limit.limit import Limit
+from rate_limit.grammer import Or
+from helpers import FakeRedis
+from tornado.testing import AsyncTestCase, gen_test
+from time import time
+
+
+class BatchTestCase(AsyncTestCase):
+    def test_merge_selectors(self):
+        res = merge_selectors({}, {"a": {"allowed_requests": 5,
+                                         "requests_span": 1,
+                                         "spans": [1]}})
+        merge_selectors(res, {"a": {"allowed_requests": 2,
+                                    "requests_span": 60,
+                                    "spans": [1, 60]}})
+
+        self.assertEqual(res["a"], {"allowed_requests": 5,
+                                    "requests_span": 60,
+                                    "spans": [1, 60]})
+
+    @gen_test
+    def test_items_see_earlier_items_of_the_batch(self):
+        batch = Batch(now=1000)
+        limit = Limit(batch, '3/s', key="k")
+
+        res = []
+        for _ in range(4):
+            res.append((yield batch.request_limit_reached(limit)))
+
+        self.assertEqual(res, [False, False, False, True])
+        self.assertEqual(batch.pushed, {"k": 3})
+
+    @gen_test
+    def test_cost(self):
+        batch = Batch(now=1000)
+        limit = Limit(batch, '5/s', key="k")
+
+        self.assertFalse((yield batch.request_limit_reached(limit, 4)))
+        self.assertTrue((yield batch.request_limit_reached(limit, 2)))
+        self.assertFalse((yield batch.request_limit_reached(limit, 1)))
+        self.assertTrue((yield batch.request_limit_reached(limit, 6)))
+
+    @gen_test
+    def test_old_requests_are_ignored(self):
+        batch = Batch(now=1000)
+        batch.logs = {"k": [999, 990]}
+        limit = Limit(batch, '2/5s', key="k")
+
+        self.assertFalse((yield batch.request_limit_reached(limit)))
+        self.assertTrue((yield batch.request_limit_reached(limit)))
+
+
+class CheckManyTestCase(AsyncTestCase):
+    @gen_test
+    def test_check_many(self):
+        redis = FakeRedis()
+        rl = RateLimit(redis, namespace="ns", disable_locks=True)
+
+        items = [('tenant:2/m', {"tenant": tenant}, 1)
+                 for tenant in ("a", "b", "a", "a", "b", "c")]
+
+        res = yield rl.check_many(items, key="consume")
+
+        self.assertEqual(res, [True, True, True, False, True, True])
+        self.assertEqual(redis.round_trips, 2)
+        # two requests and the base timestamp
+        self.assertEqual(len(redis.data["ns:consume:tenant:a"]), 3)
+
+        res = yield rl.check_many(items[:1], key="consume")
+        self.assertEqual(res, [False])
+
+    @gen_test
+    def test_check_many_uses_key_rules(self):
+        redis = FakeRedis()
+        redis.data["consume:tenant:a"] = ["0", str(int(time() * 1000))]
+        rl = RateLimit(redis, disable_locks=True)
+        rl.limit(Or('tenant:1/m', '5/s'), key="consume")
+
+        res = yield rl.check_many(
+            [(None, {"tenant": "a"}, 1), (None, {"tenant": "b"}, 1)],
+            key="consume",
+        )
+
+        self.assertEqual(res, [False, True])
@@ -0,0 +1,182 @@
+from rate_limit import RateLimit
+from rate_limit.client import format_cost_entry
+from rate_limit.rule import Rule
+from rate_limit.simulator import VirtualClock
+from rate_limit.utils import MIN_DELTA, MAX_DELTA
+from helpers import FakeRedis
+from tornado.testing import AsyncTestCase, gen_test
+from time import time
+
+
+class CostLimitTestCase(AsyncTestCase):
+    def setUp(self):
+        super(CostLimitTestCase, self).setUp()
+        self.redis = FakeRedis()
+        self.rl = RateLimit(self.redis, namespace="ns")
+
+    def log(self, *entries):
+        """
+        entries are (seconds ago, cost) tuples, oldest first, scored
+        in milliseconds
+        """
+
+        now = time()
+        total = 0
+
+        for ago, cost in entries:
+            total += cost
+            self.redis.do_zadd(
+                "ns:k", int((now - ago) * 1000), format_cost_entry(total, cost)
+            )
+
+    @gen_test
+    def test_empty_log(self):
+        rule = Rule("10B/m")
+
+        self.assertFalse((yield self.rl.is_cost_limit_reached("k", rule, 10)))
+        self.assertTrue((yield self.rl.is_cost_limit_reached("k", rule, 11)))
+
+    @gen_test
+    def test_window_total(self):
+        self.log((120, 50), (30, 4), (10, 3))
+        rule = Rule("10B/m")
+
+        self.assertFalse((yield self.rl.is_cost_limit_reached("k", rule, 3)))
+        self.assertTrue((yield self.rl.is_cost_limit_reached("k", rule, 4)))
+        self.assertEqual(self.redis.round_trips, 2)
+
+    @gen_test
+    def test_same_timestamp(self):
+        """
+        entries of the same millisecond are read in the order they were
+        pushed, not by their cumulative cost as a string
+        """
+
+        self.log((10, 95), (10, 10), (10, 1))
+        rule = Rule("110B/m")
+
+        self.assertFalse((yield self.rl.is_cost_limit_reached("k", rule, 4)))
+        self.assertTrue((yield self.rl.is_cost_limit_reached("k", rule, 5)))
+
+
+class ConcurrencyLimitTestCase(AsyncTestCase):
+    def setUp(self):
+        super(ConcurrencyLimitTestCase, self).setUp()
+        self.redis = FakeRedis()
+        self.rl = RateLimit(self.redis, namespace="ns", lease_ttl=30)
+
+    @gen_test
+    def test_take_and_release_slots(self):
+        rule = Rule("conc=2")
+
+        yield self.rl.log_request({"conc:k": {"lease": "a"}})
+        self.assertFalse((yield self.rl.is_concurrency_limit_reached(
+            "conc:k", rule
+        )))
+
+        yield self.rl.log_request({"conc:k": {"lease": "b"}})
+        self.assertTrue((yield self.rl.is_concurrency_limit_reached(
+            "conc:k", rule
+        )))
+
+        yield self.rl.release_slots({"conc:k": "a"})
+        self.assertFalse((yield self.rl.is_concurrency_limit_reached(
+            "conc:k", rule
+        )))
+
+        self.assertEqual(self.redis.round_trips, 6)
+
+    @gen_test
+    def test_expired_leases_are_reclaimed(self):
+        self.redis.do_zadd("ns:conc:k", time() - 1, "crashed")
+        self.redis.do_zadd("ns:conc:k", time() + 10, "running")
+
+        self.assertFalse((yield self.rl.is_concurrency_limit_reached(
+            "conc:k", Rule("conc=2")
+        )))
+        self.assertEqual([m for _, m in self.redis.data["ns:conc:k"]],
+                         ["running"])
+
+
+class MillisecondTestCase(AsyncTestCase):
+    def setUp(self):
+        super(MillisecondTestCase, self).setUp()
+        self.redis = FakeRedis()
+        self.clock = VirtualClock(1700000000)
+        self.rl = RateLimit(self.redis, namespace="ns", disable_locks=True,
+                            clock=self.clock)
+        self.rl.limit('2/100ms', key="k")
+
+    def decide(self):
+        return self.rl.limit(key="k").request_limit_reached()
+
+    @gen_test
+    def test_sub_second_span(self):
+        self.assertFalse((yield self.decide()))
+        self.clock.advance(0.03)
+        self.assertFalse((yield self.decide()))
+        self.clock.advance(0.03)
+        self.assertTrue((yield self.decide()))
+
+        # the first request is 100ms old
+        self.clock.advance(0.04)
+        self.assertFalse((yield self.decide()))
+
+        self.assertEqual(self.redis.ttls["ns:k"], 1)
+        log = self.redis.data["ns:k"]
+        self.assertEqual(int(log[-1]) + int(log[0]), 1700000000100)
+
+    @gen_test
+    def test_sparse_list(self):
+        """
+        a list trimmed by length keeps entries far older than its span,
+        e.g a client sending 60 requests a day to a '1000/d' limit
+        """
+
+        self.rl.limit('1000/d', key="daily")
+        limit = self.rl.limit(key="daily")
+
+        for _ in range(1001):
+            self.assertFalse((yield limit.request_limit_reached()))
+            self.clock.advance(24 * 60)
+
+        # the requests and the base timestamp
+        self.assertEqual(len(self.redis.data["ns:daily"]), 1001)
+
+    @gen_test
+    def test_rebase(self):
+        """
+        a list outliving its 32 bit deltas is rebased, its requests within
+        the span keep their time, older ones stay older than the span
+        """
+
+        self.rl.limit('5/30d', key="monthly")
+        limit = self.rl.limit(key="monthly")
+        day = 24 * 60 * 60
+
+        for _ in range(30):
+            self.assertFalse((yield limit.request_limit_reached()))
+            self.clock.advance(7 * day)
+
+        log = self.redis.data["ns:monthly"]
+        self.assertEqual(len(log), 6)
+        self.assertTrue(all(
+            MIN_DELTA <= int(delta) <= MAX_DELTA for delta in log[:-1]
+        ))
+
+        logs = yield self.rl.get_requests_logs({
+            "monthly": {"allowed_requests": 5}
+        })
+        ages = [self.clock() - t for t in logs["monthly"]]
+
+        self.assertEqual(ages[:4], [7 * day, 14 * day, 21 * day, 28 * day])
+        self.assertGreaterEqual(ages[4], 30 * day)
+
+    @gen_test
+    def test_check_many(self):
+        res = yield self.rl.check_many([(None, {}, 1)] * 3, key="k")
+        self.assertEqual(res, [True, True, False])
+
+        self.clock.advance(0.1)
+        res = yield self.rl.check_many([(None, {}, 1)] * 3, key="k")
+        self.assertEqual(res, [True, True, False])
@@ -0,0 +1,197 @@
+from rate_limit import RateLimit, HashedIdentifiers, Or
+from rate_limit.cluster import (
+    HashTags, SlotPipelines, crc16, get_hash_tag, get_slot, escape_tag,
+    unescape_tag
+)
+from rate_limit.limit import Limit
+from rate_limit.simulator import VirtualClock
+from rate_limit.utils import MIN_DELTA
+from helpers import FakeRedis
+from tornado.testing import AsyncTestCase, gen_test
+from tornadoredis.exceptions import RedisError
+from unittest import TestCase
+
+
+class SlotTestCase(TestCase):
+    def test_crc16(self):
+        self.assertEqual(crc16("123456789"), 0x31C3)
+        self.assertEqual(get_slot("foo"), 12182)
+
+    def test_hash_tag(self):
+        self.assertEqual(get_hash_tag("ns:{api}:user:a"), "api")
+        self.assertEqual(get_hash_tag("ns:{}:user:a"), "ns:{}:user:a")
+        self.assertEqual(get_hash_tag("ns:api"), "ns:api")
+        self.assertEqual(get_slot("{user1000}.following"),
+                         get_slot("{user1000}.followers"))
+
+
+class HashTagsTestCase(TestCase):
+    def test_key_policy(self):
+        tags = HashTags("key")
+
+        self.assertEqual(tags.create_identifier("api", "user", "a"),
+                         "{api}:user:a")
+        self.assertEqual(tags.create_identifier("api", None, None), "{api}")
+        self.assertEqual(tags.get_shard_identifier("{api}#10", 3),
+                         "{api}#10:shard:3")
+
+    def test_selector_policy(self):
+        tags = HashTags("selector")
+
+        self.assertEqual(tags.create_identifier("api", "user", "a"),
+                         "{api:user:a}")
+        self.assertEqual(tags.create_identifier("api", None, None), "{api}")
+        self.assertEqual(tags.get_shard_identifier("{api}#10", 3),
+                         "{api:shard:3}#10")
+
+    def test_escaping(self):
+        self.assertEqual(escape_tag("a}b{c%7D"), "a%7Db%7Bc%257D")
+        self.assertEqual(unescape_tag(escape_tag("a}b{c%7D")), "a}b{c%7D")
+        self.assertEqual(escape_tag(10), "10")
+        self.assertIsNone(escape_tag(None))
+
+    def test_braces(self):
+        """
+        a selector value can't end its tag early, or share the slot of
+        another value by doing so
+        """
+
+        tags = HashTags("selector")
+        identifier = tags.create_identifier("api", "user", "a}b")
+
+        self.assertEqual(identifier, "{api:user:a%7Db}")
+        self.assertNotEqual(
+            get_slot(identifier),
+            get_slot(tags.create_identifier("api", "user", "a}c"))
+        )
+        self.assertEqual(tags.get_shard_identifier(identifier + "#10", 3),
+                         "{api:user:a%7Db:shard:3}#10")
+        self.assertEqual(
+            tags.get_shard_identifier(
+                tags.create_identifier("{api}", "user", "a") + "#10", 3
+            ),
+            "{%7Bapi%7D:user:a:shard:3}#10"
+        )
+        self.assertEqual(
+            HashTags("key").create_identifier("a}pi", "user", "{b}"),
+            "{a%7Dpi}:user:%7Bb%7D"
+        )
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            HashTags("value")
+
+    def test_lock_identifier(self):
+        rl = RateLimit(FakeRedis(), hash_tags=HashTags("selector"))
+        limit = Limit(rl, '10/s', key="api", shards=4)
+
+        self.assertEqual(limit.get_lock_identifier(2), "{api:shard:2}")
+        self.assertEqual(Limit(rl, '10/s', key="api").get_lock_identifier(),
+                         "{api}")
+
+    def test_short_identifiers(self):
+        with self.assertRaises(RuntimeError):
+            RateLimit(FakeRedis(), identifiers=HashedIdentifiers(),
+                      hash_tags=HashTags())
+
+
+class ClusterRateLimitTestCase(AsyncTestCase):
+    def decide(self, policy):
+        redis = FakeRedis()
+        rl = RateLimit(redis, namespace="ns", disable_locks=True,
+                       clock=VirtualClock(1000), hash_tags=HashTags(policy))
+        rl.limit(Or('user:1/s', 'ip:5/s', '100/m'), key="api")
+
+        limit = rl.limit(key="api", user="a", ip="10.0.0.1")
+        reached = self.io_loop.run_sync(limit.request_limit_reached)
+
+        return redis, reached
+
+    def test_key_policy(self):
+        redis, reached = self.decide("key")
+
+        self.assertFalse(reached)
+        self.assertEqual(sorted(redis.data), [
+            "ns:{api}", "ns:{api}:ip:10.0.0.1", "ns:{api}:user:a"
+        ])
+        self.assertEqual(len(set(get_slot(key) for key in redis.data)), 1)
+
+        # 3 lookups and a single transaction
+        self.assertEqual(redis.round_trips, 4)
+
+    def test_selector_policy(self):
+        redis, reached = self.decide("selector")
+
+        self.assertFalse(reached)
+        self.assertEqual(sorted(redis.data), [
+            "ns:{api:ip:10.0.0.1}", "ns:{api:user:a}", "ns:{api}"
+        ])
+
+        # a transaction per slot
+        self.assertEqual(redis.round_trips, 6)
+
+    @gen_test
+    def test_check_many(self):
+        redis = FakeRedis()
+        rl = RateLimit(redis, namespace="ns", disable_locks=True,
+                       clock=VirtualClock(1000),
+                       hash_tags=HashTags("selector"))
+        rl.limit('user:1/s', key="api")
+
+        res = yield rl.check_many([
+            (None, {"user": "a"}, 1),
+            (None, {"user": "b"}, 1),
+            (None, {"user": "a"}, 1),
+        ], key="api")
+
+        self.assertEqual(res, [True, True, False])
+        self.assertEqual(redis.data["ns:{api:user:a}"],
+                         [str(MIN_DELTA), str(1000000 - MIN_DELTA)])
+        self.assertEqual(redis.round_trips, 4)
+
+
+class SlotPipelinesTestCase(AsyncTestCase):
+    @gen_test
+    def test_execute(self):
+        redis = FakeRedis()
+        redis.data.update({"{a}:1": "x", "{a}:2": "y", "{b}": "z"})
+        pipes = SlotPipelines(redis, HashTags())
+
+        for key in ("{a}:1", "{b}", "{a}:2"):
+            pipes.get(key).get(key)
+
+        self.assertEqual(len(pipes), 2)
+
+        responses = yield pipes.execute()
+
+        self.assertEqual(sorted(responses), [
+            (["{a}:1", "{a}:2"], ["x", "y"]), (["{b}"], ["z"])
+        ])
+
+    @gen_test
+    def test_execute_without_hash_tags(self):
+        redis = FakeRedis()
+        redis.data.update({"a": "x", "b": "y"})
+        pipes = SlotPipelines(redis)
+
+        self.assertEqual((yield pipes.execute()), [])
+
+        for key in ("a", "b"):
+            pipes.get(key).get(key)
+
+        self.assertEqual((yield pipes.execute()), [(["a", "b"], ["x", "y"])])
+
+        pipes.pipes[None].execute = lambda callback: callback(
+            RedisError("down")
+        )
+
+        with self.assertRaises(RedisError):
+            yield pipes.execute()
+
+    def test_without_hash_tags(self):
+        pipes = SlotPipelines(FakeRedis())
+
+        for key in ("a", "b"):
+            pipes.get(key)
+
+        self.assertEqual(len(pipes), 1)
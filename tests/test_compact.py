@@ -0,0 +1,156 @@
+from rate_limit.compact import (
+    CompactRateLimit, decode_log, HEADER, SLOT, LOG_SCRIPT, MAX_DELTA
+)
+from rate_limit.simulator import VirtualClock
+from rate_limit.rule import Rule
+from helpers import FakeRedis, lupa
+from tornado.testing import AsyncTestCase, gen_test
+from unittest import skipIf
+from mock import Mock
+from time import time
+
+
+def encode_log(base, head, deltas):
+    """
+    packs deltas (by slot) into a log whose newest request is at head
+    """
+
+    return HEADER.pack(base, head, len(deltas)) + b"".join(
+        SLOT.pack(delta) for delta in deltas
+    )
+
+
+class CompactRateLimitTestCase(AsyncTestCase):
+    def test_decode_log(self):
+        buffer = encode_log(1000000, 1, [3000, 4000, 1000])
+
+        self.assertEqual(decode_log(buffer), [1004, 1003, 1001])
+        self.assertEqual(decode_log(None), [])
+
+    def test_decode_partial_log(self):
+        buffer = encode_log(1000000, 1, [3000, 4000, 0])
+        buffer = buffer[:4] + HEADER.pack(1000000, 1, 2)[4:] + buffer[16:]
+
+        self.assertEqual(decode_log(buffer), [1004, 1003])
+
+    @gen_test
+    def test_is_rate_limit_reached(self):
+        redis = FakeRedis()
+        rl = CompactRateLimit(redis, namespace="ns")
+        now = int(time() * 1000)
+
+        redis.eval = Mock(side_effect=lambda *args, **kwargs:
+                          kwargs["callback"](now - 500))
+        self.assertTrue((yield rl.is_rate_limit_reached("k", Rule("5/s"))))
+
+        redis.eval = Mock(side_effect=lambda *args, **kwargs:
+                          kwargs["callback"](now - 1500))
+        self.assertFalse((yield rl.is_rate_limit_reached("k", Rule("5/s"))))
+
+        self.assertEqual(redis.eval.call_args[0][1:], (["ns:k"], [5]))
+
+    @gen_test
+    def test_get_requests_logs(self):
+        redis = FakeRedis()
+        redis.data["ns:k"] = encode_log(1000000, 0, [2000])
+        rl = CompactRateLimit(redis, namespace="ns")
+
+        logs = yield rl.get_requests_logs({"k": {}, "empty": {}})
+
+        self.assertEqual(logs, {"k": [1002], "empty": []})
+
+    def test_pipe_push(self):
+        pipe = Mock()
+        CompactRateLimit(None).pipe_push(
+            pipe, "k", {"allowed_requests": 10, "requests_span": 60}, 1.5, 3
+        )
+
+        pipe.eval.assert_called_once_with(
+            LOG_SCRIPT, ["k"], [1500, 10, 60, 3]
+        )
+
+
+@skipIf(lupa is None, "lupa is needed to run the Lua scripts")
+class CompactScriptsTestCase(AsyncTestCase):
+    def setUp(self):
+        super(CompactScriptsTestCase, self).setUp()
+
+        self.redis = FakeRedis()
+        self.clock = VirtualClock(1000000)
+        self.rl = CompactRateLimit(self.redis, disable_locks=True,
+                                   clock=self.clock)
+
+    def push(self, now, capacity, count=1):
+        self.redis.do_eval(LOG_SCRIPT, ["k"], [now, capacity, 60, count])
+
+    def test_lazy_growth(self):
+        self.push(1000000, 100)
+        self.assertEqual(len(self.redis.data["k"]), 16 + 4)
+
+        self.push(1001000, 100, 2)
+        self.assertEqual(len(self.redis.data["k"]), 16 + 3 * 4)
+        self.assertEqual(decode_log(self.redis.data["k"]),
+                         [1001, 1001, 1000])
+
+        # once full, the log is a ring buffer
+        self.push(1002000, 3, 2)
+        self.assertEqual(len(self.redis.data["k"]), 16 + 3 * 4)
+        self.assertEqual(decode_log(self.redis.data["k"]),
+                         [1002, 1002, 1001])
+
+    def test_resize(self):
+        for i in range(5):
+            self.push(1000000 + i * 1000, 3)
+
+        # a full ring buffer keeps its newest requests, in order
+        self.push(1005000, 10)
+        self.assertEqual(len(self.redis.data["k"]), 16 + 4 * 4)
+        self.assertEqual(decode_log(self.redis.data["k"]),
+                         [1005, 1004, 1003, 1002])
+
+        self.push(1006000, 2)
+        self.assertEqual(decode_log(self.redis.data["k"]), [1006, 1005])
+
+    def test_rebase(self):
+        self.push(1000000, 3)
+        self.push(1000000 + MAX_DELTA - 1000, 3, 2)
+        self.push(1000000 + MAX_DELTA + 1000, 3)
+
+        now = (1000000 + MAX_DELTA) / 1000.0
+        self.assertEqual(decode_log(self.redis.data["k"]),
+                         [now + 1, now - 1, now - 1])
+
+        # requests older than MAX_DELTA are moved up to the new base
+        self.push(1000000 + 2 * MAX_DELTA + 1000, 4)
+        self.assertEqual(decode_log(self.redis.data["k"]), [
+            now + MAX_DELTA / 1000.0 + 1, now + 1, now + 1, now + 1
+        ])
+
+    @gen_test
+    def test_no_burst_after_max_delta(self):
+        """
+        a log kept alive past MAX_DELTA still holds its recent requests
+        """
+
+        self.rl.limit('3/m', key="k")
+        boundary = self.clock() + MAX_DELTA / 1000.0
+
+        while self.clock() < boundary - 3600:
+            limit = self.rl.limit(key="k")
+            self.assertFalse((yield limit.request_limit_reached()))
+            self.clock.advance(3600)
+
+        self.clock.set(boundary - 20)
+
+        for _ in range(2):
+            limit = self.rl.limit(key="k")
+            self.assertFalse((yield limit.request_limit_reached()))
+
+        self.clock.advance(40)
+        results = []
+
+        for _ in range(2):
+            limit = self.rl.limit(key="k")
+            results.append((yield limit.request_limit_reached()))
+
+        self.assertEqual(results, [False, True])
@@ -0,0 +1,262 @@
+from rate_limit.events import (
+    EventRing, EventStream, FileSink, RedisStreamSink, CallbackSink
+)
+from rate_limit.hitters import HeavyHitters
+from rate_limit.memory import MemoryRateLimit
+from rate_limit.simulator import VirtualClock
+from rate_limit.metrics import Metrics
+from rate_limit import Or, RateLimitExceeded
+from helpers import FakeRedis
+from tornado.concurrent import Future
+from tornado.testing import AsyncTestCase, gen_test
+from tornado.gen import sleep
+from unittest import TestCase
+from mock import Mock
+import threading
+import tempfile
+import shutil
+import json
+import os
+
+
+class EventRingTestCase(TestCase):
+    def test_push_and_pop(self):
+        ring = EventRing(3)
+
+        for event in range(3):
+            self.assertTrue(ring.push(event))
+
+        self.assertEqual(ring.pop_many(2), [0, 1])
+        ring.push(3)
+        ring.push(4)
+
+        self.assertEqual(len(ring), 3)
+        self.assertEqual(ring.pop_many(10), [2, 3, 4])
+        self.assertEqual(ring.slots, [None] * 3)
+
+    def test_overflow(self):
+        ring = EventRing(2)
+
+        self.assertEqual([ring.push(event) for event in range(4)],
+                         [True, True, False, False])
+        self.assertEqual(ring.dropped, 2)
+        self.assertEqual(ring.pop_many(10), [0, 1])
+
+
+class EventStreamTestCase(AsyncTestCase):
+    def setUp(self):
+        super(EventStreamTestCase, self).setUp()
+
+        self.batches = []
+        self.metrics = Metrics()
+        self.events = EventStream(
+            [CallbackSink(self.batches.append)], size=4, batch_size=3,
+            metrics=self.metrics
+        )
+
+    @gen_test
+    def test_flush(self):
+        for i in range(5):
+            self.events.record(i, "k", False, None, 0.001)
+
+        self.assertEqual(self.metrics.get_counter("events_dropped_total"), 1)
+
+        yield self.events.flush()
+
+        self.assertEqual([len(batch) for batch in self.batches], [3, 1])
+        self.assertEqual(self.batches[0][0], (0, "k", False, None, 0.001))
+        self.assertEqual(self.metrics.get_counter(
+            "events_written_total", sink="CallbackSink"
+        ), 4)
+
+    @gen_test
+    def test_failing_sink(self):
+        def fail(events):
+            raise IOError("disk full")
+
+        self.events.sinks.insert(0, CallbackSink(fail))
+        self.events.record(0, "k", False, None, 0.001)
+
+        yield self.events.flush()
+
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(self.metrics.get_counter(
+            "events_lost_total", sink="CallbackSink"
+        ), 1)
+
+    @gen_test
+    def test_decisions_never_wait(self):
+        """
+        a slow sink doesn't hold decisions, the ring fills and drops
+        """
+
+        pending = Future()
+        self.events.sinks = [CallbackSink(lambda events: pending)]
+        self.events.record(0, "k", False, None, 0)
+
+        flush = self.events.check()
+
+        for i in range(6):
+            self.events.record(i, "k", False, None, 0)
+
+        self.events.check()
+        self.assertEqual(len(self.events.ring), 4)
+        self.assertEqual(self.metrics.get_counter("events_dropped_total"), 2)
+
+        pending.set_result(None)
+        yield flush
+
+
+class SinksTestCase(AsyncTestCase):
+    @gen_test
+    def test_file(self):
+        directory = tempfile.mkdtemp()
+
+        try:
+            path = os.path.join(directory, "events.log")
+            sink = FileSink(path)
+
+            yield sink.write([(1, "k", True, "5/s", 0.5)])
+            yield sink.write([(2, "k:user:a", False, None, 0.25)])
+            sink.close()
+
+            with open(path) as events:
+                self.assertEqual([json.loads(line) for line in events], [
+                    [1, "k", True, "5/s", 0.5],
+                    [2, "k:user:a", False, None, 0.25],
+                ])
+        finally:
+            shutil.rmtree(directory)
+
+    @gen_test
+    def test_file_doesnt_block(self):
+        """
+        a slow disk doesn't stall the IOLoop, write() is done once the
+        batch was flushed
+        """
+
+        directory = tempfile.mkdtemp()
+
+        try:
+            sink = FileSink(os.path.join(directory, "events.log"))
+            disk = threading.Event()
+            real_file, sink.file = sink.file, Mock(
+                write=Mock(side_effect=lambda data: disk.wait())
+            )
+
+            written = sink.write([(1, "k", True, "5/s", 0.5)])
+            yield sleep(0.01)
+            self.assertFalse(written.done())
+
+            disk.set()
+            yield written
+
+            self.assertEqual(sink.file.flush.call_count, 1)
+            sink.close()
+            real_file.close()
+        finally:
+            shutil.rmtree(directory)
+
+    @gen_test
+    def test_file_errors(self):
+        directory = tempfile.mkdtemp()
+
+        try:
+            sink = FileSink(os.path.join(directory, "events.log"))
+            sink.file.close()
+
+            with self.assertRaises(ValueError):
+                yield sink.write([(1, "k", True, "5/s", 0.5)])
+
+            sink.close()
+        finally:
+            shutil.rmtree(directory)
+
+    @gen_test
+    def test_redis_stream(self):
+        redis = FakeRedis()
+        sink = RedisStreamSink(redis, stream="events")
+
+        yield sink.write([
+            (1, "k", True, "5/s", 0.5), (2, "k", False, None, 0)
+        ])
+
+        self.assertEqual(len(redis.data["events"]), 1)
+        self.assertEqual(json.loads(redis.data["events"][0]["events"]), [
+            [1, "k", True, "5/s", 0.5], [2, "k", False, None, 0]
+        ])
+
+
+class DecisionEventsTestCase(AsyncTestCase):
+    @gen_test
+    def test_decisions(self):
+        batches = []
+        events = EventStream([CallbackSink(batches.append)])
+        rl = MemoryRateLimit(clock=VirtualClock(100), events=events)
+        rl.limit(Or('user:1/s', '10/m'), key="k")
+
+        for _ in range(2):
+            yield rl.limit(key="k", user="a").request_limit_reached()
+
+        yield events.flush()
+
+        self.assertEqual([event[:4] for event in batches[0]], [
+            (100, "k:user:a", False, None),
+            (100, "k:user:a", True, "user:1/s"),
+        ])
+        self.assertTrue(all(event[4] >= 0 for event in batches[0]))
+
+    @gen_test
+    def test_concurrent_decisions(self):
+        """
+        decisions sharing a decorator record their own denied rule
+        """
+
+        batches = []
+        events = EventStream([CallbackSink(batches.append)])
+        rl = MemoryRateLimit(clock=VirtualClock(100), events=events,
+                             disable_locks=True, interleave=True)
+
+        class User(object):
+            def __init__(self, user):
+                self.user = user
+
+            @rl.limit('user:1/s')
+            def get(self):
+                pass
+
+        yield User("a").get()
+
+        with self.assertRaises(RateLimitExceeded):
+            yield [User("a").get(), User("b").get()]
+
+        yield events.flush()
+
+        self.assertEqual(sorted(event[1:4] for event in batches[0]), [
+            ("get:user:a", False, None),
+            ("get:user:a", True, "user:1/s"),
+            ("get:user:b", False, None),
+        ])
+
+    @gen_test
+    def test_local_denials(self):
+        batches = []
+        events = EventStream([CallbackSink(batches.append)])
+        clock = VirtualClock(100)
+        rl = MemoryRateLimit(clock=clock, events=events,
+                             heavy_hitters=HeavyHitters(threshold=1))
+        rl.limit('1/m', key="k")
+
+        yield rl.limit(key="k").request_limit_reached()
+        clock.advance(1)
+
+        for _ in range(2):
+            yield rl.limit(key="k").request_limit_reached()
+
+        yield events.flush()
+
+        self.assertEqual([event[:4] for event in batches[0]], [
+            (100, "k", False, None),
+            (101, "k", True, "1/m"),
+            (101, "k", True, None),
+        ])
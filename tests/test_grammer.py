@@ -1,6 +1,6 @@
 from tornado.testing import AsyncTestCase, gen_test
 from tornado.gen import coroutine, Return
-from rate_limit.grammer import And, Or
+from rate_limit.grammer import And, Or, dump_rules, load_rules
 
 
 class GrammerTestCase(AsyncTestCase):
@@ -65,6 +65,18 @@ class GrammerTestCase(AsyncTestCase):
         yield self.assertLogic(And(True, False, Exception), False)
         yield self.assertLogic(Or(True, Exception), True)
 
+    def test_evaluate(self):
+        def evaluate(content):
+            if content is Exception:
+                raise Exception
+
+            return content
+
+        self.assertTrue(And(True, Or(False, True)).evaluate(evaluate))
+        self.assertFalse(Or(False, And(True, False)).evaluate(evaluate))
+        self.assertFalse(And(True, False, Exception).evaluate(evaluate))
+        self.assertTrue(Or(And(True, True), Exception).evaluate(evaluate))
+
     def test_get_all(self):
         """
         get_all should return a set of the content of all operators
@@ -72,3 +84,26 @@ class GrammerTestCase(AsyncTestCase):
 
         logic = And(And("hey", Or("ho", "lets"), "go"), Or("lets", "go"))
         self.assertEqual(logic.get_all(), set(("hey", "ho", "lets", "go")))
+
+
+class SerializationTestCase(AsyncTestCase):
+    def test_dump_rules(self):
+        self.assertEqual(dump_rules('user:5/s'), 'user:5/s')
+        self.assertEqual(
+            dump_rules(And('user:5/s', Or('ip:10/m', '100/h'))),
+            {"and": ['user:5/s', {"or": ['ip:10/m', '100/h']}]}
+        )
+
+    def test_load_rules(self):
+        rules = load_rules({"and": ['user:5/s', {"or": ['ip:10/m']}]})
+
+        self.assertIsInstance(rules, And)
+        self.assertEqual(rules.operators[0], 'user:5/s')
+        self.assertIsInstance(rules.operators[1], Or)
+        self.assertEqual(dump_rules(rules),
+                         {"and": ['user:5/s', {"or": ['ip:10/m']}]})
+
+    def test_load_malformed_rules(self):
+        for obj in ({"xor": ['5/s']}, {"and": [], "or": []}, 5, None):
+            with self.assertRaises(SyntaxError):
+                load_rules(obj)
@@ -0,0 +1,170 @@
+from rate_limit.hitters import HeavyHitters
+from rate_limit.memory import MemoryRateLimit
+from rate_limit.simulator import VirtualClock
+from rate_limit.metrics import Metrics
+from rate_limit import And
+from tornado.testing import AsyncTestCase, gen_test
+from unittest import TestCase
+import random
+
+
+class HeavyHittersTestCase(TestCase):
+    def test_space_saving(self):
+        hitters = HeavyHitters(capacity=2)
+
+        for identifier in ("a", "a", "a", "b", "c"):
+            hitters.observe(identifier, 0)
+
+        self.assertEqual(hitters.counts, {"a": [3, 0], "c": [2, 1]})
+
+    def test_buckets(self):
+        """
+        the identifier evicted always has the lowest count, found in
+        the buckets without scanning the counts
+        """
+
+        hitters = HeavyHitters(capacity=8)
+        rand = random.Random(0)
+
+        for _ in range(2000):
+            hitters.observe(rand.choice("abcdefghijklmnop"[:rand.randint(
+                1, 16)]), 0)
+
+            counts = [count for count, _ in hitters.counts.values()]
+            self.assertEqual(hitters.min_count, min(counts))
+            self.assertEqual(
+                dict((count, set(bucket))
+                     for count, bucket in hitters.buckets.items()),
+                dict((count, set(
+                    i for i, (c, _) in hitters.counts.items() if c == count
+                )) for count in counts)
+            )
+
+    def test_promotion_and_demotion(self):
+        hitters = HeavyHitters(capacity=10, threshold=3, interval=1)
+
+        for _ in range(3):
+            hitters.observe("a", 0)
+
+        hitters.observe("b", 0.5)
+        hitters.observe("b", 1)
+
+        self.assertTrue(hitters.is_hot("a"))
+        self.assertFalse(hitters.is_hot("b"))
+
+        hitters.observe("a", 2)
+        self.assertFalse(hitters.is_hot("a"))
+
+    def test_idle_interval_demotes(self):
+        hitters = HeavyHitters(threshold=1, interval=1)
+
+        hitters.observe("a", 0)
+        hitters.observe("a", 1)
+        self.assertTrue(hitters.is_hot("a"))
+
+        hitters.observe("b", 5)
+        self.assertFalse(hitters.is_hot("a"))
+
+    def test_block(self):
+        hitters = HeavyHitters(threshold=1, interval=1, block_ttl=0.5)
+
+        hitters.observe("a", 0)
+        hitters.deny("a", 0)
+        self.assertFalse(hitters.observe("a", 0.1))
+
+        hitters.observe("a", 1)
+        hitters.deny("a", 1)
+        self.assertTrue(hitters.observe("a", 1.2))
+        self.assertFalse(hitters.observe("a", 1.5))
+
+    def test_get_heavy_hitters(self):
+        hitters = HeavyHitters(capacity=2, threshold=2)
+
+        for identifier in ("a", "a", "b"):
+            hitters.observe(identifier, 0)
+
+        hitters.observe("b", 1)
+
+        self.assertEqual(hitters.get_heavy_hitters(), [{
+            "identifier": "b",
+            "decisions": 1,
+            "guaranteed_decisions": 1,
+            "hot": False,
+            "last_interval_decisions": None,
+            "blocked": False,
+        }, {
+            "identifier": "a",
+            "decisions": 0,
+            "guaranteed_decisions": 0,
+            "hot": True,
+            "last_interval_decisions": 2,
+            "blocked": False,
+        }])
+
+
+class HeavyHittersRateLimitTestCase(AsyncTestCase):
+    @gen_test
+    def test_hot_denials_are_local(self):
+        clock = VirtualClock(1000)
+        metrics = Metrics()
+        rl = MemoryRateLimit(
+            clock=clock, metrics=metrics,
+            heavy_hitters=HeavyHitters(threshold=5, block_ttl=0.5)
+        )
+        rl.limit('apikey:2/m', key="api")
+
+        def decide(apikey):
+            return rl.limit(key="api", apikey=apikey).request_limit_reached()
+
+        for _ in range(5):
+            yield decide("scraper")
+
+        clock.advance(1)
+        self.assertTrue((yield decide("scraper")))
+        self.assertEqual(rl.get_heavy_hitters()[0]["identifier"],
+                         "api:apikey:scraper")
+
+        round_trips = metrics.get_counter("redis_round_trips_total")
+
+        for _ in range(10):
+            self.assertTrue((yield decide("scraper")))
+
+        self.assertEqual(
+            metrics.get_counter("redis_round_trips_total"), round_trips
+        )
+        self.assertEqual(metrics.get_counter(
+            "cache_requests_total", cache="heavy_hitter", result="hit"
+        ), 10)
+        self.assertEqual(metrics.get_counter(
+            "decisions_total", key="api", result="deny"
+        ), 14)
+
+        # other identifiers, and the hot one once the block is over,
+        # are decided as usual
+        self.assertFalse((yield decide("user")))
+
+        clock.advance(0.5)
+        yield decide("scraper")
+        self.assertGreater(
+            metrics.get_counter("redis_round_trips_total"), round_trips + 1
+        )
+
+    @gen_test
+    def test_selectors_called_once(self):
+        calls = []
+
+        def apikey():
+            calls.append("apikey")
+            return "a"
+
+        rl = MemoryRateLimit(clock=VirtualClock(1000),
+                             heavy_hitters=HeavyHitters())
+        rl.limit(And('apikey:2/m', 'apikey:10/h'), key="api")
+
+        yield rl.limit(key="api", apikey=apikey).request_limit_reached()
+
+        # looked up once for the identifier, the rules and the log
+        self.assertEqual(calls, ["apikey"])
+
+    def test_not_tracked(self):
+        self.assertEqual(MemoryRateLimit().get_heavy_hitters(), [])
@@ -0,0 +1,57 @@
+from rate_limit import RateLimit, HashedIdentifiers, migrate_identifiers
+from helpers import FakeRedis
+from tornado.testing import AsyncTestCase, gen_test
+
+
+class HashedIdentifiersTestCase(AsyncTestCase):
+    def test_shorten(self):
+        identifiers = HashedIdentifiers(digest_size=8)
+        short = identifiers.shorten("ns", "login:user:" + "x" * 64)
+
+        self.assertEqual(len(short), 10)
+        self.assertEqual(short, identifiers.shorten("ns", "login:user:" +
+                                                    "x" * 64))
+        self.assertNotEqual(short, identifiers.shorten("ns", "login:user:y"))
+        self.assertEqual(short[:2], identifiers.shorten("ns", "other")[:2])
+
+    def test_explicit_prefix(self):
+        identifiers = HashedIdentifiers(prefix="\x01")
+        self.assertEqual(identifiers.shorten("ns", "k")[:1], "\x01")
+
+    def test_add_namespace(self):
+        identifiers = HashedIdentifiers()
+        rl = RateLimit(None, namespace="ns", identifiers=identifiers)
+
+        self.assertEqual(rl.add_namespace("k:user:vova"),
+                         identifiers.shorten("ns", "k:user:vova"))
+
+    @gen_test
+    def test_reverse_lookup(self):
+        redis = FakeRedis()
+        rl = RateLimit(redis, namespace="ns",
+                       identifiers=HashedIdentifiers(reverse_lookup=True))
+
+        yield rl.log_request({"k:user:vova": {"allowed_requests": 5,
+                                              "requests_span": 1}})
+
+        short = rl.add_namespace("k:user:vova")
+        self.assertEqual(len(redis.data[short]), 2)
+        self.assertEqual((yield rl.lookup_identifier(short)), "k:user:vova")
+
+    @gen_test
+    def test_migrate_identifiers(self):
+        redis = FakeRedis()
+        redis.data = {
+            "ns:k:user:vova": ["1", "2"],
+            "ns:cost:k:user:vova": [(1, "1:1")],
+            "other:k": ["3"],
+        }
+
+        rl = RateLimit(redis, namespace="ns", identifiers=HashedIdentifiers())
+
+        self.assertEqual((yield migrate_identifiers(rl)), 2)
+        self.assertEqual(redis.data[rl.add_namespace("k:user:vova")],
+                         ["1", "2"])
+        self.assertIn(rl.add_namespace("cost:k:user:vova"), redis.data)
+        self.assertIn("other:k", redis.data)
+        self.assertEqual(len(redis.data), 3)
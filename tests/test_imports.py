@@ -0,0 +1,62 @@
+from unittest import TestCase
+import subprocess
+import json
+import sys
+import os
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+SCRIPT = """
+import sys
+sys.path.insert(0, %r)
+%s
+print(json.dumps(sorted(set(
+    name.split(".")[0] for name in sys.modules
+    if name.split(".")[0] in ("tornado", "tornadoredis", "six")
+))))
+"""
+
+
+def get_loaded(code):
+    """
+    returns the heavy dependencies a fresh interpreter running code loaded
+    """
+
+    output = subprocess.check_output([
+        sys.executable, "-c", SCRIPT % (ROOT, "import json\n" + code)
+    ])
+
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+class ImportsTestCase(TestCase):
+    def test_core(self):
+        self.assertEqual(get_loaded(
+            "from rate_limit import And, Or\n"
+            "from rate_limit.rule import Rule\n"
+            "from rate_limit.plan import Plan\n"
+            "Rule('user:5/s')\n"
+            "Plan(And('user:5/s', Or('ip:1/m', '100/h')))\n"
+        ), [])
+
+    def test_grammer_serialization(self):
+        self.assertEqual(get_loaded(
+            "from rate_limit.grammer import dump_rules, load_rules, And\n"
+            "load_rules(dump_rules(And('user:5/s', '100/h')))\n"
+        ), [])
+
+    def test_lazy_frontend(self):
+        self.assertIn("tornado", get_loaded(
+            "import rate_limit\n"
+            "assert rate_limit.RateLimit.__module__ == 'rate_limit.client'\n"
+        ))
+
+    def test_unknown_attribute(self):
+        import rate_limit
+
+        with self.assertRaises(AttributeError):
+            rate_limit.Missing
+
+        from rate_limit import RateLimit
+        from rate_limit.client import RateLimit as client_rate_limit
+        self.assertIs(RateLimit, client_rate_limit)
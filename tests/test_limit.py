@@ -1,17 +1,31 @@
 from tornado.gen import coroutine
-from rate_limit.limit import Limit, RateLimitExceeded
+from tornado.concurrent import Future
+from rate_limit.limit import Limit, Decision, RateLimitExceeded
 from rate_limit.grammer import Or, And
 from helpers import mocked_future_response
 from tornado.testing import AsyncTestCase, gen_test
+from mock import Mock
 
 
-def mocked_limit(rate_limit_reached=False):
+def mocked_limit(rate_limit_reached=False, leases=None):
     """
-    returns a monkey patched Limit instance, with the rate_limit_reached
-    method returning value in 'rate_limit_reached' argument
+    returns a monkey patched Limit instance, with the decide method
+    returning a Decision, reached as in 'rate_limit_reached' argument
+    and holding leases.
     """
     limit = Limit(None, None)
-    limit.request_limit_reached = mocked_future_response(rate_limit_reached)
+
+    def decide(func_args=None):
+        decision = Decision(func_args=func_args)
+        decision.reached = rate_limit_reached
+        decision.leases = leases or {}
+
+        res = Future()
+        res.set_result(decision)
+
+        return res
+
+    limit.decide = Mock(side_effect=decide)
 
     return limit
 
@@ -30,6 +44,7 @@ class LimitTestCase(AsyncTestCase):
 
         self.assertEqual(selectors['vova']["allowed_requests"], 10)
         self.assertEqual(selectors['vova']["requests_span"], 60)
+        self.assertEqual(selectors['vova']["spans"], [5, 60])
         self.assertEqual(len(selectors), 1)
 
     def test_get_relevant_selectors_ignored_empty_selectors(self):
@@ -77,7 +92,7 @@ class LimitTestCase(AsyncTestCase):
             return returns
 
         self.assertEqual((yield func()), returns)
-        self.assertEqual(limit.request_limit_reached.call_count, 1)
+        self.assertEqual(limit.decide.call_count, 1)
 
     @gen_test
     def test_wrapping_a_coroutine(self):
@@ -95,7 +110,7 @@ class LimitTestCase(AsyncTestCase):
             return returns
 
         self.assertEqual((yield func()), returns)
-        self.assertEqual(limit.request_limit_reached.call_count, 1)
+        self.assertEqual(limit.decide.call_count, 1)
 
     @gen_test
     def test_raising_exception_when_rate_limit_reached(self):
@@ -114,7 +129,7 @@ class LimitTestCase(AsyncTestCase):
         with self.assertRaises(RateLimitExceeded):
             yield func()
 
-        self.assertEqual(limit.request_limit_reached.call_count, 1)
+        self.assertEqual(limit.decide.call_count, 1)
 
     @gen_test
     def test_contextmanager_basic(self):
@@ -128,7 +143,7 @@ class LimitTestCase(AsyncTestCase):
             ret = True
 
         self.assertTrue(ret)
-        self.assertEqual(limit.request_limit_reached.call_count, 1)
+        self.assertEqual(limit.decide.call_count, 1)
 
     @gen_test
     def test_contextmanager_returning_itself(self):
@@ -250,14 +265,23 @@ class LimitTestCase(AsyncTestCase):
 
             @limit
             def get_username(self):
-                return limit.get_selector("username")
+                return limit.get_selector(
+                    "username", Decision(func_args=(self,))
+                )
 
             @limit
             def get_apikey(self):
-                return limit.get_selector("apikey")
+                return limit.get_selector(
+                    "apikey", Decision(func_args=(self,))
+                )
+
+        api = API()
 
-        self.assertEqual((yield API().get_username()), "vova")
-        self.assertEqual((yield API().get_apikey()), "kitties")
+        self.assertEqual((yield api.get_username()), "vova")
+        self.assertEqual((yield api.get_apikey()), "kitties")
+
+        # the decision is given the args of the call
+        limit.decide.assert_called_with((api,))
 
     def test_get_selector_returns_none_when_underlying_returns_none(self):
         """
@@ -290,3 +314,85 @@ class LimitTestCase(AsyncTestCase):
             limit.create_identifier("user", "vova"),
             "some_key:user:vova"
         )
+
+    def test_get_cost(self):
+        self.assertEqual(Limit(None, None).get_cost(), 1)
+        self.assertEqual(Limit(None, None, cost=5).get_cost(), 5)
+        self.assertEqual(Limit(None, None, cost=lambda: 7).get_cost(), 7)
+
+        limit = Limit(None, None, cost="size", size=lambda: 9)
+        self.assertEqual(limit.get_cost(), 9)
+
+    def test_get_relevant_selectors_weighted_rules(self):
+        """
+        weighted rules get their own identifier, carrying the request cost
+        """
+
+        rules = And('user:5/s', 'user:1MB/m', 'user:10KB/s')
+        limit = Limit(None, rules, user="vova", key="k")
+        decision = limit.create_decision()
+        decision.cost = 100
+
+        selectors = limit.get_relevant_selectors(decision)
+
+        self.assertEqual(selectors['k:user:vova']["allowed_requests"], 5)
+        self.assertEqual(selectors['cost:k:user:vova'], {
+            "requests_span": 60,
+            "cost": 100
+        })
+
+    def test_get_relevant_selectors_concurrency_rules(self):
+        """
+        concurrency rules get their own identifier, all carrying
+        the same new lease
+        """
+
+        rules = And('user:5/s', 'user:conc=2', 'conc=10')
+        limit = Limit(None, rules, user="vova", key="k")
+
+        selectors = limit.get_relevant_selectors()
+        lease = selectors['conc:k:user:vova']["lease"]
+
+        self.assertEqual(selectors['k:user:vova']["allowed_requests"], 5)
+        self.assertEqual(selectors['conc:k'], {"lease": lease})
+        self.assertNotEqual(
+            limit.get_relevant_selectors()['conc:k']["lease"], lease
+        )
+
+    @gen_test
+    def test_contextmanager_releases_slots(self):
+        limit = mocked_limit(leases={"conc:k": "lease"})
+        limit.client = Mock()
+        limit.client.release_slots = mocked_future_response(None)
+
+        with (yield limit.cm()):
+            self.assertFalse(limit.client.release_slots.called)
+
+        limit.client.release_slots.assert_called_once_with(
+            {"conc:k": "lease"}
+        )
+
+    @gen_test
+    def test_decorator_releases_slots(self):
+        limit = mocked_limit(leases={"conc:k": "lease"})
+        limit.client = Mock()
+        limit.client.release_slots = mocked_future_response(None)
+
+        @limit
+        def func():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            yield func()
+
+        limit.client.release_slots.assert_called_once_with(
+            {"conc:k": "lease"}
+        )
+
+    @gen_test
+    def test_disabled_locks_arent_taken(self):
+        limit = Limit(Mock(disable_locks=True), '1/s', key="k")
+
+        self.assertEqual((yield limit.get_locks(Decision())), [])
+        self.assertIsNone((yield limit.release_locks([])))
+        self.assertFalse(limit.client.get_lock.called)
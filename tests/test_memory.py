@@ -0,0 +1,162 @@
+from rate_limit.memory import MemoryRateLimit
+from rate_limit.simulator import VirtualClock
+from rate_limit.metrics import Metrics
+from rate_limit.rule import Rule
+from rate_limit import RateLimitExceeded, Or
+from tornado.testing import AsyncTestCase, gen_test
+from tornado.gen import coroutine, moment
+
+
+class MemoryRateLimitTestCase(AsyncTestCase):
+    @gen_test
+    def test_limit(self):
+        clock = VirtualClock(100)
+        rl = MemoryRateLimit(clock=clock)
+
+        rl.limit('2/s', key="k")
+
+        for _ in range(2):
+            with (yield rl.limit(key="k").cm()):
+                pass
+
+        with self.assertRaises(RateLimitExceeded):
+            with (yield rl.limit(key="k").cm()):
+                pass
+
+        clock.advance(1)
+
+        with (yield rl.limit(key="k").cm()):
+            pass
+
+    @gen_test
+    def test_selectors(self):
+        clock = VirtualClock(100)
+        rl = MemoryRateLimit(namespace="ns", clock=clock)
+        rl.limit(Or('user:1/s', '3/m'), key="k")
+
+        for user in ("a", "a", "b"):
+            yield rl.limit(key="k", user=user).request_limit_reached()
+
+        self.assertEqual(list(rl.logs["ns:k:user:a"]), [100])
+        self.assertEqual(list(rl.logs["ns:k"]), [100, 100])
+
+    @gen_test
+    def test_expiry(self):
+        clock = VirtualClock(100)
+        rl = MemoryRateLimit(clock=clock)
+
+        yield rl.limit('2/s', key="k").request_limit_reached()
+        self.assertIn("k", rl.logs)
+
+        clock.advance(1)
+        rl.purge()
+
+        self.assertEqual(rl.logs, {})
+        self.assertEqual(rl.expires, {})
+
+    @gen_test
+    def test_cost_limit(self):
+        clock = VirtualClock(100)
+        rl = MemoryRateLimit(clock=clock)
+        rule = Rule("10units/m")
+
+        rl.push("cost:k", {"requests_span": 60, "cost": 4}, 50)
+        rl.push("cost:k", {"requests_span": 60, "cost": 3}, 90)
+        rl.push("cost:k", {"requests_span": 60, "cost": 2}, 100)
+
+        self.assertTrue((yield rl.is_cost_limit_reached("cost:k", rule, 2)))
+        self.assertFalse((yield rl.is_cost_limit_reached("cost:k", rule, 1)))
+
+        clock.set(115)
+        self.assertFalse((yield rl.is_cost_limit_reached("cost:k", rule, 5)))
+
+    @gen_test
+    def test_check_many(self):
+        rl = MemoryRateLimit(clock=VirtualClock(100))
+
+        res = yield rl.check_many(
+            [('user:2/s', {"user": "a"}, 1)] * 3, key="k"
+        )
+
+        self.assertEqual(res, [True, True, False])
+        self.assertEqual(list(rl.logs["k:user:a"]), [100, 100])
+
+    @gen_test
+    def test_round_trips(self):
+        metrics = Metrics()
+        rl = MemoryRateLimit(clock=VirtualClock(100), metrics=metrics)
+
+        yield rl.limit('2/s', key="k").request_limit_reached()
+
+        # lock, lookup, log and release
+        self.assertEqual(metrics.get_counter("redis_round_trips_total"), 4)
+
+    @gen_test
+    def test_interleave_without_locks(self):
+        clock = VirtualClock(100)
+        rl = MemoryRateLimit(disable_locks=True, interleave=True, clock=clock)
+        rl.limit('1/s', key="k")
+
+        res = yield [rl.limit(key="k").request_limit_reached()
+                     for _ in range(3)]
+
+        self.assertEqual(res, [False, False, False])
+
+    @gen_test
+    def test_interleave_with_locks(self):
+        clock = VirtualClock(100)
+        rl = MemoryRateLimit(interleave=True, clock=clock)
+        rl.limit('1/s', key="k")
+
+        res = yield [rl.limit(key="k").request_limit_reached()
+                     for _ in range(3)]
+
+        self.assertEqual(res, [False, True, True])
+
+    @gen_test
+    def test_concurrent_decorator_slots(self):
+        rl = MemoryRateLimit(interleave=True, clock=VirtualClock(100))
+
+        @rl.limit('conc=3')
+        @coroutine
+        def func():
+            yield moment
+
+        yield [func() for _ in range(3)]
+
+        # every call released its own slot
+        self.assertEqual(rl.slots.get("conc:func"), {})
+
+    @gen_test
+    def test_concurrency_limit(self):
+        clock = VirtualClock(100)
+        rl = MemoryRateLimit(clock=clock, lease_ttl=30)
+        rl.limit(Or('user:conc=1', '10/s'), key="k")
+
+        with (yield rl.limit(key="k", user="a").cm()):
+            with self.assertRaises(RateLimitExceeded):
+                with (yield rl.limit(key="k", user="a").cm()):
+                    pass
+
+            with (yield rl.limit(key="k", user="b").cm()):
+                pass
+
+        with (yield rl.limit(key="k", user="a").cm()):
+            pass
+
+    @gen_test
+    def test_lease_expiry(self):
+        clock = VirtualClock(100)
+        rl = MemoryRateLimit(clock=clock, lease_ttl=30)
+        rl.limit('conc=1', key="k")
+
+        # a worker crashed holding the slot
+        yield rl.limit(key="k").request_limit_reached()
+        self.assertTrue((yield rl.limit(key="k").request_limit_reached()))
+
+        clock.advance(30)
+        self.assertFalse((yield rl.limit(key="k").request_limit_reached()))
+
+        clock.advance(30)
+        rl.purge()
+        self.assertEqual(rl.slots, {})
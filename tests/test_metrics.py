@@ -0,0 +1,65 @@
+from rate_limit import RateLimit
+from rate_limit.metrics import Metrics, NullMetrics, Histogram
+from helpers import FakeRedis
+from tornado.testing import AsyncTestCase, gen_test
+import unittest
+
+
+class MetricsTestCase(unittest.TestCase):
+    def test_histogram(self):
+        histogram = Histogram(buckets=(1, 5))
+
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.get_cumulative_counts(),
+                         [(1, 2), (5, 3), ("+Inf", 4)])
+        self.assertEqual(histogram.sum, 14.5)
+
+    def test_to_prometheus(self):
+        metrics = Metrics(buckets=(1,))
+        metrics.observe("lock", 0.5)
+        metrics.decision("login", True)
+        metrics.rule_denied("login", 'user:"5/s')
+
+        self.assertEqual(metrics.to_prometheus().splitlines(), [
+            '# TYPE rate_limit_phase_seconds histogram',
+            'rate_limit_phase_seconds_bucket{le="1",phase="lock"} 1',
+            'rate_limit_phase_seconds_bucket{le="+Inf",phase="lock"} 1',
+            'rate_limit_phase_seconds_sum{phase="lock"} 0.5',
+            'rate_limit_phase_seconds_count{phase="lock"} 1',
+            '# TYPE rate_limit_decisions_total counter',
+            'rate_limit_decisions_total{key="login",result="deny"} 1',
+            '# TYPE rate_limit_rule_denies_total counter',
+            'rate_limit_rule_denies_total{key="login",rule="user:\\"5/s"} 1',
+        ])
+
+    def test_null_metrics(self):
+        metrics = NullMetrics()
+
+        with metrics.timer("lock"):
+            metrics.decision("k", True)
+
+        self.assertEqual(metrics.to_prometheus(), "\n")
+
+
+class InstrumentedLimitTestCase(AsyncTestCase):
+    @gen_test
+    def test_decisions_are_instrumented(self):
+        metrics = Metrics()
+        rl = RateLimit(FakeRedis(), disable_locks=True, metrics=metrics)
+        limit = rl.limit('user:1/m', key="k", user="vova")
+
+        yield limit.request_limit_reached()
+        yield limit.request_limit_reached()
+
+        self.assertEqual(metrics.get_counter(
+            "decisions_total", key="k", result="allow"), 1)
+        self.assertEqual(metrics.get_counter(
+            "decisions_total", key="k", result="deny"), 1)
+        self.assertEqual(metrics.get_counter(
+            "rule_denies_total", key="k", rule="user:1/m"), 1)
+        self.assertEqual(metrics.get_counter("redis_round_trips_total"), 3)
+
+        self.assertEqual(metrics.histograms["lookup"].count, 2)
+        self.assertEqual(metrics.histograms["log"].count, 1)
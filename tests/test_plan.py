@@ -0,0 +1,57 @@
+from rate_limit.plan import Plan, lookup_cost
+from rate_limit.limit import Limit
+from rate_limit.grammer import And, Or
+import unittest
+
+
+class PlanTestCase(unittest.TestCase):
+    def test_lookup_cost(self):
+        self.assertEqual(lookup_cost(5, 5000), 4)
+        self.assertEqual(lookup_cost(5000, 5000), 0)
+        self.assertEqual(lookup_cost(2500, 5000), 2499)
+
+    def test_rules_are_compiled_once(self):
+        plan = Plan(Or('5/s', And('5/s', 'user:1/m')))
+
+        self.assertEqual(len(plan.get_rules()), 2)
+        self.assertIs(plan.get_rule('5/s'), plan.get_rule('5/s'))
+
+    def test_cheap_lookups_share_a_list(self):
+        plan = Plan(And('user:5/s', 'user:5000/h'))
+
+        self.assertEqual(plan.describe(), {"user": [{
+            "selector": "user",
+            "suffix": "",
+            "length": 5000,
+            "rules": ["5/s", "5000/h"],
+            "lookup_costs": [4, 0],
+        }]})
+
+    def test_deep_lookups_get_their_own_list(self):
+        plan = Plan(Or('user:5/s', 'user:2500/m', 'user:5000/h'))
+        layouts = plan.describe()["user"]
+
+        self.assertEqual([layout["length"] for layout in layouts],
+                         [2500, 5000])
+        self.assertEqual(layouts[0]["rules"], ["5/s", "2500/m"])
+
+        rule = plan.get_rule('user:5/s')
+        self.assertEqual(plan.get_list_identifier("k:user:vova", rule),
+                         "k:user:vova#2500")
+
+        rule = plan.get_rule('user:5000/h')
+        self.assertEqual(plan.get_list_identifier("k:user:vova", rule),
+                         "k:user:vova")
+
+    def test_write_cost(self):
+        plan = Plan(Or('50/s', '100/m'), write_cost=10)
+        self.assertEqual(len(plan.describe()[None]), 2)
+
+    def test_limit_logs_to_planned_lists(self):
+        limit = Limit(None, Or('user:5/s', 'user:2500/m', 'user:5000/h'),
+                      user="vova", key="k")
+        selectors = limit.get_relevant_selectors()
+
+        self.assertEqual(selectors["k:user:vova#2500"]["allowed_requests"],
+                         2500)
+        self.assertEqual(selectors["k:user:vova"]["allowed_requests"], 5000)
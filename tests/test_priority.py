@@ -0,0 +1,156 @@
+from rate_limit import RateLimit, RateLimitExceeded
+from rate_limit.priority import PriorityClasses
+from rate_limit.memory import MemoryRateLimit
+from rate_limit.simulator import VirtualClock
+from rate_limit.rule import Rule
+from helpers import FakeRedis
+from tornado.testing import AsyncTestCase, gen_test
+from unittest import TestCase
+
+
+class PriorityClassesTestCase(TestCase):
+    def setUp(self):
+        self.priorities = PriorityClasses(
+            {"bulk": 0.7, "batch": 0.29, "interactive": 1}, default="bulk"
+        )
+
+    def test_get_rule(self):
+        rule = Rule("user:100/m")
+
+        self.assertEqual(
+            self.priorities.get_rule(rule, "bulk").allowed_requests, 70
+        )
+        self.assertEqual(
+            self.priorities.get_rule(rule, "batch").allowed_requests, 29
+        )
+        self.assertIs(self.priorities.get_rule(rule, "interactive"), rule)
+        self.assertEqual(rule.allowed_requests, 100)
+
+        # requests without a class get the default one
+        self.assertEqual(
+            self.priorities.get_rule(rule, None).allowed_requests, 70
+        )
+
+    def test_at_least_one(self):
+        rule = self.priorities.get_rule(Rule("user:conc=2"), "batch")
+
+        self.assertEqual(rule.allowed_requests, 1)
+        self.assertEqual(rule.concurrency, 1)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            PriorityClasses({"bulk": 1.5})
+
+        with self.assertRaises(ValueError):
+            PriorityClasses({"bulk": 0.5}, default="interactive")
+
+        with self.assertRaises(RuntimeError):
+            self.priorities.get_share("unknown")
+
+        self.assertEqual(PriorityClasses({"bulk": 0.5}).get_share(None), 1)
+
+
+class PriorityTestCase(AsyncTestCase):
+    def setUp(self):
+        super(PriorityTestCase, self).setUp()
+
+        self.redis = FakeRedis()
+        self.rl = RateLimit(self.redis, disable_locks=True,
+                            clock=VirtualClock(1000))
+        self.rl.limit('user:10/m', key="api", priorities=PriorityClasses(
+            {"bulk": 0.7, "interactive": 1}
+        ))
+
+    @gen_test
+    def test_headroom(self):
+        results = []
+
+        for _ in range(8):
+            limit = self.rl.limit(key="api", user="a", priority="bulk")
+            results.append((yield limit.request_limit_reached()))
+
+        self.assertEqual(results, [False] * 7 + [True])
+
+        # interactive requests use the reserved headroom
+        for _ in range(3):
+            limit = self.rl.limit(key="api", user="a",
+                                  priority=lambda: "interactive")
+            self.assertFalse((yield limit.request_limit_reached()))
+
+        limit = self.rl.limit(key="api", user="a", priority="interactive")
+        self.assertTrue((yield limit.request_limit_reached()))
+
+        # every class shares the same list, of 10 requests and a base
+        self.assertEqual(list(self.redis.data), ["api:user:a"])
+        self.assertEqual(len(self.redis.data["api:user:a"]), 11)
+
+    @gen_test
+    def test_single_lookup(self):
+        for _ in range(7):
+            yield self.rl.limit(key="api", user="a").request_limit_reached()
+
+        self.redis.round_trips = 0
+        decision = yield self.rl.limit(
+            key="api", user="a", priority="bulk"
+        ).decide()
+
+        self.assertTrue(decision.reached)
+        self.assertEqual(decision.denied_rule, "user:10/m")
+        self.assertEqual(self.redis.round_trips, 1)
+
+    @gen_test
+    def test_selector(self):
+        """
+        a decorated method takes its class from its own request, and
+        concurrent calls keep their own class
+        """
+
+        rl = MemoryRateLimit(clock=VirtualClock(1000), interleave=True)
+        priorities = PriorityClasses({"bulk": 0.5, "interactive": 1})
+
+        class Job(object):
+            def __init__(self, kind):
+                self.kind = kind
+
+            @rl.limit('2/m', key="jobs", priorities=priorities,
+                      priority="kind")
+            def run(self):
+                return self.kind
+
+        yield Job("bulk").run()
+
+        interactive, bulk = Job("interactive").run(), Job("bulk").run()
+
+        self.assertEqual((yield interactive), "interactive")
+
+        with self.assertRaises(RateLimitExceeded):
+            yield bulk
+
+    @gen_test
+    def test_check_many(self):
+        self.rl.limit('user:10/s', key="bulk", priorities=PriorityClasses(
+            {"bulk": 0.2}, default="bulk"
+        ))
+
+        res = yield self.rl.check_many(
+            [(None, {"user": "a"}, 1)] * 3, key="bulk"
+        )
+
+        self.assertEqual(res, [True, True, False])
+
+
+class MemoryPriorityTestCase(AsyncTestCase):
+    @gen_test
+    def test_memory(self):
+        rl = MemoryRateLimit(clock=VirtualClock(1000))
+        rl.limit('5/s', key="api", priorities=PriorityClasses(
+            {"bulk": 0.6, "interactive": 1}, default="bulk"
+        ))
+
+        results = []
+
+        for priority in [None] * 4 + ["interactive"] * 3:
+            limit = rl.limit(key="api", priority=priority)
+            results.append((yield limit.request_limit_reached()))
+
+        self.assertEqual(results, [False] * 3 + [True] + [False] * 2 + [True])
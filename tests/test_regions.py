@@ -0,0 +1,251 @@
+from rate_limit.regions import MultiRegionRateLimit, Replicator
+from rate_limit.simulator import VirtualClock
+from rate_limit.metrics import Metrics
+from rate_limit.grammer import And
+from helpers import FakeRedis, gen_random_string
+from tornado.testing import AsyncTestCase, gen_test
+from tornado.gen import sleep
+import tornadoredis
+import pytest
+
+slow = pytest.mark.slow
+
+REGIONS = ("eu", "us", "ap")
+
+
+class BrokenRedis(FakeRedis):
+    def do_hset(self, key, field, value):
+        raise IOError("connection refused")
+
+
+class MultiRegionTestCase(AsyncTestCase):
+    def setUp(self):
+        super(MultiRegionTestCase, self).setUp()
+
+        self.clock = VirtualClock(1000)
+        self.redis = dict((region, FakeRedis()) for region in REGIONS)
+        self.regions = dict(
+            (region, MultiRegionRateLimit(
+                self.redis[region], region, namespace="ns",
+                disable_locks=True, clock=self.clock
+            ))
+            for region in REGIONS
+        )
+
+        for rl in self.regions.values():
+            rl.limit('5/10s', key="k")
+
+    def get_replicator(self, region, **kwargs):
+        return Replicator(self.regions[region], dict(
+            (remote, self.redis[remote]) for remote in REGIONS
+            if remote != region
+        ), **kwargs)
+
+    def admit(self, region, count):
+        """
+        runs count decisions in region, returns how many were allowed.
+        FakeRedis answers synchronously, so decisions are done on return.
+        """
+
+        return sum(
+            not self.regions[region].limit(
+                key="k"
+            ).request_limit_reached().result()
+            for _ in range(count)
+        )
+
+    def test_counters(self):
+        self.assertEqual(self.admit("eu", 7), 5)
+        self.assertEqual(
+            self.redis["eu"].data["ns:crdt:k:10:100"], {"eu": "5"}
+        )
+        self.assertEqual(self.redis["eu"].ttls["ns:crdt:k:10:100"], 21)
+        self.assertEqual(
+            self.redis["eu"].data["ns:crdt:dirty"], set(["ns:crdt:k:10:100"])
+        )
+
+    def test_spans(self):
+        rl = self.regions["eu"]
+        rl.limit(And('user:2/s', 'user:10/m'), key="multi")
+
+        rl.limit(key="multi", user="a").request_limit_reached().result()
+
+        self.assertEqual(self.redis["eu"].data["ns:crdt:multi:user:a:1:1000"],
+                         {"eu": "1"})
+        self.assertEqual(self.redis["eu"].data["ns:crdt:multi:user:a:60:16"],
+                         {"eu": "1"})
+
+    def test_sliding_estimate(self):
+        self.assertEqual(self.admit("eu", 5), 5)
+
+        # the previous window counts in full until it rolls over
+        self.clock.set(1012)
+        self.assertEqual(self.admit("eu", 5), 0)
+
+        self.clock.set(1020)
+        self.assertEqual(self.admit("eu", 5), 5)
+
+    @gen_test
+    def test_window_boundary_burst(self):
+        """
+        without replication lag, a burst at the end of a window and one
+        right after it together are capped at the limit
+        """
+
+        self.clock.set(1009.9)
+        self.assertEqual(self.admit("eu", 5), 5)
+        yield self.get_replicator("eu").replicate()
+
+        self.clock.set(1010.1)
+        self.assertEqual(self.admit("eu", 5) + self.admit("us", 5), 0)
+
+        self.clock.set(1019.8)
+        self.assertEqual(self.admit("us", 5), 0)
+
+    def test_regions_without_replication(self):
+        self.assertEqual(self.admit("eu", 5), 5)
+        self.assertEqual(self.admit("us", 5), 5)
+
+    @gen_test
+    def test_replication(self):
+        self.assertEqual(self.admit("eu", 3), 3)
+        yield self.get_replicator("eu").replicate()
+
+        self.assertEqual(self.redis["us"].data["ns:crdt:k:10:100"],
+                         {"eu": "3"})
+        self.assertEqual(self.redis["us"].ttls["ns:crdt:k:10:100"], 21)
+        self.assertEqual(self.admit("us", 5), 2)
+        self.assertEqual(self.admit("ap", 5), 2)
+
+        yield self.get_replicator("us").replicate()
+        self.assertEqual(self.redis["eu"].data["ns:crdt:k:10:100"],
+                         {"eu": "3", "us": "2"})
+        self.assertEqual(self.admit("eu", 5), 0)
+
+    @gen_test
+    def test_redelivery(self):
+        replicator = self.get_replicator("eu")
+        self.admit("eu", 2)
+        yield replicator.replicate()
+        self.admit("eu", 1)
+        yield replicator.replicate()
+        yield replicator.replicate()
+
+        self.assertEqual(self.redis["us"].data["ns:crdt:k:10:100"],
+                         {"eu": "3"})
+        self.assertNotIn("ns:crdt:dirty", self.redis["eu"].data)
+
+    @gen_test
+    def test_counter_without_ttl(self):
+        """
+        tornadoredis reports the TTL of a key without one as None, such
+        counters aren't shipped
+        """
+
+        self.admit("eu", 2)
+        del self.redis["eu"].ttls["ns:crdt:k:10:100"]
+        yield self.get_replicator("eu").replicate()
+
+        self.assertNotIn("ns:crdt:k:10:100", self.redis["us"].data)
+
+    @gen_test
+    def test_delay(self):
+        metrics = Metrics()
+        replicator = self.get_replicator("eu", delay=2, metrics=metrics)
+
+        self.admit("eu", 5)
+        yield replicator.replicate()
+        self.assertEqual(self.admit("us", 5), 5)
+
+        self.clock.advance(2)
+        yield replicator.replicate()
+        self.assertEqual(self.admit("ap", 5), 0)
+
+        self.assertEqual(metrics.histograms["replication"].count, 2)
+        self.assertEqual(metrics.histograms["replication"].sum, 4)
+
+    @gen_test
+    def test_failed_region_is_retried(self):
+        replicator = self.get_replicator("eu")
+        replicator.remotes["us"] = BrokenRedis()
+
+        self.admit("eu", 2)
+        yield replicator.replicate()
+
+        self.assertEqual(self.redis["ap"].data["ns:crdt:k:10:100"],
+                         {"eu": "2"})
+        self.assertEqual(replicator.outboxes["us"], {
+            "ns:crdt:k:10:100": (2, 21, 1000)
+        })
+
+        replicator.remotes["us"] = self.redis["us"]
+        yield replicator.replicate()
+
+        self.assertEqual(self.redis["us"].data["ns:crdt:k:10:100"],
+                         {"eu": "2"})
+        self.assertEqual(replicator.outboxes["us"], {})
+
+    @gen_test
+    def test_unsupported_rules(self):
+        rl = self.regions["eu"]
+
+        with self.assertRaises(RuntimeError):
+            yield rl.limit('user:1MB/m', user="a").request_limit_reached()
+
+        with self.assertRaises(RuntimeError):
+            yield rl.limit('conc=2').request_limit_reached()
+
+
+class MultiRegionRedisTestCase(AsyncTestCase):
+    """
+    regions backed by separate databases of a local redis-server, a Redis
+    per region behaves the same.
+    """
+
+    @slow
+    @gen_test(timeout=10)
+    def test_replication_lag(self):
+        namespace = gen_random_string()
+        regions = {}
+
+        for db, region in enumerate(REGIONS, 1):
+            redis_conn = tornadoredis.Client(selected_db=db)
+            redis_conn.connect()
+            regions[region] = MultiRegionRateLimit(
+                redis_conn, region, namespace=namespace
+            )
+            regions[region].limit('10/h', key="k")
+
+        replicators = [
+            Replicator(rl, dict(
+                (remote, regions[remote].redis_conn) for remote in REGIONS
+                if remote != region
+            ), interval=0.05, delay=0.2)
+            for region, rl in regions.items()
+        ]
+
+        for replicator in replicators:
+            replicator.start()
+
+        try:
+            for _ in range(4):
+                yield regions["eu"].limit(key="k").request_limit_reached()
+
+            # before the lag, us still admits the whole limit
+            self.assertFalse((
+                yield regions["us"].limit(key="k").request_limit_reached()
+            ))
+
+            yield sleep(0.5)
+
+            allowed = 0
+            for _ in range(10):
+                reached = yield regions["ap"].limit(
+                    key="k"
+                ).request_limit_reached()
+                allowed += not reached
+
+            self.assertEqual(allowed, 5)
+        finally:
+            for replicator in replicators:
+                replicator.stop()
@@ -1,6 +1,8 @@
 
 from __future__ import division
-from rate_limit.rule import parse_rate_string, parse_expression
+from rate_limit.rule import (
+    parse_rate_string, parse_expression, parse_amount, Rule
+)
 import unittest
 
 
@@ -33,7 +35,25 @@ class ParseRateTestCase(unittest.TestCase):
     def test_multiple_hours(self):
         self.assertParseTime("3/5h", 3, 5 * 60 * 60)
 
+    def test_days(self):
+        self.assertParseTime("1000/d", 1000, 24 * 60 * 60)
+        self.assertParseTime("1000/7d", 1000, 7 * 24 * 60 * 60)
+
+    def test_milliseconds(self):
+        self.assertParseTime("50/100ms", 50, 0.1)
+        self.assertParseTime("50/ms", 50, 0.001)
+        self.assertParseTime("50/1000ms", 50, 1)
+
+    def test_fractional(self):
+        self.assertParseTime("5/1.5s", 5, 1.5)
+        self.assertParseTime("5/0.5m", 5, 30)
+        self.assertEqual(Rule("user:50/100ms").requests_span, 0.1)
+        self.assertEqual(Rule("user:10-50/0.5s").requests_span, 0.5)
+
     def test_bad_rate(self):
+        self.assertBadRateRaises("1/1.s")
+        self.assertBadRateRaises("1/5ds")
+        self.assertBadRateRaises("1/.5s")
         self.assertBadRateRaises(None)
         self.assertBadRateRaises("")
         self.assertBadRateRaises("1/")
@@ -92,3 +112,70 @@ class ExpressionParserTestCase(unittest.TestCase):
         self.assertBadExpressionRaises("vova:15/s/:1.0")
         self.assertBadExpressionRaises("vova:15/s:-1.0")
         self.assertBadExpressionRaises("vova:15/s:2.0")
+
+
+class WeightedRuleTestCase(unittest.TestCase):
+    def test_parse_amount(self):
+        self.assertEqual(parse_amount("10"), (10, None))
+        self.assertEqual(parse_amount("10MB"), (10 * 1024 * 1024, "MB"))
+        self.assertEqual(parse_amount("1000units"), (1000, "units"))
+
+    def test_weighted_rule(self):
+        rule = Rule("apikey:10KB/m")
+
+        self.assertEqual(rule.selector, "apikey")
+        self.assertEqual(rule.allowed_requests, 10 * 1024)
+        self.assertEqual(rule.requests_span, 60)
+        self.assertEqual(rule.unit, "KB")
+
+    def test_plain_rule_has_no_unit(self):
+        self.assertEqual(Rule("5/s").unit, None)
+
+
+class ConcurrencyRuleTestCase(unittest.TestCase):
+    def test_concurrency_rule(self):
+        rule = Rule("user:conc=5")
+
+        self.assertEqual(rule.selector, "user")
+        self.assertEqual(rule.rate, "conc=5")
+        self.assertEqual(rule.concurrency, 5)
+        self.assertEqual(rule.requests_span, None)
+        self.assertEqual(rule.unit, None)
+
+    def test_global_concurrency_rule(self):
+        rule = Rule("conc=20")
+
+        self.assertEqual(rule.selector, None)
+        self.assertEqual(rule.concurrency, 20)
+
+    def test_rate_rule_has_no_concurrency(self):
+        self.assertEqual(Rule("5/s").concurrency, None)
+
+    def test_malformed_concurrency_rules(self):
+        for expression in ("conc=", "conc=5/s", "user:conc5", "conc=-1"):
+            with self.assertRaises(SyntaxError):
+                Rule(expression)
+
+
+class AdaptiveRuleTestCase(unittest.TestCase):
+    def test_adaptive_rule(self):
+        rule = Rule("user:20-200/s")
+
+        self.assertTrue(rule.adaptive)
+        self.assertEqual(rule.selector, "user")
+        self.assertEqual(rule.rate, "20-200/s")
+        self.assertEqual(rule.min_requests, 20)
+        self.assertEqual(rule.max_requests, 200)
+        self.assertEqual(rule.allowed_requests, 200)
+        self.assertEqual(rule.requests_span, 1)
+
+    def test_static_rule_is_not_adaptive(self):
+        rule = Rule("5/s")
+
+        self.assertFalse(rule.adaptive)
+        self.assertEqual(rule.min_requests, None)
+
+    def test_malformed_adaptive_rules(self):
+        for expression in ("20-/s", "200-20/s", "20-200MB/s", "-20/s"):
+            with self.assertRaises(SyntaxError):
+                Rule(expression)
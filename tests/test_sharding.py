@@ -0,0 +1,84 @@
+from rate_limit import RateLimit
+from rate_limit.limit import Decision
+from rate_limit.memory import MemoryRateLimit
+from rate_limit.simulator import VirtualClock
+from rate_limit.grammer import Or
+from rate_limit.rule import Rule
+from rate_limit.sharding import get_shard_rule, get_spill_order
+from helpers import FakeRedis
+from tornado.testing import AsyncTestCase, gen_test
+from mock import patch
+import unittest
+
+
+class ShardingTestCase(unittest.TestCase):
+    def test_get_shard_rule_splits_budget(self):
+        rule = Rule("10/s")
+        allowed = [get_shard_rule(rule, shard, 4).allowed_requests
+                   for shard in range(4)]
+
+        self.assertEqual(allowed, [3, 3, 2, 2])
+        self.assertEqual(rule.allowed_requests, 10)
+
+    def test_get_shard_rule_allows_at_least_one(self):
+        self.assertEqual(get_shard_rule(Rule("2/s"), 3, 4).allowed_requests,
+                         1)
+
+    def test_get_spill_order(self):
+        self.assertEqual(get_spill_order(3, 4), [3, 0])
+        self.assertEqual(get_spill_order(0, 1), [0])
+
+
+class ShardedLimitTestCase(AsyncTestCase):
+    @gen_test
+    def test_spill_over(self):
+        redis = FakeRedis()
+        rl = RateLimit(redis, disable_locks=True)
+        limit = rl.limit(Or('4/m', 'user:10/m'), key="k", shards=2,
+                         user="vova")
+
+        res = []
+
+        with patch("rate_limit.limit.pick_shard", return_value=0):
+            for _ in range(5):
+                res.append((yield limit.request_limit_reached()))
+
+        self.assertEqual(res, [False, False, False, False, True])
+        # the requests and the base timestamp of each list
+        self.assertEqual(len(redis.data["k:shard:0"]), 3)
+        self.assertEqual(len(redis.data["k:shard:1"]), 3)
+        self.assertEqual(len(redis.data["k:user:vova"]), 5)
+
+    def test_lock_identifiers(self):
+        rl = RateLimit(FakeRedis())
+        decision = Decision()
+        decision.shard = 3
+
+        limit = rl.limit('4/m', key="k", shards=4)
+        decision.plan, decision.spill_order = limit.get_plan(), [3, 0]
+        self.assertEqual(limit.get_lock_identifiers(decision),
+                         ["k:0", "k:3"])
+
+        # selector rules aren't split, they stay under the key's lock
+        limit = rl.limit(Or('4/m', 'user:10/m'), key="k2", shards=4)
+        decision.plan = limit.get_plan()
+        self.assertEqual(limit.get_lock_identifiers(decision),
+                         ["k2", "k2:0", "k2:3"])
+
+    @gen_test
+    def test_concurrent_shards(self):
+        """
+        selector rules of decisions on different shards are still
+        mutually exclusive
+        """
+
+        rl = MemoryRateLimit(interleave=True, clock=VirtualClock(100))
+        rl.limit(Or('4/m', 'user:1/m'), key="k")
+
+        with patch("rate_limit.limit.pick_shard", side_effect=[0, 1]):
+            res = yield [
+                rl.limit(key="k", user="vova", shards=2)
+                .request_limit_reached() for _ in range(2)
+            ]
+
+        self.assertEqual(sorted(res), [False, True])
@@ -0,0 +1,305 @@
+from rate_limit.shared import SharedMemoryTable, SharedMemoryRateLimit
+from rate_limit.memory import MemoryRateLimit
+from rate_limit.simulator import VirtualClock
+from rate_limit.metrics import Metrics
+from rate_limit.rule import Rule
+from rate_limit import Or
+from rate_limit.shared import hash_identifier
+from tornado.testing import AsyncTestCase, gen_test
+from unittest import TestCase
+from time import time, sleep
+import tempfile
+import shutil
+import fcntl
+import os
+
+PARAMS = {"allowed_requests": 3, "requests_span": 10}
+
+
+class SharedMemoryTableTestCase(TestCase):
+    def setUp(self):
+        self.table = SharedMemoryTable(sets=4, ways=2, capacity=4)
+
+    def tearDown(self):
+        self.table.close()
+
+    def test_push(self):
+        self.table.push("a", PARAMS, 100)
+        self.table.push("a", PARAMS, 101, count=2)
+
+        self.assertEqual(self.table.get_log("a", 101), [101, 101, 100])
+        self.assertEqual(self.table.lookup("a", 2, 101), 100)
+        self.assertEqual(self.table.lookup("a", 3, 101), None)
+        self.assertEqual(self.table.get_log("b", 101), [])
+
+    def test_ring_buffer(self):
+        for now in range(6):
+            self.table.push("a", PARAMS, now)
+
+        self.assertEqual(self.table.get_log("a", 5), [5, 4, 3, 2])
+
+    def test_expiry(self):
+        self.table.push("a", PARAMS, 100)
+
+        self.assertEqual(self.table.get_log("a", 110), [])
+
+        self.table.push("a", PARAMS, 110)
+        self.assertEqual(self.table.get_log("a", 110), [110])
+
+    def test_eviction(self):
+        table = SharedMemoryTable(sets=1, ways=2, capacity=4)
+
+        table.push("a", {"allowed_requests": 1, "requests_span": 30}, 100)
+        table.push("b", {"allowed_requests": 1, "requests_span": 10}, 100)
+        table.push("c", {"allowed_requests": 1, "requests_span": 20}, 100)
+
+        self.assertEqual(table.get_log("a", 100), [100])
+        self.assertEqual(table.get_log("b", 100), [])
+        self.assertEqual(table.get_log("c", 100), [100])
+
+    def test_capacity(self):
+        with self.assertRaises(RuntimeError):
+            self.table.push("a", {"allowed_requests": 5, "requests_span": 1},
+                            0)
+
+    def test_shared_by_path(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "table")
+
+        try:
+            first = SharedMemoryTable(path, sets=4, ways=2, capacity=4)
+            second = SharedMemoryTable(path, sets=4, ways=2, capacity=4)
+
+            first.push("a", PARAMS, 100)
+            self.assertEqual(second.get_log("a", 100), [100])
+
+            with self.assertRaises(ValueError):
+                SharedMemoryTable(path, sets=8, ways=2, capacity=4)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_shared_by_fork(self):
+        pid = os.fork()
+
+        if pid == 0:
+            self.table.push("a", PARAMS, 100)
+            os._exit(0)
+
+        os.waitpid(pid, 0)
+
+        self.assertEqual(self.table.get_log("a", 100), [100])
+
+
+class SharedMemoryRateLimitTestCase(AsyncTestCase):
+    def setUp(self):
+        super(SharedMemoryRateLimitTestCase, self).setUp()
+
+        self.clock = VirtualClock(100)
+        self.table = SharedMemoryTable(sets=16, ways=2, capacity=8)
+
+    def tearDown(self):
+        self.table.close()
+        super(SharedMemoryRateLimitTestCase, self).tearDown()
+
+    @gen_test
+    def test_limit(self):
+        rl = SharedMemoryRateLimit(self.table, "ns", clock=self.clock)
+        rl.limit(Or('user:2/s', '3/m'), key="k")
+
+        res = []
+
+        for user in ("a", "a", "a", "b", "b"):
+            limit = rl.limit(key="k", user=user)
+            res.append((yield limit.request_limit_reached()))
+
+        self.assertEqual(res, [False, False, True, False, True])
+        self.assertEqual(self.table.get_log("ns:k", 100), [100, 100, 100])
+
+    @gen_test
+    def test_check(self):
+        rl = SharedMemoryRateLimit(self.table, "ns", clock=self.clock)
+        rl.limit(Or('user:2/s', '3/m'), key="k")
+
+        res = [rl.check("k", user=user) for user in ("a", "a", "a", "b")]
+
+        self.assertEqual(res, [False, False, True, False])
+        self.assertEqual(self.table.get_log("ns:k", 100), [100, 100, 100])
+
+        # coroutine decisions share the same logs
+        limit = rl.limit(key="k", user="b")
+        self.assertTrue((yield limit.request_limit_reached()))
+
+        self.clock.advance(60)
+        self.assertFalse(rl.check("k", {"user": "a"}))
+
+    def test_check_unsupported(self):
+        rl = SharedMemoryRateLimit(self.table, clock=self.clock)
+        rl.limit(Or('user:2/s', 'user:10units/m'), key="weighted")
+
+        with self.assertRaises(RuntimeError):
+            rl.check("weighted", user="a")
+
+        remote = MemoryRateLimit(clock=self.clock)
+        rl = SharedMemoryRateLimit(self.table, remote=remote, clock=self.clock)
+        rl.limit('2/s', key="k")
+
+        with self.assertRaises(RuntimeError):
+            rl.check("k")
+
+    def test_check_removed_rules(self):
+        rl = SharedMemoryRateLimit(self.table, clock=self.clock)
+        rl.set_rules({"k": '1/s'})
+
+        self.assertFalse(rl.check("k"))
+        self.assertTrue(rl.check("k"))
+
+        rl.remove_rules(["k"])
+        self.assertFalse(rl.check("k"))
+
+    @gen_test
+    def test_check_many(self):
+        rl = SharedMemoryRateLimit(self.table, clock=self.clock)
+
+        res = yield rl.check_many(
+            [('user:2/s', {"user": "a"}, 1)] * 3, key="k"
+        )
+
+        self.assertEqual(res, [True, True, False])
+        self.assertEqual(self.table.get_log("k:user:a", 100), [100, 100])
+
+    @gen_test
+    def test_weighted_rules_need_a_remote(self):
+        rl = SharedMemoryRateLimit(self.table, clock=self.clock)
+
+        with self.assertRaises(RuntimeError):
+            yield rl.is_cost_limit_reached("k", Rule("10units/m"), 1)
+
+    @gen_test
+    def test_tier(self):
+        metrics = Metrics()
+        remote = MemoryRateLimit(clock=self.clock, metrics=metrics)
+        rl = SharedMemoryRateLimit(self.table, remote=remote, clock=self.clock)
+        rl.limit('2/s', key="k")
+
+        # another host logged a request
+        remote.push("k", {"allowed_requests": 2, "requests_span": 1}, 100)
+
+        res = []
+
+        for _ in range(3):
+            res.append((yield rl.limit(key="k").request_limit_reached()))
+
+        self.assertEqual(res, [False, True, True])
+        self.assertEqual(list(remote.logs["k"]), [100, 100])
+        self.assertEqual(self.table.get_log("k", 100), [100])
+
+        # lock, lookup, log and release, then lock, lookup and release twice,
+        # the local log holds a single request, so it can't deny
+        self.assertEqual(metrics.get_counter("redis_round_trips_total"), 10)
+
+        self.table.push("k", {"allowed_requests": 2, "requests_span": 1}, 100)
+        self.assertTrue((yield rl.limit(key="k").request_limit_reached()))
+
+        # denied locally, only the remote lock was taken and released
+        self.assertEqual(metrics.get_counter("redis_round_trips_total"), 12)
+
+    @gen_test
+    def test_lock(self):
+        rl = SharedMemoryRateLimit(self.table, clock=self.clock)
+
+        lock = yield rl.get_lock("k")
+        second = rl.get_lock("k")
+
+        self.assertFalse(second.done())
+
+        yield rl.release_lock(lock)
+        yield rl.release_lock((yield second))
+
+    def fork_locker(self, key, hold):
+        """
+        forks a process trying the stripe lock of key, holding it for hold
+        seconds if taken, returns its pid once it tried.
+        """
+
+        offset = self.table.sets + hash_identifier(key) % 1024
+        read, write = os.pipe()
+        pid = os.fork()
+
+        if pid == 0:
+            try:
+                fcntl.lockf(self.table.fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1,
+                            offset, os.SEEK_SET)
+                os.write(write, b"1")
+                sleep(hold)
+            except IOError:
+                os.write(write, b"0")
+            finally:
+                os._exit(0)
+
+        locked = os.read(read, 1) == b"1"
+        os.close(read)
+        os.close(write)
+
+        return pid, locked
+
+    @gen_test
+    def test_lock_doesnt_block(self):
+        """
+        a stripe locked by another process is polled, without blocking
+        """
+
+        rl = SharedMemoryRateLimit(self.table, clock=self.clock,
+                                   lock_polling_interval=0.01)
+        pid, locked = self.fork_locker("k", 0.5)
+
+        try:
+            self.assertTrue(locked)
+
+            start = time()
+            lock = rl.get_lock("k")
+            self.assertLess(time() - start, 0.2)
+            self.assertFalse(lock.done())
+
+            yield rl.release_lock((yield lock))
+        finally:
+            os.waitpid(pid, 0)
+
+    def test_check_lock(self):
+        """
+        check waits for a stripe locked by another process
+        """
+
+        rl = SharedMemoryRateLimit(self.table, clock=self.clock)
+        rl.limit('2/s', key="k")
+        pid, locked = self.fork_locker("k", 0.3)
+
+        try:
+            self.assertTrue(locked)
+
+            start = time()
+            self.assertFalse(rl.check("k"))
+            self.assertGreater(time() - start, 0.1)
+        finally:
+            os.waitpid(pid, 0)
+
+    @gen_test
+    def test_tier_lock(self):
+        """
+        given a remote, its lock excludes the other processes, the stripe
+        is only locked within this process
+        """
+
+        remote = MemoryRateLimit(clock=self.clock)
+        rl = SharedMemoryRateLimit(self.table, remote=remote, clock=self.clock)
+
+        lock = yield rl.get_lock("k")
+        pid, locked = self.fork_locker("k", 0)
+        os.waitpid(pid, 0)
+
+        self.assertTrue(locked)
+
+        second = rl.get_lock("k")
+        self.assertFalse(second.done())
+
+        yield rl.release_lock(lock)
+        yield rl.release_lock((yield second))
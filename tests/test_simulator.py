@@ -0,0 +1,81 @@
+from rate_limit.simulator import (
+    VirtualClock, Simulator, generate_traffic, read_access_log,
+    get_max_window_count
+)
+from rate_limit.memory import MemoryRateLimit
+from rate_limit import Or
+from unittest import TestCase
+
+
+class SimulatorTestCase(TestCase):
+    def test_virtual_clock(self):
+        clock = VirtualClock(10)
+        clock.advance(1.5)
+
+        self.assertEqual(clock(), 11.5)
+
+    def test_generate_traffic(self):
+        traffic = generate_traffic(100, 10, {"user": 5}, start=50, seed=1)
+
+        self.assertEqual(traffic, generate_traffic(
+            100, 10, {"user": 5}, start=50, seed=1
+        ))
+        self.assertTrue(800 < len(traffic) < 1200)
+        self.assertTrue(all(50 <= ts < 60 for ts, _ in traffic))
+        self.assertEqual(
+            set(selectors["user"] for _, selectors in traffic),
+            set("user%d" % i for i in range(5))
+        )
+
+    def test_read_access_log(self):
+        traffic = read_access_log([
+            "# recorded",
+            "1500000000.25 user=vova ip=8.8.8.8",
+            "",
+            "1500000001 apikey=a=b",
+        ])
+
+        self.assertEqual(traffic, [
+            (1500000000.25, {"user": "vova", "ip": "8.8.8.8"}),
+            (1500000001, {"apikey": "a=b"}),
+        ])
+
+    def test_get_max_window_count(self):
+        self.assertEqual(get_max_window_count([0, 0.5, 0.9, 1, 1.5], 1), 3)
+        self.assertEqual(get_max_window_count([], 1), 0)
+
+    def test_exact_configuration(self):
+        traffic = generate_traffic(50, 20, {"user": 3}, seed=2)
+        simulator = Simulator(Or('user:5/s', '20/s'), traffic)
+
+        report, = simulator.compare([
+            ("locks", lambda **kwargs: MemoryRateLimit(**kwargs), 1),
+        ])
+
+        self.assertEqual(report["requests"], len(traffic))
+        self.assertEqual(report["admitted"], report["ideal_admitted"])
+        self.assertEqual(report["over_admitted"], 0)
+        self.assertEqual(report["error"], 0)
+        self.assertEqual(report["window_excess"], {"user:5/s": 0, "20/s": 0})
+        # lock, one or two lookups, a log if admitted and release
+        self.assertTrue(3 <= report["round_trips_per_decision"] <= 5)
+
+    def test_over_admissions_without_locks(self):
+        traffic = [(100 + i * 0.001, {}) for i in range(40)]
+        simulator = Simulator('5/s', traffic)
+
+        locks, no_locks = simulator.compare([
+            ("locks", lambda **kwargs: MemoryRateLimit(
+                interleave=True, **kwargs), 8),
+            ("no locks", lambda **kwargs: MemoryRateLimit(
+                interleave=True, disable_locks=True, **kwargs), 8),
+        ])
+
+        self.assertEqual(locks["admitted"], 5)
+        self.assertEqual(locks["window_excess"], {"5/s": 0})
+
+        self.assertEqual(no_locks["ideal_admitted"], 5)
+        self.assertEqual(no_locks["admitted"], 8)
+        self.assertEqual(no_locks["over_admitted"], 3)
+        self.assertEqual(no_locks["window_excess"], {"5/s": 3})
+        self.assertEqual(no_locks["round_trips_per_decision"], 1.2)
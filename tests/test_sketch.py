@@ -0,0 +1,145 @@
+from rate_limit import RateLimit, Or
+from rate_limit.sketch import CountMinSketch, get_sketch_identifier
+from rate_limit.memory import MemoryRateLimit
+from rate_limit.simulator import VirtualClock
+from rate_limit.rule import Rule
+from helpers import FakeRedis
+from tornado.testing import AsyncTestCase, gen_test
+from unittest import TestCase
+
+
+class CountMinSketchTestCase(TestCase):
+    def test_dimensions(self):
+        sketch = CountMinSketch('ip:100/m', error=0.01, confidence=0.99)
+
+        self.assertEqual(sketch.width, 272)
+        self.assertEqual(sketch.depth, 5)
+        self.assertEqual(sketch.describe()["counters_per_window"], 1360)
+
+    def test_max_counters(self):
+        sketch = CountMinSketch('ip:100/m', error=0.0001, max_counters=1000)
+
+        self.assertEqual(sketch.width, 200)
+        self.assertAlmostEqual(sketch.error, 0.0136, places=4)
+
+    def test_cells(self):
+        sketch = CountMinSketch(['ip:100/m'], error=0.01)
+        cells = sketch.get_cells("10.0.0.1")
+
+        self.assertEqual(cells, sketch.get_cells("10.0.0.1"))
+        self.assertNotEqual(cells, sketch.get_cells("10.0.0.2"))
+        self.assertEqual(len(cells), sketch.depth)
+
+        for row, cell in enumerate(cells):
+            self.assertEqual(cell // sketch.width, row)
+
+    def test_counts(self):
+        sketch = CountMinSketch(['ip:100/m', '1000/s'])
+
+        self.assertTrue(sketch.counts(Rule('ip:100/m')))
+        self.assertTrue(sketch.counts(Rule('1000/s')))
+        self.assertFalse(sketch.counts(Rule('ip:100/s')))
+
+    def test_only_request_count_rules(self):
+        for rule in ('ip:1MB/m', 'ip:conc=5', 'ip:10-100/s'):
+            with self.assertRaises(RuntimeError):
+                CountMinSketch(rule)
+
+    def test_get_sketch_identifier(self):
+        self.assertEqual(get_sketch_identifier("login", Rule('ip:100/m')),
+                         "cms:login:ip:100/m")
+
+
+class SketchRateLimitTestCase(AsyncTestCase):
+    @gen_test
+    def test_redis(self):
+        clock = VirtualClock(1000)
+        redis = FakeRedis()
+        rl = RateLimit(redis, namespace="ns", disable_locks=True, clock=clock)
+        rl.limit(Or('ip:3/10s', 'user:5/10s'), key="login",
+                 sketch=CountMinSketch('ip:3/10s', error=0.01))
+
+        res = []
+        for _ in range(4):
+            res.append((yield rl.limit(
+                key="login", ip="10.0.0.1", user="a"
+            ).request_limit_reached()))
+
+        self.assertEqual(res, [False, False, False, True])
+        self.assertEqual(redis.ttls["ns:cms:login:ip:3/10s:100"], 21)
+        self.assertEqual(sorted(redis.data["ns:cms:login:ip:3/10s:100"]
+                                .values()), ["3"] * 5)
+        self.assertIn("ns:login:user:a", redis.data)
+
+    @gen_test
+    def test_fixed_memory(self):
+        clock = VirtualClock(1000)
+        redis = FakeRedis()
+        rl = RateLimit(redis, disable_locks=True, clock=clock)
+        sketch = CountMinSketch('ip:1/10s', max_counters=100)
+        rl.limit('ip:1/10s', key="login", sketch=sketch)
+
+        for ip in range(1000):
+            yield rl.limit(key="login", ip=ip).request_limit_reached()
+
+        self.assertEqual(list(redis.data), ["cms:login:ip:1/10s:100"])
+        self.assertLessEqual(len(redis.data["cms:login:ip:1/10s:100"]), 100)
+
+    @gen_test
+    def test_errors_deny(self):
+        """
+        colliding values can only make estimates too high
+        """
+
+        clock = VirtualClock(1000)
+        rl = MemoryRateLimit(clock=clock)
+        rl.limit('ip:2/10s', key="k",
+                 sketch=CountMinSketch('ip:2/10s', max_counters=1))
+
+        res = []
+        for ip in ("a", "b", "c"):
+            limit = rl.limit(key="k", ip=ip)
+            res.append((yield limit.request_limit_reached()))
+
+        self.assertEqual(res, [False, False, True])
+
+    @gen_test
+    def test_memory_windows(self):
+        clock = VirtualClock(1000)
+        rl = MemoryRateLimit(clock=clock)
+        rl.limit('ip:4/10s', key="k", sketch=CountMinSketch('ip:4/10s'))
+
+        def decide():
+            return rl.limit(key="k", ip="a").request_limit_reached()
+
+        for _ in range(4):
+            self.assertFalse((yield decide()))
+
+        self.assertTrue((yield decide()))
+
+        # the whole previous window counts until it rolls over, even if
+        # its requests were at its very end
+        clock.set(1019)
+        self.assertTrue((yield decide()))
+
+        clock.set(1020)
+
+        for _ in range(4):
+            self.assertFalse((yield decide()))
+
+        self.assertTrue((yield decide()))
+
+        clock.set(1046)
+        self.assertFalse((yield decide()))
+
+        rl.purge()
+        self.assertEqual(list(rl.logs), ["cms:k:ip:4/10s:104"])
+
+    def test_check_many(self):
+        rl = RateLimit(FakeRedis(), disable_locks=True)
+        rl.limit('ip:1/s', key="k", sketch=CountMinSketch('ip:1/s'))
+
+        with self.assertRaises(RuntimeError):
+            self.io_loop.run_sync(
+                lambda: rl.check_many([(None, {"ip": "a"}, 1)], key="k")
+            )
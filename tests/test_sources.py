@@ -0,0 +1,162 @@
+from rate_limit.sources import FileRuleSource, RedisRuleSource, RuleReloader
+from rate_limit.memory import MemoryRateLimit
+from rate_limit.simulator import VirtualClock
+from rate_limit.grammer import And, dump_rules
+from rate_limit import RateLimitExceeded
+from helpers import FakeRedis
+from tornado.testing import AsyncTestCase, gen_test
+from mock import Mock
+import tempfile
+import shutil
+import json
+import os
+
+
+class FileRuleSourceTestCase(AsyncTestCase):
+    def setUp(self):
+        super(FileRuleSourceTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "rules.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(FileRuleSourceTestCase, self).tearDown()
+
+    def write(self, rules, mtime):
+        with open(self.path, "w") as output:
+            json.dump(rules, output)
+
+        os.utime(self.path, (mtime, mtime))
+
+    @gen_test
+    def test_load(self):
+        self.write({"k": {"and": ["user:5/s", "100/m"]}, "l": "1/s"}, 1000)
+        source = FileRuleSource(self.path)
+
+        version, rules = yield source.load()
+
+        self.assertEqual(version, 1000)
+        self.assertEqual((yield source.get_version()), 1000)
+        self.assertEqual(dump_rules(rules["k"]),
+                         {"and": ["user:5/s", "100/m"]})
+        self.assertEqual(rules["l"], "1/s")
+
+
+class RedisRuleSourceTestCase(AsyncTestCase):
+    @gen_test
+    def test_store_and_load(self):
+        redis = FakeRedis()
+        source = RedisRuleSource(redis, namespace="ns")
+
+        self.assertEqual((yield source.get_version()), 0)
+        self.assertEqual((yield source.store("k", And("5/s", "1/m"))), 1)
+        self.assertEqual((yield source.store("l", "1/s")), 2)
+
+        version, rules = yield source.load()
+
+        self.assertEqual(version, 2)
+        self.assertEqual(dump_rules(rules["k"]), {"and": ["5/s", "1/m"]})
+        self.assertEqual(rules["l"], "1/s")
+        self.assertEqual(redis.published[-1], ("ns:rules:version", "l"))
+
+
+class RuleReloaderTestCase(AsyncTestCase):
+    def setUp(self):
+        super(RuleReloaderTestCase, self).setUp()
+        self.source = RedisRuleSource(FakeRedis())
+        self.rl = MemoryRateLimit(clock=VirtualClock(100))
+
+    @gen_test
+    def test_hot_reload(self):
+        yield self.source.store("k", "2/s")
+
+        reloader = RuleReloader(self.rl, self.source)
+        yield reloader.reload()
+
+        limit = self.rl.limit(key="k")
+        res = []
+
+        for _ in range(2):
+            res.append((yield limit.request_limit_reached()))
+
+        self.assertEqual(res, [False, False])
+
+        # tightened during an incident
+        yield self.source.store("k", "1/s")
+        yield reloader.check()
+
+        self.assertEqual(limit.rules, "2/s")
+        self.assertTrue((yield limit.request_limit_reached()))
+        self.assertEqual(limit.rules, "1/s")
+
+    @gen_test
+    def test_unchanged_rules_keep_their_plans(self):
+        yield self.source.store("k", "2/s")
+        yield self.source.store("l", "2/s")
+
+        reloader = RuleReloader(self.rl, self.source)
+        yield reloader.reload()
+
+        plan = self.rl.get_plan("k")
+
+        yield self.source.store("l", "1/s")
+        self.assertEqual((yield reloader.reload()), ["l"])
+        self.assertIs(self.rl.get_plan("k"), plan)
+
+    @gen_test
+    def test_check_only_reloads_new_versions(self):
+        reloader = RuleReloader(self.rl, self.source)
+        reloader.reload = Mock(wraps=reloader.reload)
+
+        yield reloader.check()
+        yield reloader.check()
+
+        self.assertEqual(reloader.reload.call_count, 1)
+
+    @gen_test
+    def test_code_defined_rules_are_overridden(self):
+        self.rl.limit("5/s", key="k")
+        yield self.source.store("k", "1/s")
+
+        yield RuleReloader(self.rl, self.source).reload()
+
+        with (yield self.rl.limit(key="k").cm()):
+            pass
+
+        with self.assertRaises(RateLimitExceeded):
+            with (yield self.rl.limit(key="k").cm()):
+                pass
+
+    @gen_test
+    def test_deleted_keys_are_removed(self):
+        self.rl.limit("2/s", key="code")
+        yield self.source.store("code", "1/s")
+        yield self.source.store("k", "1/s")
+
+        reloader = RuleReloader(self.rl, self.source)
+        yield reloader.reload()
+
+        limit = self.rl.limit(key="k")
+        self.assertFalse((yield limit.request_limit_reached()))
+        self.assertTrue((yield limit.request_limit_reached()))
+
+        yield self.source.delete("code")
+        yield self.source.delete("k")
+        self.assertEqual(sorted((yield reloader.reload())), ["code", "k"])
+
+        # keys only defined by the source aren't limited anymore, keys
+        # defined in code get back their own rules
+        self.assertFalse((yield limit.request_limit_reached()))
+        self.assertFalse(
+            (yield self.rl.limit(key="k").request_limit_reached())
+        )
+        self.assertEqual(self.rl.get_plan("code").tree, "2/s")
+
+        res = yield self.rl.check_many([(None, {}, 1)] * 2, key="k")
+        self.assertEqual(res, [True, True])
+
+        # and are limited again once they are stored
+        yield self.source.store("k", "1/s")
+        yield reloader.reload()
+
+        self.assertTrue((yield limit.request_limit_reached()))
@@ -0,0 +1,143 @@
+from rate_limit.tenants import TenantRules, get_plan_key
+from rate_limit.sources import RedisRuleSource, RuleReloader
+from rate_limit.memory import MemoryRateLimit
+from rate_limit.simulator import VirtualClock
+from rate_limit.metrics import Metrics
+from rate_limit.grammer import And
+from rate_limit import RateLimitExceeded
+from helpers import FakeRedis
+from tornado.testing import AsyncTestCase, gen_test
+from unittest import TestCase
+
+
+class TenantRulesTestCase(TestCase):
+    def setUp(self):
+        self.tenants = TenantRules("apikey", tiers={
+            "free": "apikey:10/m",
+            "paid": And("apikey:100/m", "apikey:10/s"),
+        }, tenants={"a": "free", "b": "paid", "c": "paid"})
+
+    def test_get(self):
+        rules, plan = self.tenants.get("a")
+
+        self.assertEqual(rules, "apikey:10/m")
+        self.assertEqual(plan.tree, rules)
+        self.assertEqual(self.tenants.get("unknown"), None)
+
+    def test_tiers_share_plans(self):
+        metrics = Metrics()
+
+        self.assertIs(self.tenants.get("b", metrics)[1],
+                      self.tenants.get("c", metrics)[1])
+        self.assertEqual(metrics.get_counter(
+            "cache_requests_total", cache="tenant_plan", result="hit"
+        ), 1)
+
+    def test_custom_contract(self):
+        self.assertEqual(self.tenants.set_rules({"a": "apikey:5000/h"}),
+                         ["a"])
+        self.assertEqual(self.tenants.set_rules({"a": "apikey:5000/h"}), [])
+        self.assertEqual(self.tenants.get("a")[0], "apikey:5000/h")
+
+    def test_set_tier(self):
+        self.tenants.set_tier("paid", "apikey:1000/m")
+
+        self.assertEqual(self.tenants.get("b")[0], "apikey:1000/m")
+        self.assertEqual(self.tenants.get("a")[0], "apikey:10/m")
+
+    def test_remove(self):
+        self.tenants.remove("a")
+
+        self.assertEqual(self.tenants.get("a"), None)
+
+    def test_plans_lru(self):
+        tenants = TenantRules("apikey", capacity=2, tenants=dict(
+            ("t%d" % i, "apikey:%d/m" % (i + 1)) for i in range(3)
+        ))
+
+        first = tenants.get("t0")[1]
+        tenants.get("t1")
+        tenants.get("t0")
+        tenants.get("t2")
+
+        self.assertEqual(list(tenants.plans), [
+            get_plan_key("apikey:1/m"), get_plan_key("apikey:3/m")
+        ])
+        self.assertIs(tenants.get("t0")[1], first)
+        self.assertEqual(len(tenants.plans), 2)
+
+
+class TenantLimitTestCase(AsyncTestCase):
+    @gen_test
+    def test_limit_with_tenants(self):
+        rl = MemoryRateLimit(clock=VirtualClock(100))
+        tenants = TenantRules("apikey", tenants={"paid": "apikey:3/s"})
+        rl.limit("apikey:1/s", key="api", tenants=tenants)
+
+        res = {}
+
+        for apikey in ("free", "paid"):
+            limit = rl.limit(key="api", apikey=apikey)
+            res[apikey] = []
+
+            for _ in range(4):
+                res[apikey].append((yield limit.request_limit_reached()))
+
+        self.assertEqual(res, {
+            "free": [False, True, True, True],
+            "paid": [False, False, False, True],
+        })
+
+    @gen_test
+    def test_concurrent_tenants(self):
+        """
+        concurrent decisions of a decorator use their own tenant's rules
+        """
+
+        rl = MemoryRateLimit(clock=VirtualClock(100), interleave=True)
+        tenants = TenantRules("apikey", tenants={"paid": "apikey:3/s"})
+
+        class Client(object):
+            def __init__(self, apikey):
+                self.apikey = apikey
+
+            @rl.limit("apikey:1/s", key="api", tenants=tenants)
+            def call(self):
+                return self.apikey
+
+        yield Client("free").call()
+
+        free, paid = Client("free").call(), Client("paid").call()
+
+        with self.assertRaises(RateLimitExceeded):
+            yield free
+
+        self.assertEqual((yield paid), "paid")
+
+    @gen_test
+    def test_check_many(self):
+        """
+        batched items are evaluated against their tenant's rules too
+        """
+
+        rl = MemoryRateLimit(clock=VirtualClock(100))
+        tenants = TenantRules("apikey", tenants={"paid": "apikey:3/s"})
+        rl.limit("apikey:1/s", key="api", tenants=tenants)
+
+        res = yield rl.check_many(
+            [(None, {"apikey": "free"}, 1)] * 2 +
+            [(None, {"apikey": "paid"}, 1)] * 4,
+            key="api"
+        )
+
+        self.assertEqual(res, [True, False, True, True, True, False])
+
+    @gen_test
+    def test_tenants_from_redis(self):
+        source = RedisRuleSource(FakeRedis(), name="tenants")
+        tenants = TenantRules("apikey", tiers={"paid": "apikey:3/s"})
+
+        yield source.store("acme", "paid")
+        yield RuleReloader(tenants, source).reload()
+
+        self.assertEqual(tenants.get("acme")[0], "apikey:3/s")
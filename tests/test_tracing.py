@@ -0,0 +1,82 @@
+from rate_limit import RateLimit
+from rate_limit.memory import MemoryRateLimit
+from rate_limit.grammer import Or
+from rate_limit.tracing import Tracer, Span, NULL_SPAN
+from helpers import FakeRedis
+from tornado.testing import AsyncTestCase, gen_test
+from mock import patch
+
+
+class TracingTestCase(AsyncTestCase):
+    def test_span(self):
+        reported = []
+        tracer = Tracer(reporter=reported.append)
+
+        with tracer.trace("root", a=1) as span:
+            with span.child("child") as child:
+                child.set_tag("b", 2)
+
+        self.assertEqual(reported, [span])
+        self.assertEqual(span.to_dict()["children"][0]["tags"], {"b": 2})
+        self.assertTrue(span.duration >= child.duration)
+
+    def test_span_records_errors(self):
+        span = Span("root")
+
+        with self.assertRaises(ValueError):
+            with span:
+                raise ValueError
+
+        self.assertEqual(span.tags["error"], "ValueError")
+
+    def test_sampling(self):
+        tracer = Tracer(sample_rate=0.5)
+
+        with patch("random.random", return_value=0.7):
+            self.assertIs(tracer.trace("root"), NULL_SPAN)
+
+        with patch("random.random", return_value=0.2):
+            self.assertIsNot(tracer.trace("root"), NULL_SPAN)
+
+    @gen_test
+    def test_decision_spans(self):
+        reported = []
+        rl = RateLimit(FakeRedis(), disable_locks=True,
+                       tracer=Tracer(reporter=reported.append))
+        limit = rl.limit(Or('user:1/m', '5/s'), key="k", user="vova")
+
+        yield limit.request_limit_reached()
+        yield limit.request_limit_reached()
+
+        first, second = [span.to_dict() for span in reported]
+
+        self.assertEqual(first["tags"], {"key": "k", "reached": False})
+        self.assertEqual([child["name"] for child in first["children"]],
+                         ["lock", "rule", "rule", "log", "release"])
+
+        self.assertEqual(second["tags"]["reached"], True)
+        self.assertEqual(second["children"][1]["tags"], {
+            "rule": "user:1/m",
+            "identifier": "k:user:vova",
+            "reached": True,
+        })
+        self.assertEqual(len(second["children"]), 3)
+
+    @gen_test
+    def test_concurrent_decisions(self):
+        """
+        concurrent decisions of a Limit keep their rules in their own span
+        """
+
+        reported = []
+        rl = MemoryRateLimit(interleave=True,
+                             tracer=Tracer(reporter=reported.append))
+        limit = rl.limit('5/s', key="k")
+
+        yield [limit.request_limit_reached() for _ in range(2)]
+
+        for span in reported:
+            self.assertEqual(
+                [child["name"] for child in span.to_dict()["children"]],
+                ["lock", "rule", "log", "release"]
+            )
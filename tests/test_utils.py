@@ -1,4 +1,7 @@
-from rate_limit.utils import join_non_empty
+from rate_limit.utils import (
+    join_non_empty, get_window, get_sliding_estimate, encode_timestamp,
+    get_age, decode_timestamp, MIN_DELTA
+)
 import unittest
 
 
@@ -16,3 +19,58 @@ class JoinNonEmptyTestCase(unittest.TestCase):
         self.assertEqual(j(":", "", "hey", None, "ho"), "hey:ho")
         self.assertEqual(j(":", "hey", "ho", "lets"), "hey:ho:lets")
         self.assertEqual(j(":", 0, 1, 2), "0:1:2")
+
+
+class TimestampTestCase(unittest.TestCase):
+    base = 1700000000000 - MIN_DELTA
+
+    def test_milliseconds(self):
+        now = 1700000000.25
+        delta = encode_timestamp(now) - self.base
+
+        self.assertEqual(encode_timestamp(now), 1700000000250)
+        self.assertAlmostEqual(get_age(now + 0.1, self.base, delta), 0.1)
+        self.assertAlmostEqual(get_age(now + 59.999, self.base, delta),
+                               59.999)
+
+    def test_decode(self):
+        now = 1700000000.25
+        delta = encode_timestamp(now) - self.base
+
+        self.assertEqual(decode_timestamp(self.base, delta), now)
+        self.assertEqual(decode_timestamp(str(self.base), str(delta)), now)
+
+    def test_clock_skew(self):
+        delta = encode_timestamp(1700000000.05) - self.base
+
+        self.assertAlmostEqual(get_age(1700000000, self.base, delta), -0.05)
+
+    def test_old_entries(self):
+        """
+        entries of sparse lists can be older than their span
+        """
+
+        now = 1700000000.25
+        delta = encode_timestamp(now) - self.base
+
+        for days in (12.5, 16.7, 30):
+            self.assertAlmostEqual(
+                get_age(now + days * 24 * 60 * 60, self.base, delta),
+                days * 24 * 60 * 60
+            )
+
+
+class WindowTestCase(unittest.TestCase):
+    def test_get_window(self):
+        self.assertEqual(get_window(1005, 10), 100)
+        self.assertEqual(get_window(1009.9, 10), 100)
+        self.assertEqual(get_window(1010, 10), 101)
+
+    def test_get_sliding_estimate(self):
+        self.assertEqual(get_sliding_estimate(1, 10, 1002, 10), 9)
+        self.assertEqual(get_sliding_estimate(1, 10, 1000, 10), 11)
+
+        # a strict estimate counts the whole previous window
+        self.assertEqual(
+            get_sliding_estimate(1, 10, 1009, 10, strict=True), 11
+        )
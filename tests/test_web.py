@@ -0,0 +1,122 @@
+from rate_limit.memory import MemoryRateLimit
+from rate_limit.simulator import VirtualClock
+from rate_limit.web import RateLimitMixin, get_request_selector
+from rate_limit.priority import PriorityClasses
+from rate_limit import Or
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application, RequestHandler, stream_request_body
+from unittest import TestCase
+from mock import Mock
+
+
+class WebTestCase(AsyncHTTPTestCase):
+    def get_app(self):
+        self.rl = rl = MemoryRateLimit(clock=VirtualClock(1000))
+        rl.limit(Or('apikey:2/m', 'ip:conc=1'), key="api")
+        rl.limit('path:1/10s', key="UploadHandler")
+        rl.limit('apikey:4/m', key="bulk", priorities=PriorityClasses(
+            {"bulk": 0.5, "interactive": 1}, default="bulk"
+        ))
+        self.calls = calls = []
+
+        class ApiHandler(RateLimitMixin, RequestHandler):
+            rate_limit = rl
+            rate_limit_key = "api"
+            rate_limit_selectors = {"apikey": "header:X-Api-Key"}
+
+            def ip(self):
+                return "127.0.0.1"
+
+            def get(self):
+                calls.append("get")
+                self.write("ok")
+
+        class BulkHandler(ApiHandler):
+            rate_limit_key = "bulk"
+
+        @stream_request_body
+        class UploadHandler(RateLimitMixin, RequestHandler):
+            rate_limit = rl
+            rate_limit_selectors = {"path": "path:0"}
+
+            def data_received(self, chunk):
+                calls.append("data")
+
+            def put(self, path):
+                calls.append("put")
+
+        return Application([
+            (r"/api", ApiHandler),
+            (r"/bulk", BulkHandler),
+            (r"/upload/(.*)", UploadHandler),
+        ])
+
+    def test_reject(self):
+        for _ in range(2):
+            response = self.fetch("/api", headers={"X-Api-Key": "a"})
+            self.assertEqual(response.code, 200)
+
+        response = self.fetch("/api", headers={"X-Api-Key": "a"})
+
+        self.assertEqual(response.code, 429)
+        self.assertEqual(response.headers["Retry-After"], "60")
+        self.assertEqual(response.headers["X-RateLimit-Limit"], "2")
+        self.assertEqual(self.calls, ["get", "get"])
+
+        # other apikeys are limited on their own
+        response = self.fetch("/api", headers={"X-Api-Key": "b"})
+        self.assertEqual(response.code, 200)
+
+    def test_priority_limit(self):
+        """
+        the limit reported is the share of the request's class
+        """
+
+        for _ in range(2):
+            response = self.fetch("/bulk", headers={"X-Api-Key": "a"})
+            self.assertEqual(response.code, 200)
+
+        response = self.fetch("/bulk", headers={"X-Api-Key": "a"})
+
+        self.assertEqual(response.code, 429)
+        self.assertEqual(response.headers["X-RateLimit-Limit"], "2")
+
+    def test_slots_released(self):
+        for _ in range(3):
+            response = self.fetch("/api", headers={"X-Api-Key": "%s" % _})
+            self.assertEqual(response.code, 200)
+
+        self.assertEqual(self.rl.slots.get("conc:api:ip:127.0.0.1"), {})
+
+    def test_body_not_read(self):
+        response = self.fetch("/upload/a", method="PUT", body="x" * 1024)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(self.calls, ["data", "put"])
+
+        response = self.fetch("/upload/a", method="PUT", body="x" * 1024)
+        self.assertEqual(response.code, 429)
+        self.assertEqual(response.headers["Retry-After"], "10")
+        self.assertEqual(self.calls, ["data", "put"])
+
+
+class RequestSelectorTestCase(TestCase):
+    def test_sources(self):
+        handler = Mock(path_args=["a"], path_kwargs={"user": "u"})
+        handler.request.headers = {"X-Api-Key": "k"}
+        handler.request.remote_ip = "10.0.0.1"
+        handler.get_query_argument.side_effect = lambda name, default: name
+
+        def get(source):
+            return get_request_selector(handler, source)()
+
+        self.assertEqual(get("header:X-Api-Key"), "k")
+        self.assertEqual(get("header:Missing"), None)
+        self.assertEqual(get("path:0"), "a")
+        self.assertEqual(get("path:1"), None)
+        self.assertEqual(get("path:user"), "u")
+        self.assertEqual(get("query:q"), "q")
+        self.assertEqual(get("remote_ip"), "10.0.0.1")
+        self.assertEqual(get(lambda handler: handler.path_args[0]), "a")
+
+        with self.assertRaises(ValueError):
+            get("body:user")